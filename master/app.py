@@ -1,7 +1,9 @@
+import asyncio
 import gradio as gr
-from datetime import datetime
 
-from .rag_pipeline import ChatAssistant, get_embeddings, vretrieve, retrieve_chatbot_prompt, request_retrieve_prompt
+from .rag_pipeline import AsyncChatAssistant, get_embeddings, RetrievalCache, RetrievalRouter, SpeculativeRetriever, NO_NEED, get_context_packer, retrieve_chatbot_prompt, request_retrieve_prompt
+from .rag_pipeline.observability.log_writer import get_log_writer, RequestLog
+from .rag_pipeline.observability.tracing import enable_tracing, observe
 from .utils import load_local
 
 
@@ -20,9 +22,18 @@ AVAILABLE_MODELS = {
 DEFAULT_MODEL_KEY = "mistral medium (mistral)"
 
 EMBEDDING_MODEL_ID = "alibaba-nlp/gte-multilingual-base"
+EMBEDDING_BACKEND = "torch"  # "onnx" or "quantized" for faster CPU query embedding, see test/bench_embedding.py
 VECTORSTORE_PATH = "notebook/An/master/knowledge/vectorstore_full"
-LOG_FILE_PATH = "log.txt"
-MAX_HISTORY_CONVERSATION = 50
+VECTORSTORE_MMAP = True  # Memory-map the index and chunks, so workers start fast and share one copy of them
+SPECULATIVE_RETRIEVAL = True  # Retrieve the raw message while the LLM rewrites the query, see rag_pipeline/retrieval/speculative.py
+RETRIEVAL_PARAMS = {"k": 4, "metric": "mmr", "threshold": 0.7}
+LOG_FILE_PATH = "log.jsonl"  # Rotated past LOG_MAX_BYTES into log.jsonl.1 ... log.jsonl.<LOG_BACKUP_COUNT>
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Per-stage latency histograms (rewrite, embedding, FAISS search, reranking, time to first token...), not exported by default.
+TRACING_METRICS_PORT = None  # e.g. 9464: Prometheus text on http://127.0.0.1:9464/metrics, the p50/p95/p99 summary on /metrics.json
+TRACING_METRICS_PATH = None  # e.g. "metrics.prom" (Prometheus text) or "metrics.json" (summary), rewritten every 15 seconds
+MAX_HISTORY_CONVERSATION = 50  # Hard cap, the context packer then fits the history in the model's token budget
 
 # System prompt for the medical assistant
 sys = """
@@ -32,69 +43,100 @@ You must answer professionally and empathetically, taking into account the user'
 
 # --- Initial Setup (runs once) ---
 print("Initializing models and data...")
-embedding_model = get_embeddings(EMBEDDING_MODEL_ID, show_progress=False)
-vectorstore, docs = load_local(VECTORSTORE_PATH, embedding_model)
+embedding_model = get_embeddings(EMBEDDING_MODEL_ID, show_progress=False, backend=EMBEDDING_BACKEND)
+vectorstore, docs, bm25_index = load_local(VECTORSTORE_PATH, embedding_model, mmap=VECTORSTORE_MMAP)
+# Users repeat near-identical questions, so rewritten queries that embed close together share results.
+retrieval_cache = RetrievalCache(max_size=1024, ttl=3600, semantic_threshold=0.95)
+# Decides NO NEED / the search query locally for small talk, repeated and self-contained questions, see test/bench_router.py.
+retrieval_router = RetrievalRouter(max_size=4096)
+speculative_retriever = SpeculativeRetriever(retrieval_cache, reuse_threshold=0.9)
+# Load the tokenizer now rather than on the first message.
+get_context_packer(*AVAILABLE_MODELS[DEFAULT_MODEL_KEY])
+log_writer = get_log_writer(LOG_FILE_PATH, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT)
+if TRACING_METRICS_PORT is not None or TRACING_METRICS_PATH is not None:
+    enable_tracing(metrics_port=TRACING_METRICS_PORT, metrics_path=TRACING_METRICS_PATH)
 print("Initialization complete.")
 
 
-# --- Helper Functions ---
-def log(log_txt: str):
-    """Appends a log entry to the log file."""
-    with open(LOG_FILE_PATH, "a", encoding="utf-8") as log_file:
-        log_file.write(log_txt + "\n")
-
-
 # --- Core Chatbot Logic ---
-def chatbot_logic(message: str, history: list, selected_model_key: str):
+async def chatbot_logic(message: str, history: list, selected_model_key: str):
     """
     Handles the main logic for receiving a message, performing RAG, and generating a response.
     """
     # 1. Look up the model_id and model_provider from the selected key
     model_id, model_provider = AVAILABLE_MODELS[selected_model_key]
+    # One JSONL record per turn, queued for the writer thread once the turn ends.
+    request_log = RequestLog(log_writer, message=message, model=model_id, provider=model_provider)
 
-    log(f"** Current time **: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    log(f"** User message **: {message}")
-    log(f"** Using Model **: {model_id} ({model_provider})")
-
-    # Initialize the assistant with the specified model for this request
+    # Initialize the assistant with the specified model for this request (the client is shared per provider)
     try:
-        chat_assistant = ChatAssistant(model_id, model_provider)
+        chat_assistant = AsyncChatAssistant(model_id, model_provider)
     except Exception as e:
+        request_log.commit(error=f"{type(e).__name__}: {e}")
         yield f"Error: Could not initialize the model. Please check the ID and provider. Details: {e}"
         return
 
-    # --- RAG Pipeline ---
-    # 2. Format conversation history for context
-    history = history[-MAX_HISTORY_CONVERSATION:]
-    conversation = "".join(f"User: {user_msg}\nBot: {bot_msg}\n" for user_msg, bot_msg in history)
-    query_for_rag = conversation + f"User: {message}\nBot:"
-
-    # 3. Generate a search query from the conversation
-    rag_query = chat_assistant.get_response(request_retrieve_prompt.format(role="user", conversation=query_for_rag))
-    rag_query = rag_query[rag_query.lower().rfind("[") + 1: rag_query.rfind("]")]
-
-    # 4. Retrieve relevant documents if necessary
-    if "NO NEED" not in rag_query:
-        retrieve_results = vretrieve(rag_query, vectorstore, docs, k=4, metric="mmr", threshold=0.7)
-    else:
-        retrieve_results = []
-
-    retrieved_docs = "\n".join([f"Document {i+1}:\n" + doc.page_content for i, doc in enumerate(retrieve_results)])
-    log(f"** RAG query **: {rag_query}")
-    log(f"** Retrieved documents **:\n{retrieved_docs}")
-
-    # --- Final Response Generation ---
-    # 5. Create the final prompt with retrieved context
-    final_prompt = retrieve_chatbot_prompt.format(role="user", documents=retrieved_docs, conversation=query_for_rag)
-
-    # 6. Stream the response from the LLM
     response = ""
-    for token in chat_assistant.get_streaming_response(final_prompt, sys):
-        response += token
-        yield response
-    
-    log(f"** Bot response **: {response}")
-    log("=" * 50 + "\n\n")
+    try:
+        # --- RAG Pipeline ---
+        # 2. Format conversation history for context, within the model's token budget
+        history = history[-MAX_HISTORY_CONVERSATION:]
+        context_packer = get_context_packer(model_id, model_provider)
+        with request_log.stage("pack_history"):
+            query_for_rag = context_packer.pack_history(history, message)
+
+        # 3. Generate a search query from the conversation, with the LLM only when the router is unsure
+        async def rewrite_query():
+            with request_log.stage("rewrite"):
+                rag_query = await chat_assistant.get_response(request_retrieve_prompt.format(role="user", conversation=query_for_rag))
+            return rag_query[rag_query.lower().rfind("[") + 1: rag_query.rfind("]")]
+
+        retrieve_results = None
+        rag_query, route = retrieval_router.route(message, history)
+        if rag_query is None:
+            if SPECULATIVE_RETRIEVAL:
+                # The raw message is retrieved during the rewrite, its results are reused or merged.
+                with request_log.stage("rewrite_and_retrieve"):
+                    rag_query, retrieve_results = await speculative_retriever.retrieve(message, rewrite_query(), vectorstore, docs, bm25_index=bm25_index, **RETRIEVAL_PARAMS)
+            else:
+                rag_query = await rewrite_query()
+            retrieval_router.record(message, history, rag_query)
+
+        # 4. Retrieve relevant documents if necessary (unless the speculative retrieval already did)
+        if retrieve_results is None and NO_NEED not in rag_query:
+            # Retrieval is CPU-bound, run it off the event loop so other chats keep streaming.
+            with request_log.stage("retrieve"):
+                retrieve_results = await asyncio.to_thread(retrieval_cache.retrieve, rag_query, vectorstore, docs, bm25_index=bm25_index, **RETRIEVAL_PARAMS)
+        retrieve_results = retrieve_results or []
+
+        # 5. Create the final prompt: overlapping chunks merged, packed by relevance until the budget is reached
+        with request_log.stage("pack_prompt"):
+            final_prompt, packing = context_packer.pack_prompt(retrieve_chatbot_prompt, retrieve_results, query_for_rag, sys, role="user")
+        request_log.set(
+            route=route,
+            rag_query=rag_query,
+            previous_turn=list(history[-1]) if history else None,  # Lets test/bench_router.py replay the routing context.
+            documents=[{"id": doc.id, "source": doc.metadata.get("source"), "text": doc.page_content} for doc in retrieve_results],
+            packing=packing,
+        )
+
+        # --- Final Response Generation ---
+        # 6. Stream the response from the LLM
+        with request_log.stage("generate"):
+            async for token in chat_assistant.get_streaming_response(final_prompt, sys):
+                if not response:
+                    request_log.mark("first_token")
+                response += token
+                yield response
+    except Exception as e:
+        request_log.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        # Also reached when the user stops the stream. Only queues the record.
+        request_log.commit(response=response, retrieval_cache=retrieval_cache.stats(), speculative_retrieval=speculative_retriever.stats())
+        # The turn's stages as histograms too (chatbot.rewrite, chatbot.first_token, chatbot.total...), when tracing is enabled.
+        for stage, seconds in request_log.timings.items():
+            observe(f"chatbot.{stage}", seconds)
 
 # --- UI Helper Function ---
 def start_new_chat():
@@ -104,7 +146,7 @@ def start_new_chat():
 # --- Gradio UI ---
 with gr.Blocks(theme="soft") as chatbot_ui:
     gr.Markdown("# MedLLM")
-    gr.Markdown("Your conversations are automatically saved to `log.txt` for future reference.")
+    gr.Markdown("Your conversations are automatically saved to `log.jsonl` for future reference.")
     
     model_selector = gr.Dropdown(
         label="Select Model",
@@ -122,13 +164,15 @@ with gr.Blocks(theme="soft") as chatbot_ui:
             scale=7 # Make the textbox take more space in the row
         )
 
-    def respond(message, chat_history, selected_model_key):
+    async def respond(message, chat_history, selected_model_key):
         """Wrapper function to connect chatbot_logic with Gradio's state."""
         # If chat_history is None (cleared), initialize it as an empty list
         chat_history = chat_history or []
-        bot_message_stream = chatbot_logic(message, chat_history, selected_model_key)
+        # A copy: chatbot_logic only starts on the first iteration, after the current message is appended below,
+        # and must see the previous turns only (the router, the packer and the log rely on history[-1]).
+        bot_message_stream = chatbot_logic(message, list(chat_history), selected_model_key)
         chat_history.append([message, ""])
-        for token in bot_message_stream:
+        async for token in bot_message_stream:
             chat_history[-1][1] = token
             yield chat_history
 
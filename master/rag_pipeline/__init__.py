@@ -1,8 +1,14 @@
-from .generation.llm_wrapper import ChatAssistant
+from .generation.llm_wrapper import ChatAssistant, AsyncChatAssistant
+from .generation.context_packer import ContextPacker, get_context_packer
 from .indexing.chunking.recursive import split_document as recursive_chunking
 from .indexing.chunking.markdown import split_document as markdown_chunking
 from .indexing.embedding.embedding import get_embeddings
+from .indexing.embedding.cache import CachedEmbeddings
 from .data_ingest.loader import load_data
 from .generation.prompt_template import *
 from .retrieval.vector_retriever import retrieve as vretrieve
-from .retrieval.reranker import rerank
\ No newline at end of file
+from .retrieval.vector_retriever import retrieve_batch as vretrieve_batch
+from .retrieval.reranker import rerank
+from .retrieval.cache import RetrievalCache
+from .retrieval.router import RetrievalRouter, NO_NEED
+from .retrieval.speculative import SpeculativeRetriever
\ No newline at end of file
@@ -1,40 +1,95 @@
 import os
-from typing import List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List, Tuple
 from langchain.schema import Document
 
-def load_data(data_path: str, file_type: str) -> List[Document]:
+SUPPORTED_FILE_TYPES = ["txt"]
+
+def load_data(data_path: str, file_type: str, max_workers: int = 8) -> List[Document]:
     """
     Load knowledge data from a specified path and file type.
     Args:
         data_path: The path to the data.
         file_type: The type of the data.
+        max_workers: The number of threads reading files.
     Returns:
         A list of documents.
     """
-    if file_type == "pdf":
-        raise NotImplementedError("PDF loading is not yet implemented.")
-    elif file_type == "txt":
-        return _load_txt(data_path)
+    return list(iter_data(data_path, file_type, max_workers))
 
-def _load_txt(data_path: str) -> List[Document]:
-    splits = []
+def iter_data(data_path: str, file_type: str, max_workers: int = 8) -> Iterator[Document]:
+    """
+    Stream knowledge data from a specified path and file type, recursing into subdirectories.
+    Args:
+        data_path: The path to the data.
+        file_type: The type of the data.
+        max_workers: The number of threads reading files.
+    Returns:
+        A generator of documents, in file path order.
+    """
+    for _, document in iter_files(list_files(data_path, file_type), max_workers):
+        yield document
 
+def list_files(data_path: str, file_type: str) -> List[str]:
+    """
+    List the source files of a data path, recursing into subdirectories.
+    Args:
+        data_path: The path to the data.
+        file_type: The type of the data.
+    Returns:
+        The sorted file paths.
+    """
+    if file_type == "pdf":
+        raise NotImplementedError("PDF loading is not yet implemented.")
+    if file_type not in SUPPORTED_FILE_TYPES:
+        raise ValueError(f"Unsupported file type: '{file_type}'. Supported file types are {SUPPORTED_FILE_TYPES}.")
     if not os.path.isdir(data_path):
         raise FileNotFoundError(f"Error: Directory not found at {data_path}")
 
-    for file_name in os.listdir(data_path):
-        if file_name.endswith('.txt'):
-            file_path = os.path.join(data_path, file_name)
-            
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                metadata = {"source": file_name}
-                doc = Document(page_content=content, metadata=metadata)
-                
-                splits.append(doc)
-
-            except Exception as e:
-                print(f"Error reading file {file_path}: {e}")
-                
-    return splits
+    file_paths = []
+    for dir_path, _, file_names in os.walk(data_path):
+        file_paths.extend(os.path.join(dir_path, file_name) for file_name in file_names if file_name.endswith(f".{file_type}"))
+    return sorted(file_paths)
+
+def load_file(file_path: str) -> Document:
+    """
+    Load one text file as a document.
+    Args:
+        file_path: The path to the file.
+    Returns:
+        The document, with the file name as source.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    metadata = {"source": os.path.basename(file_path)}
+    return Document(page_content=content, metadata=metadata)
+
+def iter_files(file_paths: Iterable[str], max_workers: int = 8, prefetch: int = None) -> Iterator[Tuple[str, Document]]:
+    """
+    Read files with a thread pool and yield them in order as they become available.
+    At most `prefetch` files are read ahead of the consumer, so memory stays bounded.
+    Files that cannot be read are reported and skipped.
+    Args:
+        file_paths: The files to read.
+        max_workers: The number of threads reading files.
+        prefetch: The number of files read ahead. Defaults to 4 * max_workers.
+    Returns:
+        A generator of (file path, document).
+    """
+    prefetch = prefetch or 4 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="loader") as executor:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append((file_path, executor.submit(load_file, file_path)))
+            if len(pending) >= prefetch:
+                yield from _pop_loaded(pending)
+        while pending:
+            yield from _pop_loaded(pending)
+
+def _pop_loaded(pending: deque) -> Iterator[Tuple[str, Document]]:
+    file_path, future = pending.popleft()
+    try:
+        yield file_path, future.result()
+    except Exception as e:
+        print(f"Error reading file {file_path}: {e}")
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Tuple
+
+MANIFEST_NAME = "manifest.json"
+
+def load_manifest(vectorstore_dir: str) -> Dict[str, dict]:
+    """
+    Load the ingest manifest: source file -> {"mtime", "size", "sha1", "chunk_ids"}.
+    Args:
+        vectorstore_dir: The directory of the vectorstore.
+    Returns:
+        The manifest, empty if there is none yet.
+    """
+    manifest_path = os.path.join(vectorstore_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(vectorstore_dir: str, manifest: Dict[str, dict]) -> None:
+    """
+    Save the ingest manifest next to the vectorstore.
+    Args:
+        vectorstore_dir: The directory of the vectorstore.
+        manifest: The manifest to save.
+    """
+    os.makedirs(vectorstore_dir, exist_ok=True)
+    tmp_path = os.path.join(vectorstore_dir, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, os.path.join(vectorstore_dir, MANIFEST_NAME))
+
+def file_sha1(file_path: str) -> str:
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def file_entry(file_path: str, chunk_ids: List[str], sha1: str = None) -> dict:
+    """
+    Build the manifest entry of a source file.
+    Args:
+        file_path: The source file.
+        chunk_ids: The ids of the chunks of the file in the vectorstore.
+        sha1: The content hash, computed if not given.
+    Returns:
+        The manifest entry.
+    """
+    stat = os.stat(file_path)
+    return {
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "sha1": sha1 or file_sha1(file_path),
+        "chunk_ids": chunk_ids,
+    }
+
+def chunk_ids(file_path: str, num_chunks: int) -> List[str]:
+    """
+    Deterministic ids of the chunks of a source file.
+    Args:
+        file_path: The source file.
+        num_chunks: The number of chunks.
+    Returns:
+        The chunk ids.
+    """
+    prefix = hashlib.sha1(file_path.encode("utf-8")).hexdigest()[:16]
+    return [f"{prefix}-{i}" for i in range(num_chunks)]
+
+def diff_manifest(manifest: Dict[str, dict], file_paths: List[str]) -> Tuple[List[str], List[str], List[str], Dict[str, str]]:
+    """
+    Compare the current source files with the manifest.
+    Files whose mtime and size are unchanged are not hashed.
+    Args:
+        manifest: The manifest of the last ingest.
+        file_paths: The current source files.
+    Returns:
+        Tuple: (added, modified, deleted, hashes)\\
+        added: Files not in the manifest.\\
+        modified: Files whose content changed.\\
+        deleted: Files in the manifest that no longer exist.\\
+        hashes: The content hash of every file that had to be hashed.
+    """
+    added, modified, hashes = [], [], {}
+    for file_path in file_paths:
+        entry = manifest.get(file_path)
+        if entry is None:
+            added.append(file_path)
+            continue
+        stat = os.stat(file_path)
+        if stat.st_mtime == entry["mtime"] and stat.st_size == entry["size"]:
+            continue
+        hashes[file_path] = file_sha1(file_path)
+        if hashes[file_path] != entry["sha1"]:
+            modified.append(file_path)
+        else:
+            # Touched but identical, only refresh the stat fields.
+            entry["mtime"], entry["size"] = stat.st_mtime, stat.st_size
+
+    current = set(file_paths)
+    deleted = [file_path for file_path in manifest if file_path not in current]
+    return added, modified, deleted, hashes
@@ -0,0 +1,159 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterator, List, Tuple
+
+from langchain.schema import Document
+from langchain_core.embeddings import Embeddings
+
+from .loader import iter_files
+
+_DONE = object()
+
+class _Aborted(Exception):
+    pass
+
+class StageStats:
+    """Counters of one pipeline stage. Busy time is the wall time minus the time spent waiting on queues."""
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.wait = 0.0
+        self.wall = 0.0
+
+    @property
+    def busy(self) -> float:
+        return max(self.wall - self.wait, 0.0)
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.busy if self.busy > 0 else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.name:<6} {self.items:>9} {self.unit:<6} busy {self.busy:8.1f}s  wall {self.wall:8.1f}s  {self.throughput:10.1f} {self.unit}/s"
+
+# Queue operations poll so that every stage stops shortly after any other stage failed.
+def _get_all(q: queue.Queue, stats: StageStats, errors: list) -> Iterator:
+    while True:
+        begin = time.perf_counter()
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            if errors:
+                raise _Aborted()
+            continue
+        finally:
+            stats.wait += time.perf_counter() - begin
+        if item is _DONE:
+            return
+        yield item
+
+def _put(q: queue.Queue, item, stats: StageStats, errors: list) -> None:
+    begin = time.perf_counter()
+    try:
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if errors:
+                    raise _Aborted()
+    finally:
+        stats.wait += time.perf_counter() - begin
+
+def _run_stage(stats: StageStats, produce: Callable[[], Iterator[Tuple[object, int]]], output: queue.Queue, errors: list) -> None:
+    """Put every (result, count) produced by `produce` on `output`. Always ends `output` with _DONE."""
+    start = time.perf_counter()
+    try:
+        for result, count in produce():
+            stats.items += count
+            if output is not None:
+                _put(output, result, stats, errors)
+    except _Aborted:
+        pass
+    except Exception as e:
+        errors.append(e)
+    finally:
+        stats.wall = time.perf_counter() - start
+        if output is not None:
+            try:
+                _put(output, _DONE, stats, errors)
+            except _Aborted:
+                pass
+
+def run_ingest_pipeline(file_paths: List[str],
+                        chunk_files: Callable[[List[Tuple[str, Document]]], List[Document]],
+                        embed_model: Embeddings,
+                        write: Callable[[List[Document], List[List[float]]], None],
+                        batch_size: int = 512,
+                        group_size: int = 64,
+                        queue_size: int = 4,
+                        load_workers: int = 8) -> List[StageStats]:
+    """
+    Ingest files through a streaming pipeline: load -> chunk -> embed -> write.
+    Each stage runs on its own thread and the stages are connected by bounded queues,
+    so only a few file groups / chunk batches are in flight at any time.
+    Args:
+        file_paths: The files to ingest.
+        chunk_files: Turns a group of (file path, document) into chunks.
+        embed_model: The embedding model.
+        write: Adds a batch of chunks and their vectors to the vectorstore.
+        batch_size: The number of chunks per embedding batch.
+        group_size: The number of files per chunking group.
+        queue_size: The maximum number of groups/batches waiting between two stages.
+        load_workers: The number of threads reading files.
+    Returns:
+        The stats of each stage.
+    """
+    loaded, chunked, embedded = (queue.Queue(maxsize=queue_size) for _ in range(3))
+    load_stats, chunk_stats, embed_stats, write_stats = stats = [
+        StageStats("load", "files"), StageStats("chunk", "chunks"), StageStats("embed", "chunks"), StageStats("write", "chunks"),
+    ]
+    errors = []
+
+    def load():
+        group = []
+        for file in iter_files(file_paths, max_workers=load_workers):
+            group.append(file)
+            if len(group) >= group_size:
+                yield group, len(group)
+                group = []
+        if group:
+            yield group, len(group)
+
+    def chunk():
+        # Regroup the chunks of each file group into fixed-size batches for the embedder.
+        pending = []
+        for group in _get_all(loaded, chunk_stats, errors):
+            pending.extend(chunk_files(group))
+            while len(pending) >= batch_size:
+                yield pending[:batch_size], batch_size
+                del pending[:batch_size]
+        if pending:
+            yield pending, len(pending)
+
+    def embed():
+        for batch in _get_all(chunked, embed_stats, errors):
+            vectors = embed_model.embed_documents([doc.page_content for doc in batch])
+            yield (batch, vectors), len(batch)
+
+    def write_all():
+        for batch, vectors in _get_all(embedded, write_stats, errors):
+            write(batch, vectors)
+            yield None, len(batch)
+
+    threads = [
+        threading.Thread(target=_run_stage, args=(load_stats, load, loaded, errors), name="ingest-load"),
+        threading.Thread(target=_run_stage, args=(chunk_stats, chunk, chunked, errors), name="ingest-chunk"),
+        threading.Thread(target=_run_stage, args=(embed_stats, embed, embedded, errors), name="ingest-embed"),
+        threading.Thread(target=_run_stage, args=(write_stats, write_all, None, errors), name="ingest-write"),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return stats
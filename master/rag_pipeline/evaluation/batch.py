@@ -0,0 +1,97 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+from ..generation.llm_wrapper import _messages
+from ..generation.response_cache import ResponseCache, make_key
+
+BATCH_FORMATS = ["openai", "mistral"]
+
+def batch_request(custom_id: str, model_name: str, user: str, sys: str = "", sampling_params: Optional[dict] = None, format: str = "openai") -> dict:
+    """
+    One line of a batch input file. OpenAI lines carry the endpoint and model,
+    Mistral lines only the body (the model and endpoint are given when the job is created).
+    """
+    body = {"messages": _messages(user, sys), **(sampling_params or {})}
+    if format == "openai":
+        return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": {"model": model_name, **body}}
+    if format == "mistral":
+        return {"custom_id": custom_id, "body": body}
+    raise ValueError(f"Unknown batch format {format}, expected one of {BATCH_FORMATS}.")
+
+def write_batch_file(requests: List[dict], path: str, model_name: str, sampling_params: Optional[dict] = None, format: str = "openai") -> int:
+    """
+    Write chat completion requests in the batch-file JSONL format of OpenAI or Mistral.
+    Args:
+        requests: {"custom_id", "user", "sys"} per request, custom ids being unique.
+        path: The batch input file.
+        model_name: The model to query.
+        sampling_params: Extra arguments of the completion requests (temperature, max_tokens...).
+        format: "openai" or "mistral".
+    Returns:
+        The number of requests written.
+    """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for request in requests:
+            line = batch_request(request["custom_id"], model_name, request["user"], request.get("sys", ""), sampling_params, format)
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return len(requests)
+
+def uncached_requests(requests: List[dict], cache: ResponseCache, provider: str, model_name: str, sampling_params: Optional[dict] = None) -> List[dict]:
+    """The requests (see write_batch_file) without a cached response, so a batch does not pay for them again."""
+    return [request for request in requests if make_key(provider, model_name, request.get("sys", ""), request["user"], sampling_params) not in cache]
+
+def _read_jsonl(path: str) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def read_batch_results(path: str) -> Dict[str, dict]:
+    """
+    Returns:
+        The chat completion body of every successful request of a batch output file, by custom id.
+        OpenAI and Mistral output files share the {"custom_id", "response": {"status_code", "body"}, "error"} layout.
+    """
+    results = {}
+    for line in _read_jsonl(path):
+        response = line.get("response") or {}
+        if line.get("error") or response.get("status_code", 200) != 200 or not response.get("body"):
+            continue
+        results[line["custom_id"]] = response["body"]
+    return results
+
+def ingest_batch_results(requests_path: str, results_path: str, cache: ResponseCache, provider: str, model_name: Optional[str] = None) -> dict:
+    """
+    Store the responses of a finished batch job in the response cache, under the key a live request would use,
+    so the evaluation run that follows reads them instead of calling the provider.
+    Args:
+        requests_path: The batch input file written by write_batch_file.
+        results_path: The batch output file downloaded from the provider.
+        cache: The response cache of the evaluation.
+        provider: The provider the batch ran on.
+        model_name: The model of the requests, required for Mistral files (their lines have no model).
+    Returns:
+        {"ingested", "failed", "missing"}: the requests answered, those answered with an error
+        and those absent from the results (sent live by the next run).
+    """
+    results = read_batch_results(results_path)
+    answered = {line["custom_id"] for line in _read_jsonl(results_path)}
+    counts = {"ingested": 0, "failed": 0, "missing": 0}
+    for request in _read_jsonl(requests_path):
+        body = dict(request["body"])
+        messages = body.pop("messages")
+        model = body.pop("model", None) or model_name
+        if model is None:
+            raise ValueError(f"{requests_path} has no model, pass model_name.")
+        if request["custom_id"] not in results:
+            counts["failed" if request["custom_id"] in answered else "missing"] += 1
+            continue
+        response = results[request["custom_id"]]
+        usage = response.get("usage")
+        if usage:
+            usage = {name: usage.get(name) for name in ("prompt_tokens", "completion_tokens", "total_tokens")}
+        sys, user = messages[0]["content"], messages[1]["content"]
+        cache.put(make_key(provider, model, sys, user, body), provider, model, response["choices"][0]["message"]["content"], usage)
+        counts["ingested"] += 1
+    return counts
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import numpy as np
+
+def load_results(results_path: str) -> Dict[str, dict]:
+    """
+    Load the records of a results file, keyed by question id. A truncated last line (crash mid-write) is ignored.
+    """
+    records = {}
+    if not os.path.exists(results_path):
+        return records
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["id"]] = record
+    return records
+
+def fingerprint(*parts) -> str:
+    """
+    A short hash of what determines an item's result, stored as the item's "fingerprint" (see completed_records).
+    Pass the prompt (which holds the retrieved documents), the provider, the model and the sampling params, so that
+    a run with another config re-runs the items instead of resuming with the previous config's records.
+    """
+    return hashlib.blake2b(json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8"), digest_size=8).hexdigest()
+
+def completed_records(items: List[dict], results_path: str) -> Dict[str, dict]:
+    """
+    Returns:
+        The records of `results_path` that are still valid for `items`: an item with a "fingerprint" only counts
+        as done if its record has the same one, so changing the prompt or the model re-runs it instead of resuming.
+    """
+    records = load_results(results_path)
+    fingerprints = {item["id"]: item.get("fingerprint") for item in items}
+    return {item_id: record for item_id, record in records.items() if record.get("fingerprint") == fingerprints.get(item_id)}
+
+def pending_items(items: List[dict], results_path: str, resume: bool = True) -> Tuple[Dict[str, dict], List[dict]]:
+    """
+    Returns:
+        The records already in `results_path` and the items not evaluated yet.
+        If `resume` is False, the results file is started over.
+    """
+    if os.path.dirname(results_path):
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    if not resume and os.path.exists(results_path):
+        os.remove(results_path)
+    stored = len(load_results(results_path))
+    records = completed_records(items, results_path)
+    pending = [item for item in items if item["id"] not in records]
+    if stored:
+        print(f"Resuming from {results_path}: {len(items) - len(pending)} of {len(items)} items already done.")
+    if stored > len(records):
+        print(f"Warning: {stored - len(records)} records of {results_path} were produced with another prompt or config, re-running their items.")
+    return records, pending
+
+_write_lock = threading.Lock()
+
+def _append_record(results_path: str, record: dict) -> None:
+    with _write_lock, open(results_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def _completed(items: List[dict], records: Dict[str, dict]) -> List[dict]:
+    failed = sum(1 for item in items if item["id"] not in records)
+    if failed:
+        print(f"{failed} items failed, run again to retry them.")
+    return [records[item["id"]] for item in items if item["id"] in records]
+
+async def run_eval_async(items: List[dict], process: Callable[[dict], Awaitable[dict]], results_path: str, concurrency: int = 64, resume: bool = True) -> List[dict]:
+    """
+    Evaluate items on one event loop, appending one JSON record per item to `results_path` as soon as it completes.
+    Items whose id is already in the file (with the same "fingerprint", if the items have one) are skipped,
+    so a crashed run picks up where it stopped.
+    Items whose `process` raises are reported and left out of the file, so the next run retries them.
+    Args:
+        items: The items to evaluate, each with a unique "id".
+        process: A coroutine function evaluating one item and returning its record (response, prediction, correct, usage, ...).
+        results_path: The JSONL results file.
+        concurrency: The number of items in flight at once, without a thread per request.
+        resume: Skip the items already in the results file. If False, the file is started over.
+    Returns:
+        The records of the completed items, in the order of `items`.
+    """
+    from tqdm import tqdm
+
+    records, pending = pending_items(items, results_path, resume)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(item: dict) -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                record = await process(item)
+            except Exception as e:
+                print(f"Error on item {item['id']}: {e}")
+                return None
+        record = {"id": item["id"], **record, "latency": time.perf_counter() - start, "fingerprint": item.get("fingerprint")}
+        _append_record(results_path, record)
+        return record
+
+    with tqdm(total=len(pending)) as progress:
+        for next_record in asyncio.as_completed([run_one(item) for item in pending]):
+            record = await next_record
+            progress.update()
+            if record is not None:
+                records[record["id"]] = record
+    return _completed(items, records)
+
+def summarize_results(records: List[dict], num_total: int = None) -> dict:
+    """
+    Args:
+        records: The records of the completed items.
+        num_total: The number of items of the run. The failed items (no record) count as wrong in "accuracy",
+            "accuracy_completed" is over the completed items only.
+    Returns:
+        The number of items, records and failed items, the accuracy (if records have "correct"),
+        latency mean/p50/p95 in seconds, token totals and the number of responses served from the response cache.
+    """
+    num_total = len(records) if num_total is None else num_total
+    summary = {"num_total": num_total, "num_items": len(records), "num_failed": num_total - len(records)}
+    if not records:
+        return summary
+    scored = [record["correct"] for record in records if "correct" in record]
+    if scored:
+        summary["accuracy"] = sum(scored) / (len(scored) + summary["num_failed"])
+        summary["accuracy_completed"] = sum(scored) / len(scored)
+    latencies = [record["latency"] for record in records if "latency" in record]
+    if latencies:
+        summary["latency_mean"] = float(np.mean(latencies))
+        summary["latency_p50"] = float(np.percentile(latencies, 50))
+        summary["latency_p95"] = float(np.percentile(latencies, 95))
+    usages = [record["usage"] for record in records if record.get("usage")]
+    for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        summary[field] = sum(usage.get(field) or 0 for usage in usages)
+    summary["cached"] = sum(1 for usage in usages if usage.get("cached"))
+    return summary
+
+def format_summary(summary: dict) -> str:
+    return "\n".join(f"{name:>18}: {value:.4f}" if isinstance(value, float) else f"{name:>18}: {value}" for name, value in summary.items())
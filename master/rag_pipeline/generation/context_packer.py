@@ -0,0 +1,236 @@
+import functools
+import threading
+from typing import List, Optional, Tuple
+
+from langchain.schema import Document
+
+# Prompt budget (tokens, completion excluded) per model. Ollama truncates prompts beyond its num_ctx (4096 by default),
+# the hosted models get a budget well under their context to keep the per-turn cost down.
+_context_budgets_ = {
+    "mistral-large-2": 12000,
+    "mistral-medium": 12000,
+    "mistral-small": 8000,
+    "llama3:8b": 3072,
+    "llama3.1:8b": 3072,
+    "gpt-oss-20b": 3072,
+    "gemma3:12b": 3072,
+    "gpt-4o-mini": 12000,
+    "gpt-4o": 12000,
+}
+DEFAULT_CONTEXT_BUDGET = 3072
+
+# Local tokenizer per provider: "tiktoken:<encoding>" or a Hugging Face tokenizer. The multilingual embedding model's
+# SentencePiece tokenizer stands in for the Mistral/Llama/Gemma ones, which are gated, and counts Vietnamese similarly.
+_tokenizers_ = {
+    "openai": "tiktoken:o200k_base",
+    "mistral": "alibaba-nlp/gte-multilingual-base",
+    "ollama": "alibaba-nlp/gte-multilingual-base",
+}
+CHARS_PER_TOKEN = 3  # Fallback when no tokenizer can be loaded, on the safe side for Vietnamese.
+MIN_OVERLAP_CHARS = 64  # Chunks sharing at least this many characters at their ends are merged (chunk_overlap is 512).
+
+class TokenCounter:
+    """Token counts with a local tokenizer, memoized. Falls back to CHARS_PER_TOKEN if the tokenizer cannot be loaded."""
+    def __init__(self, tokenizer_name: Optional[str] = None):
+        """
+        Args:
+            tokenizer_name: "tiktoken:<encoding>", a Hugging Face tokenizer name, or None for the character estimate.
+        """
+        self.tokenizer_name = tokenizer_name
+        self._encode = None
+        if tokenizer_name is not None:
+            try:
+                self._encode = self._load(tokenizer_name)
+            except Exception as e:
+                print(f"Warning: Could not load the tokenizer {tokenizer_name} ({e}), estimating {CHARS_PER_TOKEN} characters per token.")
+        self.count = functools.lru_cache(maxsize=16384)(self._count)
+
+    @staticmethod
+    def _load(tokenizer_name: str):
+        if tokenizer_name.startswith("tiktoken:"):
+            import tiktoken
+            encoding = tiktoken.get_encoding(tokenizer_name.split(":", 1)[1])
+            return lambda text: encoding.encode(text, disallowed_special=())
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        tokenizer.model_max_length = 10 ** 9  # Counting only, silence the sequence length warning.
+        return lambda text: tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def _count(self, text: str) -> int:
+        if self._encode is None:
+            return -(-len(text) // CHARS_PER_TOKEN)
+        return len(self._encode(text))
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+def get_token_counter(tokenizer_name: Optional[str]) -> TokenCounter:
+    """Get the counter of a tokenizer, loaded once and shared by every packer."""
+    with _counters_lock:
+        if tokenizer_name not in _counters:
+            _counters[tokenizer_name] = TokenCounter(tokenizer_name)
+        return _counters[tokenizer_name]
+
+def _overlap(left: str, right: str) -> int:
+    """The length of the longest suffix of `left` that is a prefix of `right`, if at least MIN_OVERLAP_CHARS."""
+    start = left.find(right[:MIN_OVERLAP_CHARS], max(0, len(left) - len(right)))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(right[:MIN_OVERLAP_CHARS], start + 1)
+    return 0
+
+def deduplicate(documents: List[Document]) -> Tuple[List[Document], int]:
+    """
+    Merge the chunks that overlap (consecutive chunks of one section share chunk_overlap characters) and drop
+    the chunks contained in another one. The merged chunk takes the place of the most relevant of its parts.
+    Returns:
+        The deduplicated documents, in relevance order, and the number of chunks merged or dropped.
+    """
+    kept, removed = [], 0
+    for doc in documents:
+        text = doc.page_content
+        for i, other in enumerate(kept):
+            if text in other.page_content:
+                break
+            if other.page_content in text:
+                kept[i] = Document(id=doc.id, page_content=text, metadata=doc.metadata)
+                break
+            if len(text) < MIN_OVERLAP_CHARS or len(other.page_content) < MIN_OVERLAP_CHARS:
+                continue
+            overlap = _overlap(other.page_content, text)
+            if overlap:
+                kept[i] = Document(id=other.id, page_content=other.page_content + text[overlap:], metadata=other.metadata)
+                break
+            overlap = _overlap(text, other.page_content)
+            if overlap:
+                kept[i] = Document(id=other.id, page_content=text + other.page_content[overlap:], metadata=other.metadata)
+                break
+        else:
+            kept.append(doc)
+            continue
+        removed += 1
+    return kept, removed
+
+def format_documents(documents: List[Document]) -> str:
+    return "\n".join(f"Document {i+1}:\n" + doc.page_content for i, doc in enumerate(documents))
+
+def format_conversation(history: List[Tuple[str, str]], message: str) -> str:
+    return "".join(f"User: {user_msg}\nBot: {bot_msg}\n" for user_msg, bot_msg in history) + f"User: {message}\nBot:"
+
+class ContextPacker:
+    """
+    Fits the chatbot prompts in a token budget:
+    - History: the most recent turns that fit in `history_share` of the budget, the older user messages
+      shortened into a one-line summary of `summary_tokens`.
+    - Documents: deduplicated (overlapping chunks merged), then added in relevance order until the budget is reached,
+      the last one truncated if at least `min_chunk_tokens` remain.
+    """
+    def __init__(self, budget: int = DEFAULT_CONTEXT_BUDGET, tokenizer_name: Optional[str] = None, history_share: float = 0.4, summary_tokens: int = 128, min_chunk_tokens: int = 64):
+        """
+        Args:
+            budget: The prompt budget in tokens, system prompt included.
+            tokenizer_name: See TokenCounter.
+            history_share: The share of the budget the history may use.
+            summary_tokens: The budget of the summary of the dropped turns, 0 to drop them silently.
+            min_chunk_tokens: The smallest truncated chunk worth adding.
+        """
+        self.budget = budget
+        self.history_share = history_share
+        self.summary_tokens = summary_tokens
+        self.min_chunk_tokens = min_chunk_tokens
+        self.tokens = get_token_counter(tokenizer_name)
+
+    @staticmethod
+    def _summary_line(topics: List[str]) -> str:
+        return f"(Earlier in the conversation, the user asked: {'; '.join(topics)})\n"
+
+    def _summary(self, dropped: List[Tuple[str, str]]) -> str:
+        """The user messages of the dropped turns, shortened, the most recent ones kept within summary_tokens."""
+        topics = []
+        for user_msg, _ in reversed(dropped if self.summary_tokens > 0 else []):
+            topic = " ".join(user_msg.split())
+            topic = topic if len(topic) <= 100 else topic[:100] + "..."
+            if self.tokens.count(self._summary_line([topic] + topics)) > self.summary_tokens:
+                break
+            topics.insert(0, topic)
+        return self._summary_line(topics) if topics else ""
+
+    def pack_history(self, history: List[Tuple[str, str]], message: str) -> str:
+        """
+        Returns:
+            The conversation text (as format_conversation) of the turns that fit in the history budget.
+        """
+        budget = int(self.budget * self.history_share) - self.summary_tokens
+        used = self.tokens.count(f"User: {message}\nBot:")
+        start = len(history)
+        while start > 0:
+            user_msg, bot_msg = history[start - 1]
+            turn = self.tokens.count(f"User: {user_msg}\nBot: {bot_msg}\n")
+            if used + turn > budget:
+                break
+            used += turn
+            start -= 1
+        return self._summary(history[:start]) + format_conversation(history[start:], message)
+
+    def _truncate(self, doc: Document, budget: int) -> Optional[Document]:
+        if budget < self.min_chunk_tokens:
+            return None
+        text = doc.page_content
+        while text and self.tokens.count(text) > budget:
+            text = text[:int(len(text) * budget / self.tokens.count(text) * 0.95)]
+        if not text or self.tokens.count(text) < self.min_chunk_tokens:
+            return None
+        return Document(id=doc.id, page_content=text + "...", metadata=doc.metadata)
+
+    def pack_documents(self, documents: List[Document], budget: int) -> Tuple[List[Document], dict]:
+        """
+        Args:
+            documents: The retrieved documents, most relevant first.
+            budget: The tokens available for the formatted documents.
+        Returns:
+            The packed documents and {"documents", "packed", "merged", "truncated", "document_tokens"}.
+        """
+        unique, merged = deduplicate(documents)
+        packed, used, truncated = [], 0, 0
+        for doc in unique:
+            header = self.tokens.count(f"Document {len(packed) + 1}:\n")
+            size = header + self.tokens.count(doc.page_content)
+            if used + size > budget:
+                doc = self._truncate(doc, budget - used - header)
+                if doc is not None:
+                    packed.append(doc)
+                    used += header + self.tokens.count(doc.page_content)
+                    truncated += 1
+                break
+            packed.append(doc)
+            used += size
+        return packed, {"documents": len(documents), "packed": len(packed), "merged": merged, "truncated": truncated, "document_tokens": used}
+
+    def pack_prompt(self, template: str, documents: List[Document], conversation: str, sys: str = "", **fields) -> Tuple[str, dict]:
+        """
+        Fill `template`'s {documents} and {conversation} within the budget.
+        Args:
+            template: The prompt template, e.g. retrieve_chatbot_prompt.
+            documents: The retrieved documents, most relevant first.
+            conversation: The conversation, from pack_history.
+            sys: The system prompt sent with the prompt, counted in the budget.
+            **fields: The other fields of the template (role...).
+        Returns:
+            The prompt and the packing stats (see pack_documents) with its "prompt_tokens".
+        """
+        fixed = self.tokens.count(template.format(documents="", conversation=conversation, **fields)) + self.tokens.count(sys)
+        packed, stats = self.pack_documents(documents, self.budget - fixed)
+        prompt = template.format(documents=format_documents(packed), conversation=conversation, **fields)
+        stats["prompt_tokens"] = self.tokens.count(prompt) + self.tokens.count(sys)
+        return prompt, stats
+
+_packers = {}
+_packers_lock = threading.Lock()
+
+def get_context_packer(model_name: str, provider: str = "ollama") -> ContextPacker:
+    """Get the packer of a model, with its budget and its provider's tokenizer, shared by every chat."""
+    with _packers_lock:
+        if (model_name, provider) not in _packers:
+            _packers[(model_name, provider)] = ContextPacker(_context_budgets_.get(model_name, DEFAULT_CONTEXT_BUDGET), _tokenizers_.get(provider))
+        return _packers[(model_name, provider)]
@@ -1,59 +1,239 @@
-from openai import OpenAI
-import backoff
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
+import asyncio
+import httpx
 
 import os
+import threading
+import weakref
+
+from .rate_limiter import get_rate_limiter, estimate_tokens, call_with_retry, async_call_with_retry
+from .response_cache import get_response_cache, make_key
+from ..observability.tracing import span, start_span
 
 _base_url_ ={
     "ollama": "http://localhost:11434/v1",
     "mistral": "https://api.mistral.ai/v1",
     "openai": "https://api.openai.com/v1",
+    "mock": os.getenv("MOCK_LLM_URL", "http://localhost:8000/v1"),  # test/mock_llm_server.py
 }
 
 _api_key_ = {
     "ollama": "ollama",
     "mistral": os.getenv("MISTRAL_API_KEY"),
     "openai": os.getenv("OPENAI_API_KEY"),
+    "mock": "mock",
+}
+
+# Max in-flight requests per provider for AsyncChatAssistant, also the size of its connection pool.
+_max_concurrency_ = {
+    "ollama": 4,
+    "mistral": 8,
+    "openai": 32,
+    "mock": 256,
 }
 
+_clients = {}
+_clients_lock = threading.Lock()
+# AsyncOpenAI connections and asyncio semaphores belong to the event loop they were created on.
+_async_state = weakref.WeakKeyDictionary()
+
+def get_client(provider: str) -> OpenAI:
+    """
+    Get the OpenAI client of a provider, shared by every ChatAssistant so that connections are reused.
+    """
+    with _clients_lock:
+        if provider not in _clients:
+            _clients[provider] = OpenAI(
+                base_url=_base_url_[provider],
+                api_key=_api_key_[provider],
+                max_retries=0,  # Retries go through rate_limiter.call_with_retry.
+            )
+        return _clients[provider]
+
+def get_async_client(provider: str) -> tuple[AsyncOpenAI, asyncio.Semaphore]:
+    """
+    Get the AsyncOpenAI client of a provider and the semaphore capping its in-flight requests,
+    shared by every AsyncChatAssistant of the running event loop.
+    """
+    loop_state = _async_state.setdefault(asyncio.get_running_loop(), {})
+    if provider not in loop_state:
+        max_concurrency = _max_concurrency_[provider]
+        client = AsyncOpenAI(
+            base_url=_base_url_[provider],
+            api_key=_api_key_[provider],
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)),
+        )
+        loop_state[provider] = (client, asyncio.Semaphore(max_concurrency))
+    return loop_state[provider]
+
+def set_max_concurrency(provider: str, max_concurrency: int) -> None:
+    """
+    Replace the in-flight cap of a provider for AsyncChatAssistant. Affects the clients created afterwards,
+    so call it before the first request of the event loop.
+    """
+    _max_concurrency_[provider] = max_concurrency
+
+def _check_provider(provider: str) -> None:
+    if provider not in _base_url_:
+        raise ValueError(f"Unsupported provider: '{provider}'. Supported providers are {list(_base_url_)}.")
+
+def _messages(user: str, sys: str) -> list:
+    return [
+        {"role": "system", "content": sys},
+        {"role": "user", "content": user},
+    ]
+
+def _usage(response) -> dict:
+    if response.usage is None:
+        return None
+    return {"prompt_tokens": response.usage.prompt_tokens, "completion_tokens": response.usage.completion_tokens, "total_tokens": response.usage.total_tokens}
+
+def _usage_attributes(usage: dict) -> dict:
+    return {name: usage[name] for name in ("prompt_tokens", "completion_tokens") if usage and usage.get(name) is not None}
+
+def _result(content: str, usage: dict, cached: bool, return_usage: bool):
+    if not return_usage:
+        return content
+    return content, {**(usage or {}), "cached": cached}
+
 class ChatAssistant:
-    def __init__(self, model_name:str, provider:str = "ollama"):
+    def __init__(self, model_name:str, provider:str = "ollama", max_tries: int = 6, sampling_params: dict = None, cache_path: str = None):
         """
         Args:
             model_name: The name of the model to use.
-            provider: The provider of the model. Can be "ollama", "mistral", or "openai".
+            provider: The provider of the model. Can be "ollama", "mistral", "openai" or "mock" (test/mock_llm_server.py).
+            max_tries: The maximum number of attempts of a request. Only rate limits, timeouts,
+                connection and server errors are retried, honouring Retry-After.
+            sampling_params: Extra arguments of the completion request (temperature, top_p, max_tokens...).
+            cache_path: The SQLite file caching the responses of get_response, None to disable.
         """
+        _check_provider(provider)
         self.model_name = model_name
-        self.client = OpenAI(
-            base_url=_base_url_[provider],
-            api_key=_api_key_[provider],
+        self.provider = provider
+        self.max_tries = max_tries
+        self.sampling_params = sampling_params or {}
+        self.client = get_client(provider)
+        # Shared by every assistant of the provider, across threads and coroutines.
+        self.limiter = get_rate_limiter(provider)
+        self.cache = get_response_cache(cache_path) if cache_path else None
+
+    def _create(self, messages: list, **kwargs):
+        return call_with_retry(
+            lambda: self.client.chat.completions.create(model=self.model_name, messages=messages, **self.sampling_params, **kwargs),
+            self.limiter, estimate_tokens(messages), max_tries=self.max_tries,
         )
+
+    def get_response(self, user: str, sys: str = "", use_cache: bool = True, return_usage: bool = False):
+        """
+        Args:
+            user: The user prompt.
+            sys: The system prompt.
+            use_cache: Read the cache. A fresh response is still written to it, replacing the cached one.
+            return_usage: Return (response, usage), usage being {prompt_tokens, completion_tokens, total_tokens, cached}.
+        """
+        with span("llm.response", provider=self.provider, model=self.model_name) as current:
+            key = make_key(self.provider, self.model_name, sys, user, self.sampling_params) if self.cache else None
+            if self.cache and use_cache:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    current.set(cache="hit")
+                    return _result(cached[0], cached[1], True, return_usage)
+            response = self._create(_messages(user, sys))
+            content, usage = response.choices[0].message.content, _usage(response)
+            current.set(cache="miss" if self.cache else None, **_usage_attributes(usage))
+            if self.cache:
+                self.cache.put(key, self.provider, self.model_name, content, usage)
+            return _result(content, usage, False, return_usage)
     
-    @backoff.on_exception(backoff.expo, Exception)
-    def get_response(self, user: str, sys: str = ""):
-        response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": sys},
-                    {"role": "user", "content": user},
-                ]
-            )
-        return response.choices[0].message.content
-    
-    @backoff.on_exception(backoff.expo, Exception)
     def get_streaming_response(self, user: str, sys: str = ""):
         """Yields the response token by token (streaming)."""
-        response_stream = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=[
-                {"role": "system", "content": sys},
-                {"role": "user", "content": user},
-            ],
-            stream=True
+        # Ended by hand: the span lasts across the yields. Its first_token mark is the time to first token.
+        current = start_span("llm.stream", provider=self.provider, model=self.model_name)
+        chunks = 0
+        try:
+            response_stream = self._create(_messages(user, sys), stream=True)
+
+            # Iterate over the stream of chunks
+            for chunk in response_stream:
+                # The actual token is in chunk.choices[0].delta.content
+                token = chunk.choices[0].delta.content
+                if token is not None:
+                    current.mark("first_token")
+                    chunks += 1
+                    yield token
+        except Exception:
+            current.end(error=True)
+            raise
+        finally:
+            current.set(chunks=chunks)
+            current.end()
+
+class AsyncChatAssistant:
+    """
+    Async version of ChatAssistant. The client (and its connection pool) is shared per provider,
+    and at most _max_concurrency_[provider] requests are in flight at once.
+    """
+    def __init__(self, model_name: str, provider: str = "ollama", max_tries: int = 6, sampling_params: dict = None, cache_path: str = None):
+        """
+        Args:
+            model_name: The name of the model to use.
+            provider: The provider of the model. Can be "ollama", "mistral", "openai" or "mock".
+            max_tries: The maximum number of attempts of a request, see ChatAssistant.
+            sampling_params: Extra arguments of the completion request (temperature, top_p, max_tokens...).
+            cache_path: The SQLite file caching the responses of get_response, None to disable.
+        """
+        _check_provider(provider)
+        self.model_name = model_name
+        self.provider = provider
+        self.max_tries = max_tries
+        self.sampling_params = sampling_params or {}
+        self.limiter = get_rate_limiter(provider)
+        self.cache = get_response_cache(cache_path) if cache_path else None
+
+    async def _create(self, client: AsyncOpenAI, messages: list, **kwargs):
+        return await async_call_with_retry(
+            lambda: client.chat.completions.create(model=self.model_name, messages=messages, **self.sampling_params, **kwargs),
+            self.limiter, estimate_tokens(messages), max_tries=self.max_tries,
         )
-        
-        # Iterate over the stream of chunks
-        for chunk in response_stream:
-            # The actual token is in chunk.choices[0].delta.content
-            token = chunk.choices[0].delta.content
-            if token is not None:
-                yield token
\ No newline at end of file
+
+    async def get_response(self, user: str, sys: str = "", use_cache: bool = True, return_usage: bool = False):
+        """See ChatAssistant.get_response."""
+        with span("llm.response", provider=self.provider, model=self.model_name) as current:
+            key = make_key(self.provider, self.model_name, sys, user, self.sampling_params) if self.cache else None
+            if self.cache and use_cache:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    current.set(cache="hit")
+                    return _result(cached[0], cached[1], True, return_usage)
+            client, semaphore = get_async_client(self.provider)
+            async with semaphore:
+                current.mark("slot")  # Time queued behind the provider's concurrency cap.
+                response = await self._create(client, _messages(user, sys))
+            content, usage = response.choices[0].message.content, _usage(response)
+            current.set(cache="miss" if self.cache else None, **_usage_attributes(usage))
+            if self.cache:
+                self.cache.put(key, self.provider, self.model_name, content, usage)
+            return _result(content, usage, False, return_usage)
+
+    async def get_streaming_response(self, user: str, sys: str = ""):
+        """Yields the response token by token (streaming). The request holds its semaphore slot until the stream ends."""
+        current = start_span("llm.stream", provider=self.provider, model=self.model_name)
+        chunks = 0
+        try:
+            client, semaphore = get_async_client(self.provider)
+            async with semaphore:
+                current.mark("slot")
+                response_stream = await self._create(client, _messages(user, sys), stream=True)
+                async for chunk in response_stream:
+                    token = chunk.choices[0].delta.content
+                    if token is not None:
+                        current.mark("first_token")
+                        chunks += 1
+                        yield token
+        except Exception:
+            current.end(error=True)
+            raise
+        finally:
+            current.set(chunks=chunks)
+            current.end()
@@ -0,0 +1,247 @@
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+import openai
+
+# Default limits per provider, None for unlimited. Override them for your account tier with the <PROVIDER>_RPM and
+# <PROVIDER>_TPM environment variables (e.g. MISTRAL_RPM=300, 0 for unlimited), the --rpm/--tpm flags of the eval
+# scripts or set_rate_limit.
+_rate_limits_ = {
+    "ollama": {"requests_per_minute": None, "tokens_per_minute": None},
+    "mistral": {"requests_per_minute": 60, "tokens_per_minute": 500_000},
+    "openai": {"requests_per_minute": 500, "tokens_per_minute": 200_000},
+    "mock": {"requests_per_minute": None, "tokens_per_minute": None},
+}
+for _provider, _limits in _rate_limits_.items():
+    for _name, _suffix in (("requests_per_minute", "RPM"), ("tokens_per_minute", "TPM")):
+        _value = os.getenv(f"{_provider.upper()}_{_suffix}")
+        if _value:
+            _limits[_name] = float(_value) or None
+
+# Expected completion size, reserved with the prompt and corrected once the response reports its usage.
+COMPLETION_TOKENS_ESTIMATE = 256
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled at `per_minute` / 60 per second, holding at most one minute of budget.
+    Callers reserve ahead: the bucket may go negative and each caller sleeps for its own share of the debt,
+    so waiting threads and coroutines are served in order without polling.
+    """
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` from the bucket. Returns the number of seconds to wait before using it."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount: float) -> None:
+        """Give back (or take, if negative) tokens once the actual cost is known."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+class RateLimiter:
+    """
+    Requests/min and tokens/min limits of one provider, shared by every thread and coroutine.
+    A 429 pauses the whole provider for its Retry-After, not only the request that got it.
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "throttled_requests": 0, "throttled_seconds": 0.0, "retries": 0, "rate_limited": 0, "errors": 0, "giveups": 0}
+
+    def _reserve(self, tokens: int) -> float:
+        wait = self.requests.reserve(1) if self.requests else 0.0
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        with self.lock:
+            wait = max(wait, self.paused_until - time.monotonic())
+            self.counters["requests"] += 1
+            if wait > 0:
+                self.counters["throttled_requests"] += 1
+                self.counters["throttled_seconds"] += wait
+        return wait
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block the calling thread until a request of `tokens` tokens may be sent."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        """Same as acquire, without blocking the event loop."""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def record_usage(self, estimated: int, actual: int) -> None:
+        if self.tokens:
+            self.tokens.refund(estimated - actual)
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def count(self, name: str, amount: float = 1) -> None:
+        with self.lock:
+            self.counters[name] += amount
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider: str) -> RateLimiter:
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter(**_rate_limits_.get(provider, {}))
+        return _limiters[provider]
+
+def set_rate_limit(provider: str, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None) -> None:
+    """
+    Replace the limits of a provider (None for unlimited). Affects the assistants created afterwards.
+    """
+    with _limiters_lock:
+        _rate_limits_[provider] = {"requests_per_minute": requests_per_minute, "tokens_per_minute": tokens_per_minute}
+        _limiters[provider] = RateLimiter(requests_per_minute, tokens_per_minute)
+
+def override_rate_limit(provider: str, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None) -> None:
+    """
+    Replace the given limits of a provider and keep the others, e.g. from --rpm/--tpm flags. 0 is unlimited.
+    """
+    if requests_per_minute is None and tokens_per_minute is None:
+        return
+    limits = _rate_limits_.get(provider, {"requests_per_minute": None, "tokens_per_minute": None})
+    set_rate_limit(
+        provider,
+        limits["requests_per_minute"] if requests_per_minute is None else (requests_per_minute or None),
+        limits["tokens_per_minute"] if tokens_per_minute is None else (tokens_per_minute or None),
+    )
+
+def rate_limit_stats() -> dict:
+    """
+    Returns:
+        The counters of every provider used so far: requests, throttled_requests, throttled_seconds, retries, rate_limited,
+        errors (not retryable) and giveups (retries exhausted).
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {provider: limiter.stats() for provider, limiter in limiters.items()}
+
+def estimate_tokens(messages: list) -> int:
+    """Rough token count of a request (~4 characters per token) plus the expected completion."""
+    return sum(len(message["content"]) for message in messages) // 4 + COMPLETION_TOKENS_ESTIMATE
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+def retry_after(error: Exception) -> Optional[float]:
+    """The delay requested by the server through the retry-after-ms or Retry-After header, if any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _backoff(error: Exception, attempt: int, limiter: RateLimiter, max_wait: float) -> float:
+    """The wait before the next attempt: Retry-After if given, else exponential backoff with full jitter."""
+    delay = retry_after(error)
+    if delay is None:
+        delay = random.uniform(0, min(max_wait, 2 ** attempt))
+    else:
+        delay = min(delay, max_wait)
+    if isinstance(error, openai.RateLimitError):
+        limiter.count("rate_limited")
+        limiter.pause(delay)
+    limiter.count("retries")
+    limiter.count("throttled_seconds", delay)
+    return delay
+
+def _record_usage(result, limiter: RateLimiter, tokens: int) -> None:
+    usage = getattr(result, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None) is not None:
+        limiter.record_usage(tokens, usage.total_tokens)
+
+def call_with_retry(call: Callable, limiter: RateLimiter, tokens: int = 0, max_tries: int = 6, max_wait: float = 60.0):
+    """
+    Run `call` within the provider's limits, retrying retryable errors at most `max_tries` times in total.
+    Args:
+        call: The API call, without arguments.
+        limiter: The limiter of the provider.
+        tokens: The estimated token cost of the call.
+        max_tries: The maximum number of attempts.
+        max_wait: The maximum wait between two attempts, in seconds.
+    Returns:
+        The result of the call.
+    """
+    for attempt in range(max_tries):
+        limiter.acquire(tokens)
+        try:
+            result = call()
+        except Exception as e:
+            if not is_retryable(e):
+                limiter.count("errors")
+                raise
+            if attempt == max_tries - 1:
+                limiter.count("giveups")
+                raise
+            time.sleep(_backoff(e, attempt, limiter, max_wait))
+            continue
+        _record_usage(result, limiter, tokens)
+        return result
+
+async def async_call_with_retry(call: Callable, limiter: RateLimiter, tokens: int = 0, max_tries: int = 6, max_wait: float = 60.0):
+    """
+    Same as call_with_retry, `call` returning an awaitable.
+    """
+    for attempt in range(max_tries):
+        await limiter.acquire_async(tokens)
+        try:
+            result = await call()
+        except Exception as e:
+            if not is_retryable(e):
+                limiter.count("errors")
+                raise
+            if attempt == max_tries - 1:
+                limiter.count("giveups")
+                raise
+            await asyncio.sleep(_backoff(e, attempt, limiter, max_wait))
+            continue
+        _record_usage(result, limiter, tokens)
+        return result
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+def make_key(provider: str, model_name: str, sys: str, user: str, params: Optional[dict] = None) -> str:
+    payload = json.dumps([provider, model_name, sys, user, params or {}], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    SQLite cache of LLM responses, keyed by (provider, model, system prompt, user prompt, sampling params).
+    Stores the response text and its token usage. Safe to share between threads.
+    """
+    def __init__(self, path: str):
+        """
+        Args:
+            path: The SQLite file, created if missing.
+        """
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, provider TEXT, model TEXT, response TEXT, usage TEXT, created REAL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[dict]]]:
+        """
+        Returns:
+            (response, usage) or None if the key is not cached.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT response, usage FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def __contains__(self, key: str) -> bool:
+        """Whether the key is cached, without counting a lookup."""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key: str, provider: str, model_name: str, response: str, usage: Optional[dict] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, provider, model_name, response, json.dumps(usage) if usage else None, time.time()),
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "size": size}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_response_cache(path: str) -> ResponseCache:
+    """Get the cache of a file, shared by every assistant using it."""
+    path = os.path.abspath(path)
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ResponseCache(path)
+        return _caches[path]
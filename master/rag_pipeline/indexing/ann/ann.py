@@ -0,0 +1,158 @@
+import json
+import os
+from typing import List, Optional
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+INDEX_TYPES = ["flat", "ivf_flat", "ivf_pq", "hnsw"]
+INDEX_CONFIG_NAME = "index_config.json"
+
+def build_index(index_type: str, dim: int, num_train: int = 0, nlist: int = 1024, pq_m: int = 16, pq_nbits: int = 8, hnsw_m: int = 32, ef_construction: int = 200) -> faiss.Index:
+    """
+    Build an empty FAISS index with L2 distance, like the default LangChain FAISS store.
+    Args:
+        index_type: "flat", "ivf_flat", "ivf_pq" or "hnsw".
+        dim: The vector dimension.
+        num_train: The number of training vectors, nlist is lowered so that every list gets ~39 of them.
+        nlist: The number of IVF lists.
+        pq_m: The number of PQ sub-quantizers, must divide dim.
+        pq_nbits: The number of bits per PQ code.
+        hnsw_m: The number of HNSW neighbours per node.
+        ef_construction: The HNSW construction beam width.
+    Returns:
+        The index, untrained for the IVF types.
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    if index_type in ("ivf_flat", "ivf_pq"):
+        if num_train:
+            nlist = max(1, min(nlist, num_train // 39))
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_flat":
+            return faiss.IndexIVFFlat(quantizer, dim, nlist)
+        if num_train and num_train < 2 ** pq_nbits:
+            raise ValueError(f"ivf_pq with {pq_nbits}-bit codes needs at least {2 ** pq_nbits} training vectors, got {num_train}. Use ivf_flat or flat for small corpora.")
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+    raise ValueError(f"Unsupported index type: '{index_type}'. Supported index types are {INDEX_TYPES}.")
+
+def _extract_ivf(index: faiss.Index) -> Optional[faiss.IndexIVF]:
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+def ensure_direct_map(index: faiss.Index) -> None:
+    """
+    IVF indexes need a direct map for reconstruct, which MMR and bench_ann.py use.
+    The array map is kept up to date by add(), unlike the hashtable one.
+    """
+    ivf = _extract_ivf(index)
+    if ivf is not None and ivf.direct_map.type != faiss.DirectMap.Array:
+        ivf.set_direct_map_type(faiss.DirectMap.Array)
+
+def supports_remove(index: faiss.Index) -> bool:
+    return not isinstance(index, faiss.IndexHNSW)
+
+def delete(vectorstore: FAISS, ids: List[str]) -> None:
+    """
+    Same as vectorstore.delete(ids), for every index type that supports removal.
+    LangChain renumbers the remaining rows 0..n-1 after a removal. Flat indexes do the same,
+    IVF indexes keep the old labels, so their inverted lists are relabelled to match.
+    Args:
+        vectorstore: The vectorstore.
+        ids: The docstore ids to delete.
+    """
+    index = vectorstore.index
+    if not supports_remove(index):
+        raise ValueError(f"{type(index).__name__} does not support removing vectors.")
+    ivf = _extract_ivf(index)
+    if ivf is None:
+        vectorstore.delete(ids)
+        return
+
+    rows = {doc_id: row for row, doc_id in vectorstore.index_to_docstore_id.items()}
+    removed = np.sort(np.array([rows[doc_id] for doc_id in ids if doc_id in rows], dtype=np.int64))
+    # The array direct map does not support remove_ids, it is rebuilt from the relabelled lists.
+    ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+    vectorstore.delete(ids)
+    invlists = ivf.invlists
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            labels = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+            labels -= np.searchsorted(removed, labels)
+    ivf.set_direct_map_type(faiss.DirectMap.Array)
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """
+    Set the query-time accuracy/speed knobs of an index. Ignored for index types that do not have them.
+    Args:
+        index: The index.
+        nprobe: The number of IVF lists visited per query.
+        ef_search: The HNSW search beam width.
+    """
+    ivf = _extract_ivf(index)
+    if nprobe is not None and ivf is not None:
+        ivf.nprobe = nprobe
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+def create_vectorstore(embed_model: Embeddings, sample_vectors: np.ndarray, index_type: str = "flat", **index_params) -> FAISS:
+    """
+    Create an empty LangChain FAISS store backed by an index of the given type, trained on `sample_vectors` if needed.
+    Args:
+        embed_model: The embedding model of the store.
+        sample_vectors: The vectors used to size and train the index.
+        index_type: "flat", "ivf_flat", "ivf_pq" or "hnsw".
+        **index_params: Passed to build_index.
+    Returns:
+        The vectorstore.
+    """
+    sample_vectors = np.asarray(sample_vectors, dtype=np.float32)
+    index = build_index(index_type, sample_vectors.shape[1], num_train=len(sample_vectors), **index_params)
+    if not index.is_trained:
+        print(f"Training {index_type} index on {len(sample_vectors)} vectors...")
+        index.train(sample_vectors)
+    ensure_direct_map(index)
+    return FAISS(embedding_function=embed_model, index=index, docstore=InMemoryDocstore(), index_to_docstore_id={})
+
+def read_index(index_path: str, index_type: str = "flat", mmap: bool = False) -> faiss.Index:
+    """
+    Read a FAISS index, optionally memory-mapped and read-only so that processes share its pages.
+    Args:
+        index_path: The path of the index file.
+        index_type: The type it was built with, which decides the mmap flag.
+        mmap: Memory-map the vectors instead of reading them into RAM.
+    Returns:
+        The index.
+    """
+    if not mmap:
+        return faiss.read_index(index_path)
+    # IVF lists are mapped by IO_FLAG_MMAP, flat codes (flat and HNSW storage) by IO_FLAG_MMAP_IFC. The two cannot be combined.
+    flag = faiss.IO_FLAG_MMAP if index_type in ("ivf_flat", "ivf_pq") else faiss.IO_FLAG_MMAP_IFC
+    return faiss.read_index(index_path, flag | faiss.IO_FLAG_READ_ONLY)
+
+def save_index_config(vectorstore_dir: str, config: dict) -> None:
+    """
+    Save the index type and default search params next to the index.
+    Args:
+        vectorstore_dir: The directory of the vectorstore.
+        config: {"index_type", "nprobe", "ef_search", ...}.
+    """
+    with open(os.path.join(vectorstore_dir, INDEX_CONFIG_NAME), "w", encoding="utf-8") as f:
+        json.dump(config, f)
+
+def load_index_config(vectorstore_dir: str) -> dict:
+    config_path = os.path.join(vectorstore_dir, INDEX_CONFIG_NAME)
+    if not os.path.exists(config_path):
+        return {"index_type": "flat"}
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,176 @@
+import json
+import math
+import os
+from array import array
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+from langchain.schema import Document
+
+_BM25_FILES = ["vocab.json", "meta.json", "offsets.npy", "doc_ids.npy", "tfs.npy", "doc_norm.npy", "idf.npy"]
+
+def _tokenize(text: str) -> List[str]:
+    # Same preprocessing as langchain's BM25Retriever, so scores match the old per-query index.
+    return text.split()
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index stored as flat arrays (CSR postings).
+    Postings of term t live in doc_ids[offsets[t]:offsets[t+1]] / tfs[offsets[t]:offsets[t+1]].
+    Scores are identical to rank_bm25.BM25Okapi, which BM25Retriever uses under the hood.
+    """
+    def __init__(self, vocab: dict, offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_norm: np.ndarray, idf: np.ndarray, k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            vocab: Mapping term -> term id.
+            offsets: Start of the postings of each term, length len(vocab) + 1.
+            doc_ids: Document ids of all postings.
+            tfs: Term frequencies of all postings.
+            doc_norm: Per document k1 * (1 - b + b * doc_len / avgdl).
+            idf: Per term idf.
+            k1: BM25 k1 parameter.
+            b: BM25 b parameter.
+        """
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_norm = doc_norm
+        self.idf = idf
+        self.k1 = k1
+        self.b = b
+
+    def __len__(self) -> int:
+        return len(self.doc_norm)
+
+    @classmethod
+    def from_documents(cls, docs: List[Document], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25) -> "BM25Index":
+        """
+        Build the index from a list of documents. Document ids are the positions in `docs`.
+        Args:
+            docs: The documents to index.
+            k1: BM25 k1 parameter.
+            b: BM25 b parameter.
+            epsilon: Floor for negative idf, as a fraction of the average idf.
+        Returns:
+            The index.
+        """
+        vocab = {}
+        term_ids, doc_ids, tfs = array("i"), array("i"), array("f")
+        doc_len = np.zeros(len(docs), dtype=np.float32)
+
+        for doc_id, doc in enumerate(docs):
+            tokens = _tokenize(doc.page_content)
+            doc_len[doc_id] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_id = vocab.setdefault(term, len(vocab))
+                term_ids.append(term_id)
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+
+        term_ids = np.frombuffer(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind="stable")
+        df = np.bincount(term_ids, minlength=len(vocab))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=offsets[1:])
+
+        n_docs = len(docs)
+        idf = np.array([math.log(n_docs - n + 0.5) - math.log(n + 0.5) for n in df], dtype=np.float32)
+        if len(idf) > 0:
+            eps = epsilon * float(idf.sum()) / len(idf)
+            idf[idf < 0] = eps
+
+        avgdl = float(doc_len.mean()) if n_docs > 0 else 1.0
+        doc_norm = (k1 * (1 - b + b * doc_len / (avgdl or 1.0))).astype(np.float32)
+
+        return cls(
+            vocab=vocab,
+            offsets=offsets,
+            doc_ids=np.frombuffer(doc_ids, dtype=np.int32)[order],
+            tfs=np.frombuffer(tfs, dtype=np.float32)[order],
+            doc_norm=doc_norm,
+            idf=idf,
+            k1=k1,
+            b=b,
+        )
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[int, float]]:
+        """
+        Search the index. Only touches the postings of the query terms.
+        Args:
+            query: The query to search for.
+            k: The number of documents to return.
+        Returns:
+            A list of (document id, score), best first. Documents without any query term are not returned.
+        """
+        ids, scores = [], []
+        for token in _tokenize(query):
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            posting_ids = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            ids.append(posting_ids)
+            scores.append(self.idf[term_id] * tf * (self.k1 + 1) / (tf + self.doc_norm[posting_ids]))
+
+        if not ids:
+            return []
+
+        unique_ids, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        if len(totals) > k:
+            top = np.argpartition(-totals, k)[:k]
+        else:
+            top = np.arange(len(totals))
+        top = top[np.argsort(-totals[top], kind="stable")]
+        return [(int(unique_ids[i]), float(totals[i])) for i in top]
+
+    def save(self, index_dir: str) -> None:
+        """
+        Save the index to a directory.
+        Args:
+            index_dir: The directory to save the index to.
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        with open(os.path.join(index_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "num_docs": len(self)}, f)
+        np.save(os.path.join(index_dir, "offsets.npy"), self.offsets)
+        np.save(os.path.join(index_dir, "doc_ids.npy"), self.doc_ids)
+        np.save(os.path.join(index_dir, "tfs.npy"), self.tfs)
+        np.save(os.path.join(index_dir, "doc_norm.npy"), self.doc_norm)
+        np.save(os.path.join(index_dir, "idf.npy"), self.idf)
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True) -> "BM25Index":
+        """
+        Load the index from a directory.
+        Args:
+            index_dir: The directory to load the index from.
+            mmap: Memory-map the postings instead of reading them into RAM.
+        Returns:
+            The index.
+        """
+        missing = [f for f in _BM25_FILES if not os.path.exists(os.path.join(index_dir, f))]
+        if missing:
+            raise FileNotFoundError(f"BM25 index at {index_dir} is incomplete. Missing: {missing}")
+
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        with open(os.path.join(index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(
+            vocab=vocab,
+            offsets=np.load(os.path.join(index_dir, "offsets.npy"), mmap_mode=mmap_mode),
+            doc_ids=np.load(os.path.join(index_dir, "doc_ids.npy"), mmap_mode=mmap_mode),
+            tfs=np.load(os.path.join(index_dir, "tfs.npy"), mmap_mode=mmap_mode),
+            doc_norm=np.load(os.path.join(index_dir, "doc_norm.npy"), mmap_mode=mmap_mode),
+            idf=np.load(os.path.join(index_dir, "idf.npy"), mmap_mode=mmap_mode),
+            k1=meta["k1"],
+            b=meta["b"],
+        )
@@ -0,0 +1,126 @@
+import json
+import mmap as mmap_module
+import os
+from collections.abc import Mapping, Sequence
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain.schema import Document
+
+class ChunkStore(Sequence):
+    """
+    Columnar store of the chunks, one row per FAISS row / BM25 doc id.
+    - text.bin: the UTF-8 page contents, concatenated.
+    - offsets.npy: the byte offset of each chunk in text.bin (n + 1 entries).
+    - ids.npy: the chunk ids (see data_ingest/manifest.py) as fixed-width bytes.
+    - column_<i>.npy + meta.json: every metadata key (source, Header 1-3, ...) dictionary-encoded,
+      the codes index the column's values in meta.json, -1 when a chunk does not have the key.
+    Documents are decoded on access.
+    """
+    def __init__(self, text: Union[bytes, mmap_module.mmap], offsets: np.ndarray, ids: np.ndarray, columns: Dict[str, Tuple[list, np.ndarray]]):
+        self.text = text
+        self.offsets = offsets
+        self.ids = ids
+        self.columns = columns
+
+    @classmethod
+    def from_documents(cls, docs: List[Document]) -> "ChunkStore":
+        encoded = [doc.page_content.encode("utf-8") for doc in docs]
+        offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        ids = np.array([(doc.id or "").encode("utf-8") for doc in docs], dtype=bytes)
+
+        columns = {}
+        for key in dict.fromkeys(key for doc in docs for key in doc.metadata):
+            values, codes_of = [], {}
+            codes = np.full(len(docs), -1, dtype=np.int32)
+            for i, doc in enumerate(docs):
+                if key not in doc.metadata:
+                    continue
+                value = doc.metadata[key]
+                value_key = json.dumps(value, sort_keys=True)
+                if value_key not in codes_of:
+                    codes_of[value_key] = len(values)
+                    values.append(value)
+                codes[i] = codes_of[value_key]
+            columns[key] = (values, codes)
+        return cls(b"".join(encoded), offsets, ids, columns)
+
+    def save(self, store_dir: str) -> None:
+        os.makedirs(store_dir, exist_ok=True)
+        with open(os.path.join(store_dir, "text.bin"), "wb") as f:
+            f.write(self.text)
+        np.save(os.path.join(store_dir, "offsets.npy"), self.offsets)
+        np.save(os.path.join(store_dir, "ids.npy"), self.ids)
+        for i, (_, codes) in enumerate(self.columns.values()):
+            np.save(os.path.join(store_dir, f"column_{i}.npy"), codes)
+        with open(os.path.join(store_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"num_chunks": len(self), "columns": [[key, values] for key, (values, _) in self.columns.items()]}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, store_dir: str, mmap: bool = True) -> "ChunkStore":
+        """
+        Args:
+            store_dir: The directory the store was saved to.
+            mmap: Memory-map the text and arrays instead of reading them, so processes share their pages.
+        """
+        with open(os.path.join(store_dir, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        mmap_mode = "r" if mmap else None
+        offsets = np.load(os.path.join(store_dir, "offsets.npy"), mmap_mode=mmap_mode)
+        ids = np.load(os.path.join(store_dir, "ids.npy"), mmap_mode=mmap_mode)
+        columns = {key: (values, np.load(os.path.join(store_dir, f"column_{i}.npy"), mmap_mode=mmap_mode)) for i, (key, values) in enumerate(meta["columns"])}
+        with open(os.path.join(store_dir, "text.bin"), "rb") as f:
+            if mmap and offsets[-1]:
+                text = mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ)
+            else:
+                text = f.read()
+        return cls(text, offsets, ids, columns)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Chunk {i} out of range.")
+        metadata = {}
+        for key, (values, codes) in self.columns.items():
+            if codes[i] >= 0:
+                metadata[key] = values[codes[i]]
+        return Document(id=self.ids[i].decode("utf-8") or None, page_content=self.text[self.offsets[i]:self.offsets[i + 1]].decode("utf-8"), metadata=metadata)
+
+class ChunkDocstore(Docstore):
+    """
+    Read-only LangChain docstore over a ChunkStore, addressed by integer row (see RowIds).
+    """
+    def __init__(self, chunks: ChunkStore):
+        self.chunks = chunks
+
+    def search(self, search: Union[int, str]) -> Union[str, Document]:
+        try:
+            return self.chunks[int(search)]
+        except (IndexError, ValueError):
+            return f"ID {search} not found."
+
+class RowIds(Mapping):
+    """Identity index_to_docstore_id for ChunkDocstore, without a dict entry per row."""
+    def __init__(self, n: int):
+        self.n = n
+
+    def __getitem__(self, row) -> int:
+        row = int(row)
+        if not 0 <= row < self.n:
+            raise KeyError(row)
+        return row
+
+    def __iter__(self):
+        return iter(range(self.n))
+
+    def __len__(self) -> int:
+        return self.n
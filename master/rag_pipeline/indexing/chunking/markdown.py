@@ -1,28 +1,39 @@
 from langchain.text_splitter import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from typing import List
+from functools import lru_cache
+from typing import List, Union
 
-def __split_1_document__(document: Document, chunk_size: int, chunk_overlap: int) -> List[Document]:
-    headers_to_split_on = [
-        ("#", "Header 1"),
-        ("##", "Header 2"),
-        ("###", "Header 3"),
-    ]
+from .parallel import split_parallel
+
+headers_to_split_on = [
+    ("#", "Header 1"),
+    ("##", "Header 2"),
+    ("###", "Header 3"),
+]
 
-    markdown_splitter = MarkdownHeaderTextSplitter(
+@lru_cache(maxsize=None)
+def _get_markdown_splitter() -> MarkdownHeaderTextSplitter:
+    return MarkdownHeaderTextSplitter(
         headers_to_split_on=headers_to_split_on,
         strip_headers=False,
         return_each_line=False
     )
+
+@lru_cache(maxsize=None)
+def _get_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+def __split_1_document__(document: Document, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    markdown_splitter = _get_markdown_splitter()
     
     md_header_splits = markdown_splitter.split_text(document.page_content)
 
     for doc in md_header_splits:
         doc.metadata.update(document.metadata)
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size, chunk_overlap=chunk_overlap
-    )
+    text_splitter = _get_text_splitter(chunk_size, chunk_overlap)
     
     final_splits = text_splitter.split_documents(md_header_splits)
     
@@ -47,8 +58,17 @@ def __split_1_document__(document: Document, chunk_size: int, chunk_overlap: int
 
     return final_splits
 
-def split_document(documents: List[Document], chunk_size: int, chunk_overlap: int) -> List[Document]:
-    split_documents = []
-    for doc in documents:
-        split_documents.extend(__split_1_document__(doc, chunk_size, chunk_overlap))
-    return split_documents
\ No newline at end of file
+def split_document(documents: List[Document], chunk_size: int, chunk_overlap: int, max_workers: int = 1, flatten: bool = True) -> Union[List[Document], List[List[Document]]]:
+    """
+    Split markdown documents on their #, ## and ### headers, then split the sections into chunks. Each chunk starts
+    with its source, its headers and its number within the document.
+    Args:
+        documents: The markdown documents.
+        chunk_size: The maximum number of characters of a chunk, before the prepended source and headers.
+        chunk_overlap: The number of characters shared by consecutive chunks of a section.
+        max_workers: The number of worker processes, 1 to split in this process (see parallel.split_parallel).
+        flatten: Return one flat list of chunks instead of one list per document.
+    Returns:
+        The chunks, flat or one list per document.
+    """
+    return split_parallel(__split_1_document__, documents, chunk_size, chunk_overlap, max_workers, flatten=flatten)
\ No newline at end of file
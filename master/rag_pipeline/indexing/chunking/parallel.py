@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, List, Union
+
+from langchain.schema import Document
+
+_pool_cache = {}
+
+def get_pool(max_workers: int = None) -> ProcessPoolExecutor:
+    """
+    Get a process pool for chunking. Cache available, so workers are started once per process.
+    Args:
+        max_workers: The number of worker processes. Defaults to the number of cores.
+    Returns:
+        The process pool.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers not in _pool_cache:
+        _pool_cache[max_workers] = ProcessPoolExecutor(max_workers=max_workers)
+    return _pool_cache[max_workers]
+
+def split_parallel(split_1_document: Callable, documents: List[Document], chunk_size: int, chunk_overlap: int, max_workers: int = 1, chunksize: int = 8, flatten: bool = True) -> Union[List[Document], List[List[Document]]]:
+    """
+    Split documents with `split_1_document`, fanning them out across a process pool.
+    Results are collected in input order, so the output is the same as splitting serially.
+    Args:
+        split_1_document: A module-level function splitting one document.
+        documents: The documents to split.
+        chunk_size: The chunk size.
+        chunk_overlap: The chunk overlap.
+        max_workers: The number of worker processes, 1 to split in this process, None for all cores.
+        chunksize: The number of documents sent to a worker at once.
+        flatten: Return one flat list of chunks instead of one list per document.
+    Returns:
+        The chunks of all documents, in order.
+    """
+    split = partial(split_1_document, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if max_workers == 1 or len(documents) <= 1:
+        results = map(split, documents)
+    else:
+        results = get_pool(max_workers).map(split, documents, chunksize=chunksize)
+
+    if not flatten:
+        return list(results)
+    split_documents = []
+    for chunks in results:
+        split_documents.extend(chunks)
+    return split_documents
@@ -1,12 +1,19 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-from typing import List
+from functools import lru_cache
+from typing import List, Union
 
-def __split_1_document__(document: Document, chunk_size: int, chunk_overlap: int) -> List[Document]:
-    text_splitter = RecursiveCharacterTextSplitter(
+from .parallel import split_parallel
+
+@lru_cache(maxsize=None)
+def _get_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
     )
+
+def __split_1_document__(document: Document, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    text_splitter = _get_text_splitter(chunk_size, chunk_overlap)
     
     text_content = document.page_content
     text_chunks = text_splitter.split_text(text_content)
@@ -23,8 +30,16 @@ def __split_1_document__(document: Document, chunk_size: int, chunk_overlap: int
     return split_documents
 
 
-def split_document(documents: List[Document], chunk_size: int, chunk_overlap: int) -> List[Document]:
-    split_documents = []
-    for doc in documents:
-        split_documents.extend(__split_1_document__(doc, chunk_size, chunk_overlap))
-    return split_documents
\ No newline at end of file
+def split_document(documents: List[Document], chunk_size: int, chunk_overlap: int, max_workers: int = 1, flatten: bool = True) -> Union[List[Document], List[List[Document]]]:
+    """
+    Split plain-text documents into chunks on paragraphs, then lines, then words. Chunks keep the document's metadata.
+    Args:
+        documents: The documents.
+        chunk_size: The maximum number of characters of a chunk.
+        chunk_overlap: The number of characters shared by consecutive chunks.
+        max_workers: The number of worker processes, 1 to split in this process (see parallel.split_parallel).
+        flatten: Return one flat list of chunks instead of one list per document.
+    Returns:
+        The chunks, flat or one list per document.
+    """
+    return split_parallel(__split_1_document__, documents, chunk_size, chunk_overlap, max_workers, flatten=flatten)
\ No newline at end of file
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_KEY_SIZE = 16
+
+def _text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=_KEY_SIZE).digest()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed, on-disk cache in front of an embedding model.
+    One directory per model, backend and dtype (they produce different vectors) holding:
+        keys.bin    - 16-byte blake2b digests of the chunk texts, one per row.
+        vectors.f32 - float32 vectors, row-major, same order as keys.bin.
+        meta.json   - the model name, backend, dtype and the vector dimension.
+    Both files are append-only, so adding new chunks never rewrites the cache.
+    """
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_dir: str, backend: str = "torch", dtype: str = "float32"):
+        """
+        Args:
+            embeddings: The embedding model to cache.
+            model_name: The name of the model, part of the cache key.
+            cache_dir: The root directory of the cache.
+            backend: The backend of the model (see get_embeddings), part of the cache key.
+            dtype: The dtype of the model weights (see get_embeddings), part of the cache key.
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.backend = backend
+        self.dtype = dtype
+        self.store_dir = os.path.join(cache_dir, re.sub(r"[^\w.-]+", "__", f"{model_name}__{backend}__{dtype}"))
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._index = {}
+        self._dim = None
+        self._load()
+
+    @property
+    def _keys_path(self) -> str:
+        return os.path.join(self.store_dir, "keys.bin")
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.store_dir, "vectors.f32")
+
+    def _load(self) -> None:
+        meta_path = os.path.join(self.store_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        expected = {"model_name": self.model_name, "backend": self.backend, "dtype": self.dtype}
+        saved = {name: meta.get(name) for name in expected}
+        if saved != expected:
+            raise ValueError(f"The embedding cache {self.store_dir} holds vectors of {saved}, not {expected}. Use another cache directory.")
+        self._dim = meta["dim"]
+
+        row_size = self._dim * 4
+        for path in (self._keys_path, self._vectors_path):
+            open(path, "ab").close()
+        with open(self._keys_path, "rb") as f:
+            keys = f.read()
+        # An interrupted append can leave one file longer than the other, keep the common rows only.
+        rows = min(len(keys) // _KEY_SIZE, os.path.getsize(self._vectors_path) // row_size)
+        with open(self._keys_path, "r+b") as f:
+            f.truncate(rows * _KEY_SIZE)
+        with open(self._vectors_path, "r+b") as f:
+            f.truncate(rows * row_size)
+
+        self._index = {keys[i * _KEY_SIZE:(i + 1) * _KEY_SIZE]: i for i in range(rows)}
+        print(f"Loaded {rows} cached embeddings from {self.store_dir}")
+
+    def _read_rows(self, rows: List[int]) -> np.ndarray:
+        if self._vectors is None:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r").reshape(-1, self._dim)
+        return np.asarray(self._vectors[rows])
+
+    def _append(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        if self._dim is None:
+            self._dim = vectors.shape[1]
+            os.makedirs(self.store_dir, exist_ok=True)
+            with open(os.path.join(self.store_dir, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"model_name": self.model_name, "backend": self.backend, "dtype": self.dtype, "dim": self._dim}, f)
+        with open(self._vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._keys_path, "ab") as f:
+            f.write(b"".join(keys))
+        for key in keys:
+            self._index[key] = len(self._index)
+        self._vectors = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed the texts, only running the model on texts not in the cache.
+        Args:
+            texts: The texts to embed.
+        Returns:
+            The embeddings.
+        """
+        keys = [_text_key(text) for text in texts]
+        with self._lock:
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._index:
+                    missing.setdefault(key, text)
+
+        if missing:
+            vectors = np.array(self.embeddings.embed_documents(list(missing.values())), dtype=np.float32)
+            with self._lock:
+                new = [(key, vector) for key, vector in zip(missing, vectors) if key not in self._index]
+                if new:
+                    self._append([key for key, _ in new], np.stack([vector for _, vector in new]))
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+            return self._read_rows([self._index[key] for key in keys]).tolist() if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def __len__(self) -> int:
+        return len(self._index)
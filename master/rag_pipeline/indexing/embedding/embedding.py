@@ -2,22 +2,65 @@ from langchain_huggingface import HuggingFaceEmbeddings
 
 import torch
 
+from ...observability.tracing import span
+
 _model_cache = {}
 
-def get_embeddings(model_name: str, show_progress: bool = True) -> HuggingFaceEmbeddings:
+EMBEDDING_BACKENDS = ["torch", "onnx", "quantized"]
+EMBEDDING_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+class _TracedEmbeddings(HuggingFaceEmbeddings):
+    """HuggingFaceEmbeddings whose calls are spans (observability/tracing.py), no-ops unless tracing is enabled."""
+    def embed_documents(self, texts):
+        with span("embedding.documents", texts=len(texts)):
+            return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        with span("embedding.query"):
+            return super().embed_query(text)
+
+def get_embeddings(model_name: str, show_progress: bool = True, batch_size: int = 15, backend: str = "torch", dtype: str = "float32") -> HuggingFaceEmbeddings:
     """
     Get the embeddings model. Cache available.
+    Texts of one call are sorted by length before batching (sentence-transformers does it in encode),
+    so larger batches cost little extra padding.
     Args:
         model_name: The name of the model.
+        show_progress: Show a progress bar while embedding.
+        batch_size: The number of texts per forward pass.
+        backend: "torch", "onnx" (ONNX Runtime, exported on first use) or "quantized" (int8 dynamic quantization of the linear layers, CPU only).
+        dtype: The torch dtype of the weights for the "torch" backend: "float32", "float16" or "bfloat16".
     Returns:
         The embeddings model.
     """
-    if model_name not in _model_cache:
-        embeddings = HuggingFaceEmbeddings(
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unsupported embedding backend: '{backend}'. Supported backends are {EMBEDDING_BACKENDS}.")
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: '{dtype}'. Supported dtypes are {list(EMBEDDING_DTYPES)}.")
+    if backend != "torch" and dtype != "float32":
+        # quantize_dynamic expects float32 Linear weights, and the ONNX export ignores torch_dtype.
+        raise ValueError(f"The '{backend}' embedding backend only supports the float32 dtype, got '{dtype}'.")
+
+    key = (model_name, batch_size, backend, dtype)
+    if key not in _model_cache:
+        device = 'cuda' if torch.cuda.is_available() and backend == "torch" else 'cpu'
+        model_kwargs = {'device': device, 'trust_remote_code': True}
+        if backend == "onnx":
+            model_kwargs['backend'] = "onnx"
+        elif dtype != "float32":
+            model_kwargs['model_kwargs'] = {'torch_dtype': EMBEDDING_DTYPES[dtype]}
+
+        embeddings = _TracedEmbeddings(
             model_name=model_name,
             show_progress=show_progress,
-            model_kwargs={'device': 'cuda' if torch.cuda.is_available() else 'cpu', 'trust_remote_code':True},
-            encode_kwargs={'batch_size': 15}
+            model_kwargs=model_kwargs,
+            encode_kwargs={'batch_size': batch_size}
         )
-        _model_cache[model_name] = embeddings
-    return _model_cache[model_name]
\ No newline at end of file
+        if backend == "quantized":
+            embeddings._client = torch.quantization.quantize_dynamic(embeddings._client, {torch.nn.Linear}, dtype=torch.qint8)
+        _model_cache[key] = embeddings
+    return _model_cache[key]
@@ -0,0 +1,159 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+class LogWriter:
+    """
+    JSONL log written by a background thread, so logging never blocks the caller:
+    - `write` only puts the record on a bounded queue. When the queue is full the record is dropped and counted.
+    - The thread writes the queued records in batches and flushes every `flush_interval` seconds.
+    - The file is rotated once it exceeds `max_bytes`: log.jsonl -> log.jsonl.1 -> ... -> log.jsonl.<backup_count>.
+    """
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backup_count: int = 5, queue_size: int = 10000, batch_size: int = 256, flush_interval: float = 1.0):
+        """
+        Args:
+            path: The JSONL file.
+            max_bytes: The size above which the file is rotated, 0 to never rotate.
+            backup_count: The number of rotated files kept.
+            queue_size: The maximum number of records waiting to be written.
+            batch_size: The maximum number of records written per flush.
+            flush_interval: The maximum number of seconds a record waits before being flushed.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.counters = {"written": 0, "dropped": 0, "rotations": 0, "errors": 0}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, record: dict) -> None:
+        """Queue a record, never blocks."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.counters["dropped"] += 1
+
+    def _rotate(self, f):
+        f.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        with self._lock:
+            self.counters["rotations"] += 1
+        return open(self.path, "a", encoding="utf-8")
+
+    def _run(self) -> None:
+        f = open(self.path, "a", encoding="utf-8")
+        try:
+            while not (self._closed.is_set() and self._queue.empty()):
+                try:
+                    batch = [self._queue.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    continue
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    f.write("".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch))
+                    f.flush()
+                    if self.max_bytes and f.tell() >= self.max_bytes:
+                        f = self._rotate(f)
+                    with self._lock:
+                        self.counters["written"] += len(batch)
+                except Exception as e:
+                    print(f"Warning: Could not write {len(batch)} log records to {self.path} ({e}).")
+                    with self._lock:
+                        self.counters["errors"] += len(batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            f.close()
+
+    def flush(self) -> None:
+        """Block until every queued record is written."""
+        self._queue.join()
+
+    def close(self, timeout: Optional[float] = 5.0) -> None:
+        """Write the queued records and stop the thread."""
+        self._closed.set()
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "queued": self._queue.qsize()}
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_log_writer(path: str, **kwargs) -> LogWriter:
+    """Get the writer of a file, shared by every thread. `kwargs` (see LogWriter) apply when it is created."""
+    path = os.path.abspath(path)
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = LogWriter(path, **kwargs)
+        return _writers[path]
+
+@atexit.register
+def _close_writers() -> None:
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.close()
+
+class RequestLog:
+    """
+    One JSONL record per request: a request id, free fields and the duration of each stage in seconds.
+    Stages are timed with `stage` (summed if repeated) or marked with `mark` (seconds since the request started).
+    """
+    def __init__(self, writer: LogWriter, **fields):
+        self.writer = writer
+        self.request_id = uuid.uuid4().hex
+        self.record = {"request_id": self.request_id, "time": datetime.now().isoformat(timespec="milliseconds"), **fields}
+        self.timings = {}
+        self._start = time.perf_counter()
+        self._committed = False
+
+    def set(self, **fields) -> None:
+        self.record.update(fields)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def mark(self, name: str) -> None:
+        self.timings[name] = time.perf_counter() - self._start
+
+    def commit(self, **fields) -> None:
+        """Queue the record with the total duration. Only the first call writes."""
+        if self._committed:
+            return
+        self._committed = True
+        self.record.update(fields)
+        self.timings["total"] = time.perf_counter() - self._start
+        self.writer.write({**self.record, "timings": {name: round(seconds, 6) for name, seconds in self.timings.items()}})
@@ -0,0 +1,331 @@
+import atexit
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets, from a cached lookup to a slow LLM call.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram:
+    """Bucketed latencies. Quantiles are interpolated within their bucket, as Prometheus' histogram_quantile."""
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf.
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                # The observed extremes are tighter than the bucket bounds.
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+class Span:
+    """
+    A timed operation. Attributes are aggregated by the tracer: numbers (token counts, number of texts...) are summed,
+    strings and booleans (cache hit/miss, provider, model...) are counted per value. Keep them low-cardinality, no queries.
+    """
+    __slots__ = ("tracer", "name", "attributes", "span_id", "trace_id", "parent_id", "start", "duration", "error", "marks")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict, parent: Optional["Span"]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = False
+        self.marks = {}
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def mark(self, name: str) -> None:
+        """Record the seconds since the span started, as the histogram "<span>.<name>" (e.g. llm.stream.first_token)."""
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self.start
+
+    def end(self, error: bool = False) -> None:
+        """Record the span. Only the first call counts."""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.start
+        self.error = error
+        self.tracer.record(self)
+
+class _NoopSpan:
+    """The span handed out while tracing is disabled."""
+    __slots__ = ()
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def mark(self, name: str) -> None:
+        pass
+
+    def end(self, error: bool = False) -> None:
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Tracer:
+    """Aggregates the finished spans: a latency histogram, an error count and the attribute totals per span name."""
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, span_log_path: Optional[str] = None):
+        """
+        Args:
+            buckets: The upper bounds of the latency buckets, in seconds.
+            span_log_path: A JSONL file receiving every finished span, None to only aggregate.
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.errors = {}
+        self.totals = {}  # (span, attribute) -> sum of the numeric values
+        self.events = {}  # (span, attribute, value) -> count
+        self.span_writer = None
+        if span_log_path is not None:
+            from .log_writer import get_log_writer
+            self.span_writer = get_log_writer(span_log_path)
+
+    def _observe(self, name: str, seconds: float) -> None:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(self.buckets)
+        self.histograms[name].observe(seconds)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Add a duration measured elsewhere (e.g. the stages of a RequestLog) to the histogram `name`."""
+        with self._lock:
+            self._observe(name, seconds)
+
+    def record(self, span: Span) -> None:
+        with self._lock:
+            self._observe(span.name, span.duration)
+            for mark, seconds in span.marks.items():
+                self._observe(f"{span.name}.{mark}", seconds)
+            if span.error:
+                self.errors[span.name] = self.errors.get(span.name, 0) + 1
+            for attribute, value in span.attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.totals[(span.name, attribute)] = self.totals.get((span.name, attribute), 0) + value
+                elif value is not None:
+                    key = (span.name, attribute, str(value).lower() if isinstance(value, bool) else str(value))
+                    self.events[key] = self.events.get(key, 0) + 1
+        if self.span_writer is not None:
+            self.span_writer.write({
+                "trace_id": span.trace_id, "span_id": span.span_id, "parent_id": span.parent_id, "name": span.name,
+                "duration": round(span.duration, 6), "error": span.error, "marks": {name: round(seconds, 6) for name, seconds in span.marks.items()},
+                **span.attributes,
+            })
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            {span: {"count", "errors", "mean", "p50", "p95", "p99", "max", "totals", "events"}}, durations in seconds.
+        """
+        with self._lock:
+            summary = {}
+            for name, histogram in sorted(self.histograms.items()):
+                summary[name] = {
+                    "count": histogram.count,
+                    "errors": self.errors.get(name, 0),
+                    "mean": histogram.sum / histogram.count,
+                    **{f"p{int(q * 100)}": histogram.quantile(q) for q in QUANTILES},
+                    "max": histogram.max,
+                    "totals": {attribute: total for (span, attribute), total in self.totals.items() if span == name},
+                    "events": {f"{attribute}={value}": count for (span, attribute, value), count in self.events.items() if span == name},
+                }
+            return summary
+
+    def format_prometheus(self) -> str:
+        """The metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP rag_span_duration_seconds Duration of the RAG pipeline spans.",
+            "# TYPE rag_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            for name, histogram in histograms:
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'rag_span_duration_seconds_bucket{{span="{_escape(name)}",le="{bound}"}} {cumulative}')
+                lines.append(f'rag_span_duration_seconds_sum{{span="{_escape(name)}"}} {histogram.sum}')
+                lines.append(f'rag_span_duration_seconds_count{{span="{_escape(name)}"}} {histogram.count}')
+            lines += ["# HELP rag_span_duration_quantile_seconds Interpolated quantiles of rag_span_duration_seconds since start.",
+                      "# TYPE rag_span_duration_quantile_seconds gauge"]
+            for name, histogram in histograms:
+                for q in QUANTILES:
+                    lines.append(f'rag_span_duration_quantile_seconds{{span="{_escape(name)}",quantile="{q}"}} {histogram.quantile(q)}')
+            lines += ["# HELP rag_span_errors_total Spans ended by an exception.", "# TYPE rag_span_errors_total counter"]
+            for name, count in sorted(self.errors.items()):
+                lines.append(f'rag_span_errors_total{{span="{_escape(name)}"}} {count}')
+            lines += ["# HELP rag_span_attribute_total Sum of the numeric span attributes (tokens, texts, documents...).", "# TYPE rag_span_attribute_total counter"]
+            for (name, attribute), total in sorted(self.totals.items()):
+                lines.append(f'rag_span_attribute_total{{span="{_escape(name)}",attribute="{_escape(attribute)}"}} {total}')
+            lines += ["# HELP rag_span_events_total Spans per value of their string attributes (cache hit/miss, provider...).", "# TYPE rag_span_events_total counter"]
+            for (name, attribute, value), count in sorted(self.events.items()):
+                lines.append(f'rag_span_events_total{{span="{_escape(name)}",attribute="{_escape(attribute)}",value="{_escape(value)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str) -> None:
+        """Write the metrics to `path`: Prometheus text for .prom (node_exporter's textfile collector), the summary as JSON otherwise."""
+        content = self.format_prometheus() if path.endswith(".prom") else json.dumps(self.summary(), indent=2)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside then renamed, so a scraper never reads a partial file.
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(f"{path}.tmp", path)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# None while tracing is disabled (the default): spans are no-ops and nothing is exported.
+_tracer = None
+_current_span = contextvars.ContextVar("current_span", default=None)
+_exporters = []
+_exporters_lock = threading.Lock()
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time the block as a span, the parent of the spans opened inside it (same thread or task).
+    Yields the span, to add attributes once known (`span.set(cache="hit")`). A no-op unless tracing is enabled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield _NOOP_SPAN
+        return
+    current = Span(tracer, name, attributes, _current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException:
+        current.end(error=True)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+def start_span(name: str, **attributes):
+    """
+    Start a span ended explicitly with `span.end()`, for operations spanning yields (streams) where the block form
+    of `span` cannot follow the context. It is not the parent of the spans opened meanwhile.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return _NOOP_SPAN
+    return Span(tracer, name, attributes, _current_span.get())
+
+def observe(name: str, seconds: float) -> None:
+    """Add a duration to the histogram `name`. A no-op unless tracing is enabled."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.observe(name, seconds)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        tracer = _tracer
+        if tracer is None or self.path.split("?")[0] not in ("/metrics", "/metrics.json"):
+            self.send_error(404)
+            return
+        if self.path.startswith("/metrics.json"):
+            body, content_type = json.dumps(tracer.summary()).encode("utf-8"), "application/json"
+        else:
+            body, content_type = tracer.format_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _export_periodically(tracer: Tracer, path: str, interval: float, stopped: threading.Event) -> None:
+    while not stopped.wait(interval):
+        try:
+            tracer.export(path)
+        except Exception as e:
+            print(f"Warning: Could not export the metrics to {path} ({e}).")
+
+def enable_tracing(metrics_port: Optional[int] = None, metrics_path: Optional[str] = None, export_interval: float = 15.0, span_log_path: Optional[str] = None, host: str = "127.0.0.1", buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Tracer:
+    """
+    Start recording spans. Tracing is disabled unless this is called.
+    Args:
+        metrics_port: Serve /metrics (Prometheus text) and /metrics.json (summary) on this port, None for no endpoint.
+        metrics_path: Write the metrics to this file every `export_interval` seconds and at exit (see Tracer.export).
+        export_interval: The seconds between two writes of `metrics_path`.
+        span_log_path: A JSONL file receiving every finished span.
+        host: The interface of the endpoint, local only by default.
+        buckets: The upper bounds of the latency buckets, in seconds.
+    Returns:
+        The tracer, also available through get_tracer().
+    """
+    global _tracer
+    disable_tracing()
+    tracer = Tracer(buckets, span_log_path)
+    with _exporters_lock:
+        if metrics_port is not None:
+            server = ThreadingHTTPServer((host, metrics_port), _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+            _exporters.append(("server", server))
+            print(f"Serving the metrics on http://{host}:{server.server_address[1]}/metrics")
+        if metrics_path is not None:
+            stopped = threading.Event()
+            threading.Thread(target=_export_periodically, args=(tracer, metrics_path, export_interval, stopped), name="metrics-export", daemon=True).start()
+            _exporters.append(("file", (tracer, metrics_path, stopped)))
+    _tracer = tracer
+    return tracer
+
+@atexit.register
+def disable_tracing() -> None:
+    """Stop recording spans, write the metrics files one last time and stop the endpoint."""
+    global _tracer
+    _tracer = None
+    with _exporters_lock:
+        exporters = list(_exporters)
+        _exporters.clear()
+    for kind, exporter in exporters:
+        if kind == "server":
+            exporter.shutdown()
+            exporter.server_close()
+        else:
+            tracer, path, stopped = exporter
+            stopped.set()
+            try:
+                tracer.export(path)
+            except Exception as e:
+                print(f"Warning: Could not export the metrics to {path} ({e}).")
@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain.schema import Document
+
+from .vector_retriever import retrieve
+from ..observability.tracing import span
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+class _LRU:
+    """Ordered dict with size and TTL eviction. Not thread-safe, RetrievalCache holds the lock."""
+    def __init__(self, max_size: int, ttl: Optional[float]):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        value, created = item
+        if self.ttl is not None and time.monotonic() - created > self.ttl:
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value) -> None:
+        self.items[key] = (value, time.monotonic())
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def values(self):
+        now = time.monotonic()
+        return [value for value, created in self.items.values() if self.ttl is None or now - created <= self.ttl]
+
+class RetrievalCache:
+    """
+    Cache in front of vretrieve for the chatbot.
+    - Exact cache: normalized query text -> query embedding, and (query, retrieval params) -> results.
+    - Semantic cache (optional): a new query whose embedding has a cosine similarity of at least
+      `semantic_threshold` with a cached query of the same params reuses that query's results.
+    Both are LRU with a TTL. Hit counters are available through `stats()`.
+    """
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 3600, semantic_threshold: Optional[float] = None):
+        """
+        Args:
+            max_size: The maximum number of cached embeddings and of cached results.
+            ttl: The number of seconds an entry stays valid, None for no expiry.
+            semantic_threshold: The cosine similarity above which cached results are reused, None to disable.
+        """
+        self.semantic_threshold = semantic_threshold
+        self._embeddings = _LRU(max_size, ttl)
+        self._results = _LRU(max_size, ttl)
+        self._lock = threading.Lock()
+        self.counters = {"embedding_hits": 0, "embedding_misses": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    def embed_query(self, query: str, vectorstore: FAISS) -> List[float]:
+        """
+        Embed the query with the vectorstore's embedding model, using the cache.
+        Args:
+            query: The query.
+            vectorstore: The vectorstore whose embedding model is used.
+        Returns:
+            The query embedding.
+        """
+        key = _normalize(query)
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            self.counters["embedding_hits" if embedding is not None else "embedding_misses"] += 1
+        if embedding is None:
+            embedding = vectorstore._embed_query(query)
+            with self._lock:
+                self._embeddings.put(key, embedding)
+        return embedding
+
+    def _semantic_lookup(self, params: tuple, embedding: List[float]) -> Optional[List[Document]]:
+        candidates = [(vector, results) for entry_params, vector, results in self._results.values() if entry_params == params]
+        if not candidates:
+            return None
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        similarities = np.stack([vector for vector, _ in candidates]) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.semantic_threshold:
+            return candidates[best][1]
+        return None
+
+    def retrieve(self, query: str, vectorstore: FAISS, docs: List[Document] = None, **kwargs) -> List[Document]:
+        """
+        Same as vretrieve, served from the cache when possible.
+        Args:
+            query: The query to search for.
+            vectorstore: The vectorstore to search in.
+            docs: The documents, needed for bm25 and hybrid.
+            **kwargs: The other vretrieve arguments (k, metric, threshold, reranker, bm25_index, reranker_k).
+        Returns:
+            A list of documents.
+        """
+        with span("retrieval_cache") as current:
+            params = tuple(sorted((name, value) for name, value in kwargs.items() if name != "bm25_index"))
+            key = (_normalize(query), params)
+            with self._lock:
+                results = self._results.get(key)
+                if results is not None:
+                    self.counters["exact_hits"] += 1
+                    current.set(cache="exact")
+                    return results[2]
+
+            embedding = self.embed_query(query, vectorstore)
+            if self.semantic_threshold is not None:
+                with self._lock:
+                    results = self._semantic_lookup(params, embedding)
+                    if results is not None:
+                        self.counters["semantic_hits"] += 1
+                        current.set(cache="semantic")
+                        return results
+
+            with self._lock:
+                self.counters["misses"] += 1
+            current.set(cache="miss")
+            results = retrieve(query, vectorstore, docs, query_embedding=embedding, **kwargs)
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+            with self._lock:
+                self._results.put(key, (params, vector, results))
+            return results
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            The counters plus the embedding and result hit rates.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        embeddings = stats["embedding_hits"] + stats["embedding_misses"]
+        stats["result_hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        stats["embedding_hit_rate"] = stats["embedding_hits"] / embeddings if embeddings else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._embeddings.items.clear()
+            self._results.items.clear()
@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from langchain_community.vectorstores import FAISS
+from langchain.schema import Document
+
+from ..indexing.bm25.bm25 import BM25Index
+
+# Shared pool for the dense half of hybrid queries. FAISS and the embedding model release the GIL,
+# so the dense search overlaps with the BM25 search running on the calling thread.
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-dense")
+
+def _doc_key(doc: Document) -> str:
+    return doc.page_content
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], k: int = 60, weights: List[float] = None) -> List[Tuple[Document, float]]:
+    """
+    Fuse ranked lists with reciprocal-rank fusion: score(d) = sum_i w_i / (k + rank_i(d)).
+    Args:
+        result_lists: The ranked lists to fuse, best first.
+        k: The RRF smoothing constant.
+        weights: The weight of each list. Defaults to 1 for every list.
+    Returns:
+        A list of (document, fused score), best first, deduplicated by chunk.
+    """
+    weights = weights or [1.0] * len(result_lists)
+    scores, first_seen = {}, {}
+    for weight, results in zip(weights, result_lists):
+        for rank, doc in enumerate(results):
+            key = _doc_key(doc)
+            first_seen.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank + 1)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [(first_seen[key], score) for key, score in ranked]
+
+def weighted_score_fusion(result_lists: List[List[Tuple[Document, float]]], weights: List[float]) -> List[Tuple[Document, float]]:
+    """
+    Fuse scored lists with a weighted sum of min-max normalized scores (higher is better).
+    Args:
+        result_lists: The lists of (document, score) to fuse.
+        weights: The weight of each list.
+    Returns:
+        A list of (document, fused score), best first, deduplicated by chunk.
+    """
+    scores, first_seen = {}, {}
+    for weight, results in zip(weights, result_lists):
+        if not results:
+            continue
+        raw = [score for _, score in results]
+        low, high = min(raw), max(raw)
+        for doc, score in results:
+            key = _doc_key(doc)
+            first_seen.setdefault(key, doc)
+            norm = (score - low) / (high - low) if high > low else 1.0
+            scores[key] = scores.get(key, 0.0) + weight * norm
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [(first_seen[key], score) for key, score in ranked]
+
+def _dense_search(query: str, vectorstore: FAISS, k: int, query_embedding: List[float] = None) -> List[Tuple[Document, float]]:
+    if query_embedding is None:
+        query_embedding = vectorstore._embed_query(query)
+    # FAISS returns L2 distances, negate them so that higher is better like BM25.
+    return [(doc, -score) for doc, score in vectorstore.similarity_search_with_score_by_vector(query_embedding, k=k)]
+
+def _sparse_search(query: str, docs: List[Document], bm25_index: BM25Index, k: int) -> List[Tuple[Document, float]]:
+    return [(docs[doc_id], score) for doc_id, score in bm25_index.search(query, k=k)]
+
+def fuse(dense: List[Tuple[Document, float]], sparse: List[Tuple[Document, float]], k: int, fusion: str = "rrf", alpha: float = 0.5, rrf_k: int = 60) -> List[Document]:
+    """
+    Fuse dense and sparse results.
+    Args:
+        dense: The dense (document, score) results, best first.
+        sparse: The sparse (document, score) results, best first.
+        k: The number of documents to return.
+        fusion: "rrf" for reciprocal-rank fusion or "weighted" for a weighted sum of normalized scores.
+        alpha: The weight of the dense results, the sparse results get 1 - alpha.
+        rrf_k: The RRF smoothing constant.
+    Returns:
+        A list of documents.
+    """
+    weights = [alpha, 1 - alpha]
+    if fusion == "rrf":
+        fused = reciprocal_rank_fusion([[doc for doc, _ in dense], [doc for doc, _ in sparse]], k=rrf_k, weights=weights)
+    elif fusion == "weighted":
+        fused = weighted_score_fusion([dense, sparse], weights=weights)
+    else:
+        raise ValueError(f"Unsupported fusion: '{fusion}'. Supported fusions are 'rrf' and 'weighted'.")
+    return [doc for doc, _ in fused[:k]]
+
+def retrieve(query: str, vectorstore: FAISS, docs: List[Document], bm25_index: BM25Index, k: int = 4, fetch_k: int = None, fusion: str = "rrf", alpha: float = 0.5, rrf_k: int = 60, query_embedding: List[float] = None) -> List[Document]:
+    """
+    Run the dense FAISS search and the sparse BM25 search concurrently and fuse them.
+    Args:
+        query: The query to search for.
+        vectorstore: The vectorstore to search in.
+        docs: The documents indexed by `bm25_index`.
+        bm25_index: The BM25 index.
+        k: The number of documents to retrieve.
+        fetch_k: The number of candidates to take from each search. Defaults to max(2 * k, 20).
+        fusion: "rrf" or "weighted".
+        alpha: The weight of the dense results, the sparse results get 1 - alpha.
+        rrf_k: The RRF smoothing constant.
+        query_embedding: The precomputed embedding of the query.
+    Returns:
+        A list of documents.
+    """
+    if docs is None or bm25_index is None:
+        raise ValueError("Documents not available. Hybrid search requires the documents and their BM25 index.")
+    fetch_k = fetch_k or max(2 * k, 20)
+
+    dense_future = _executor.submit(_dense_search, query, vectorstore, fetch_k, query_embedding)
+    sparse = _sparse_search(query, docs, bm25_index, fetch_k)
+    dense = dense_future.result()
+
+    return fuse(dense, sparse, k, fusion=fusion, alpha=alpha, rrf_k=rrf_k)
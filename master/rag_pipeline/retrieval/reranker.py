@@ -1,8 +1,100 @@
-import os
-import pickle
+import hashlib
+import threading
+from collections import OrderedDict
 from typing import List
 
 from langchain.schema import Document
 
-def rerank(docs: List[Document]) -> List[Document]:
-    return docs
\ No newline at end of file
+from ..observability.tracing import span
+
+DEFAULT_RERANKER_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+SCORE_CACHE_SIZE = 100_000
+
+_model_cache = {}
+_model_lock = threading.Lock()
+
+# LRU of (model name, pair hash) -> score, shared by all threads.
+_score_cache = OrderedDict()
+_score_lock = threading.Lock()
+
+def get_reranker(model_name: str = DEFAULT_RERANKER_MODEL, max_length: int = 512):
+    """
+    Get the cross-encoder model. Cache available.
+    Args:
+        model_name: The name of the model.
+        max_length: The maximum number of tokens of a (query, chunk) pair.
+    Returns:
+        The cross-encoder model.
+    """
+    with _model_lock:
+        if model_name not in _model_cache:
+            import torch
+            from sentence_transformers import CrossEncoder
+            _model_cache[model_name] = CrossEncoder(
+                model_name,
+                max_length=max_length,
+                device='cuda' if torch.cuda.is_available() else 'cpu',
+                trust_remote_code=True,
+            )
+    return _model_cache[model_name]
+
+def _pair_key(model_name: str, query: str, text: str) -> tuple:
+    digest = hashlib.blake2b(f"{query}\x00{text}".encode("utf-8"), digest_size=16).digest()
+    return (model_name, digest)
+
+def score_pairs(query: str, docs: List[Document], model_name: str = DEFAULT_RERANKER_MODEL, batch_size: int = 32) -> List[float]:
+    """
+    Score (query, chunk) pairs with the cross-encoder. Pairs already in the score cache are not recomputed.
+    Args:
+        query: The query.
+        docs: The documents to score.
+        model_name: The name of the cross-encoder model.
+        batch_size: The number of pairs per padded batch.
+    Returns:
+        The scores, one per document.
+    """
+    keys = [_pair_key(model_name, query, doc.page_content) for doc in docs]
+    scores = [None] * len(docs)
+    with _score_lock:
+        for i, key in enumerate(keys):
+            if key in _score_cache:
+                _score_cache.move_to_end(key)
+                scores[i] = _score_cache[key]
+
+    # Similar lengths end up in the same batch, so padding stays small.
+    missing = sorted((i for i, score in enumerate(scores) if score is None), key=lambda i: len(docs[i].page_content))
+    if missing:
+        model = get_reranker(model_name)
+        with span("rerank.predict", pairs=len(missing)):
+            predicted = model.predict(
+                [(query, docs[i].page_content) for i in missing],
+                batch_size=batch_size,
+                show_progress_bar=False,
+            )
+        with _score_lock:
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+                _score_cache[keys[i]] = scores[i]
+            while len(_score_cache) > SCORE_CACHE_SIZE:
+                _score_cache.popitem(last=False)
+    return scores
+
+def rerank(query: str, docs: List[Document], model_name: str = DEFAULT_RERANKER_MODEL, top_n: int = None, batch_size: int = 32) -> List[Document]:
+    """
+    Rerank the documents with a cross-encoder.
+    Args:
+        query: The query the documents were retrieved for.
+        docs: The documents to rerank.
+        model_name: The name of the cross-encoder model.
+        top_n: The number of documents to keep. Keeps all by default.
+        batch_size: The number of pairs per padded batch.
+    Returns:
+        The documents sorted by cross-encoder score, truncated to top_n.
+    """
+    if not docs:
+        return docs
+    # rerank.predict counts the pairs not in the score cache, the others are hits.
+    with span("rerank", documents=len(docs)):
+        scores = score_pairs(query, docs, model_name, batch_size)
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        return [docs[i] for i in order[:top_n]]
@@ -0,0 +1,136 @@
+import re
+import threading
+from typing import List, Optional, Tuple
+
+from .cache import _LRU, _normalize
+
+NO_NEED = "NO NEED"
+
+# Messages made only of these words need no documents (greetings, thanks, acknowledgements).
+SMALL_TALK_WORDS = {
+    "hi", "hello", "hey", "thanks", "thank", "you", "ok", "okay", "bye", "goodbye", "good", "morning", "night", "great", "nice",
+    "chào", "xin", "cảm", "ơn", "cám", "bạn", "bác", "sĩ", "nhé", "nha", "ạ", "ok", "vâng", "dạ", "được", "rồi", "tạm", "biệt", "hẹn", "gặp", "lại",
+    "tốt", "quá", "hay", "nhiều", "em", "anh", "chị", "tôi", "mình", "à", "ừ", "ờ",
+}
+
+# Words pointing back to the conversation: the message alone is not a good search query.
+FOLLOW_UP_WORDS = {
+    "it", "its", "that", "this", "these", "those", "they", "them", "he", "she", "above", "previous", "more",
+    "nó", "đó", "này", "ấy", "vậy", "thế", "kia", "trên", "họ", "thêm", "tiếp",
+}
+
+# Question and filler words: a follow-up made only of these and medical terms names no subject ("liều dùng bao nhiêu?").
+QUESTION_WORDS = {
+    "what", "which", "how", "much", "many", "why", "when", "where", "who", "is", "are", "can", "should", "do", "does", "i", "my", "the", "a", "an",
+    "of", "for", "to", "take", "use", "about", "and", "or", "any",
+    "gì", "nào", "sao", "bao", "nhiêu", "lâu", "đâu", "ai", "khi", "như", "thế", "là", "có", "không", "được", "nên", "phải", "bị", "thì", "và",
+    "hay", "hoặc", "của", "cho", "với", "dùng", "uống", "làm", "cách", "một", "các", "những", "mấy", "lần", "ngày",
+}
+
+# Phrases (matched on word boundaries) marking a medical question.
+MEDICAL_TERMS = (
+    "bệnh", "thuốc", "triệu chứng", "điều trị", "chữa", "chẩn đoán", "đau", "sốt", "ho", "viêm", "nhiễm", "ung thư", "tiểu đường", "đái tháo đường",
+    "huyết áp", "tim", "gan", "thận", "phổi", "dạ dày", "virus", "vi khuẩn", "vắc xin", "tiêm", "liều", "mang thai", "thai", "dị ứng", "xét nghiệm",
+    "phẫu thuật", "tác dụng phụ", "kháng sinh", "biến chứng", "hội chứng", "nguyên nhân",
+    "disease", "symptom", "symptoms", "treatment", "treat", "drug", "drugs", "medication", "medicine", "dose", "dosage", "pain", "fever", "cancer",
+    "diabetes", "blood pressure", "hypertension", "infection", "virus", "bacteria", "vaccine", "pregnancy", "allergy", "surgery", "diagnosis",
+    "side effect", "side effects", "antibiotic", "antibiotics", "syndrome",
+)
+
+# Politeness removed from the start of a message used as the search query.
+QUERY_PREFIXES = ("chào bác sĩ", "bác sĩ ơi", "cho tôi hỏi", "cho em hỏi", "cho mình hỏi", "xin hỏi", "tôi muốn hỏi", "hello", "hi", "please")
+
+_word_re = re.compile(r"\w+")
+_prefix_re = re.compile(r"^(?:" + "|".join(re.escape(prefix) for prefix in QUERY_PREFIXES) + r")\b[\s,.:!]*", re.IGNORECASE)
+
+def _words(text: str) -> List[str]:
+    return _word_re.findall(text.lower())
+
+class RetrievalRouter:
+    """
+    Local replacement of the request_retrieve_prompt LLM call for the common cases:
+    - Small talk (only greetings, thanks...) -> NO NEED.
+    - A message already rewritten by the LLM after the same turn -> the cached rewrite.
+    - A self-contained medical question (a medical term, no reference to earlier turns) -> the message as the query.
+    With history, the message may be elliptical ("liều dùng bao nhiêu?") or answer the bot ("vâng"): both shortcuts then
+    also require the last bot turn not to be a question, and a medical question must name a subject of its own.
+    Anything else is left to the LLM (route returns None), and its rewrite is cached with `record`.
+    Benchmark it on logged conversations with test/bench_router.py.
+    """
+    def __init__(self, max_size: int = 4096, ttl: Optional[float] = None, min_words: int = 3):
+        """
+        Args:
+            max_size: The maximum number of cached rewrites.
+            ttl: The number of seconds a rewrite stays valid, None for no expiry.
+            min_words: The minimum number of words of a message used as the query as is.
+        """
+        self.min_words = min_words
+        self._rewrites = _LRU(max_size, ttl)
+        self._lock = threading.Lock()
+        self.counters = {"small_talk": 0, "cache": 0, "medical": 0, "llm": 0}
+
+    def _key(self, message: str, history: List[Tuple[str, str]]) -> tuple:
+        # The cache is shared by every chat: a rewrite only applies after the same turn.
+        if history:
+            user_msg, bot_msg = history[-1]
+            return _normalize(message), _normalize(user_msg), _normalize(bot_msg or "")
+        return _normalize(message),
+
+    def _classify(self, message: str, history: List[Tuple[str, str]]) -> Tuple[Optional[str], str]:
+        words = _words(message)
+        if not words:
+            return NO_NEED, "small_talk"
+        # An answer to the bot's question ("vâng", "3 ngày") is meaningful only with that question.
+        if history and (history[-1][1] or "").rstrip().endswith("?"):
+            return None, "llm"
+        if all(word in SMALL_TALK_WORDS for word in words):
+            return NO_NEED, "small_talk"
+        if len(words) < self.min_words or FOLLOW_UP_WORDS.intersection(words):
+            return None, "llm"
+        padded = f" {' '.join(words)} "
+        if not any(f" {term} " in padded for term in MEDICAL_TERMS):
+            return None, "llm"
+        if history:
+            for term in MEDICAL_TERMS:
+                padded = padded.replace(f" {term} ", " ")
+            if all(word in QUESTION_WORDS or word in SMALL_TALK_WORDS for word in padded.split()):
+                return None, "llm"
+        query = " ".join(message.split())
+        return _prefix_re.sub("", query) or query, "medical"
+
+    def route(self, message: str, history: List[Tuple[str, str]] = None) -> Tuple[Optional[str], str]:
+        """
+        Args:
+            message: The user message.
+            history: The previous (user, bot) turns.
+        Returns:
+            (query, reason): the search query or NO_NEED, or None when the LLM has to decide,
+            and the reason: "small_talk", "cache", "medical" or "llm".
+        """
+        query, reason = self._classify(message, history)
+        if reason != "small_talk":
+            with self._lock:
+                cached = self._rewrites.get(self._key(message, history))
+            if cached is not None:
+                query, reason = cached, "cache"
+        with self._lock:
+            self.counters[reason] += 1
+        return query, reason
+
+    def record(self, message: str, history: List[Tuple[str, str]], query: str) -> None:
+        """Cache the LLM rewrite (or NO_NEED) of a message routed to the LLM."""
+        if not query:
+            return
+        with self._lock:
+            self._rewrites.put(self._key(message, history), query)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            The number of messages per reason and the fraction decided without the LLM.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        total = sum(stats.values())
+        stats["local_rate"] = (total - stats["llm"]) / total if total else 0.0
+        return stats
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+from typing import Awaitable, List, Optional, Tuple
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain.schema import Document
+
+from .cache import RetrievalCache
+from .hybrid_retriever import reciprocal_rank_fusion
+from .router import NO_NEED
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return float(a @ b / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
+
+def _consume(future: asyncio.Future) -> None:
+    # A discarded speculation may fail, do not report it as never retrieved.
+    if not future.cancelled():
+        future.exception()
+
+class SpeculativeRetriever:
+    """
+    Hide retrieval behind the query-rewrite LLM call: the raw user message is retrieved concurrently with the rewrite.
+    When the rewrite arrives:
+    - NO NEED: the speculative results are dropped.
+    - The rewritten query embeds within `reuse_threshold` of the message: the speculative results are used as is.
+    - Otherwise the rewritten query is retrieved and fused with the speculative results (weighted RRF, the rewrite first).
+    Retrievals go through the RetrievalCache, so the embeddings computed for the comparison are reused.
+    """
+    def __init__(self, retrieval_cache: RetrievalCache, reuse_threshold: float = 0.9, speculative_weight: float = 0.5):
+        """
+        Args:
+            retrieval_cache: The cache the retrievals go through.
+            reuse_threshold: The cosine similarity between message and rewrite above which the speculative results are reused.
+            speculative_weight: The RRF weight of the speculative results when merged (the rewrite's weight is 1).
+        """
+        self.retrieval_cache = retrieval_cache
+        self.reuse_threshold = reuse_threshold
+        self.speculative_weight = speculative_weight
+        self._lock = threading.Lock()
+        self.counters = {"reused": 0, "merged": 0, "discarded": 0, "failed": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    async def retrieve(self, message: str, rewrite: Awaitable[str], vectorstore: FAISS, docs: List[Document] = None, k: int = 4, **kwargs) -> Tuple[str, List[Document]]:
+        """
+        Args:
+            message: The raw user message, retrieved speculatively.
+            rewrite: The pending query rewrite (the request_retrieve_prompt call), returning the query or NO NEED.
+            vectorstore: The vectorstore to search in.
+            docs: The documents, needed for bm25 and hybrid.
+            k: The number of documents to retrieve.
+            **kwargs: The other vretrieve arguments (metric, threshold, reranker, bm25_index, reranker_k).
+        Returns:
+            (rewritten query, documents), no documents for NO NEED.
+        """
+        speculation = asyncio.ensure_future(asyncio.to_thread(self.retrieval_cache.retrieve, message, vectorstore, docs, k=k, **kwargs))
+        try:
+            query = await rewrite
+        except BaseException:
+            speculation.add_done_callback(_consume)
+            raise
+        if NO_NEED in query:
+            speculation.add_done_callback(_consume)
+            self._count("discarded")
+            return query, []
+
+        speculative = await self._await_speculation(speculation)
+        if speculative is None:
+            return query, await asyncio.to_thread(self.retrieval_cache.retrieve, query, vectorstore, docs, k=k, **kwargs)
+
+        # Both embeddings are cached: the message's by the speculation, the query's for the retrieval below.
+        message_embedding = await asyncio.to_thread(self.retrieval_cache.embed_query, message, vectorstore)
+        query_embedding = await asyncio.to_thread(self.retrieval_cache.embed_query, query, vectorstore)
+        if _cosine(message_embedding, query_embedding) >= self.reuse_threshold:
+            self._count("reused")
+            return query, speculative
+
+        results = await asyncio.to_thread(self.retrieval_cache.retrieve, query, vectorstore, docs, k=k, **kwargs)
+        self._count("merged")
+        fused = reciprocal_rank_fusion([results, speculative], weights=[1.0, self.speculative_weight])
+        return query, [doc for doc, _ in fused[:k]]
+
+    async def _await_speculation(self, speculation: asyncio.Future) -> Optional[List[Document]]:
+        try:
+            return await speculation
+        except Exception as e:
+            print(f"Warning: Speculative retrieval failed ({e}), retrieving the rewritten query only.")
+            self._count("failed")
+            return None
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            The number of rewrites whose speculative results were reused, merged, discarded (NO NEED) or failed.
+        """
+        with self._lock:
+            return dict(self.counters)
@@ -3,10 +3,22 @@ from langchain.schema import Document
 from langchain_community.embeddings import HuggingFaceEmbeddings
 
 from .reranker import rerank
+from .hybrid_retriever import retrieve as hybrid_retrieve, fuse
+from ..indexing.bm25.bm25 import BM25Index
+from ..observability.tracing import span
 
-from typing import List, Any
+import numpy as np
+from typing import List, Tuple
 
-def retrieve(query: str, vectorstore: FAISS, docs: List[Document] = None, k: int = 4, metric: str = "cosine", threshold: float = 0.5, reranker: Any = None) -> List[Document]:
+def _require_bm25_index(docs: List[Document], bm25_index: BM25Index) -> BM25Index:
+    if docs is None:
+        raise ValueError("Documents not available. BM25 requires ingested or loaded documents.")
+    if bm25_index is None:
+        print("Warning: No BM25 index given. Building one for this query only, pass the index from load_local instead.")
+        bm25_index = BM25Index.from_documents(docs)
+    return bm25_index
+
+def retrieve(query: str, vectorstore: FAISS, docs: List[Document] = None, k: int = 4, metric: str = "cosine", threshold: float = 0.5, reranker: str = None, bm25_index: BM25Index = None, reranker_k: int = 20, query_embedding: List[float] = None) -> List[Document]:
     """
     Retrieve documents from the vectorstore based on the query and metric.
     Args:
@@ -15,24 +27,129 @@ def retrieve(query: str, vectorstore: FAISS, docs: List[Document] = None, k: int
        vectorstore: The vectorstore to search in.
        k: The number of documents to retrieve.
        threshold: The threshold for the metric to use for retrieval.
-       reranker: The reranker to use for reranking the retrieved documents.
+       reranker: The cross-encoder model name used to rerank the retrieved documents. No reranking if None.
+       bm25_index: The prebuilt BM25 index over `docs` (see utils.load_local).
+       reranker_k: The number of candidates retrieved for the reranker, the best k are kept.
+       query_embedding: The precomputed embedding of the query, skips embedding it again.
     Returns:
        A list of documents.
     """
-    if metric == "cosine":
-        docs = vectorstore.similarity_search_with_score(query, k=k)
-        docs = [doc for doc, score in docs if score > threshold]
-    elif metric == "mmr":
-        docs = vectorstore.max_marginal_relevance_search(query, k=k)
-    elif metric == "bm25":
-        from langchain_community.retrievers import BM25Retriever
-        if docs is None:
-            raise ValueError("Documents not available. BM25 requires ingested or loaded documents.")
-        bm25_retriever = BM25Retriever.from_documents(docs)
-        docs = bm25_retriever.get_relevant_documents(query, k=k)
-    else:
-        raise ValueError(f"Unsupported metric: '{metric}'. Supported metrics are 'similarity', 'mmr', and 'bm25'.")
-    
+    with span("retrieve", metric=metric, reranker=reranker is not None) as current:
+        top_n = k
+        if reranker is not None:
+            k = max(k, reranker_k)
+        if query_embedding is None and metric in ("cosine", "mmr"):
+            query_embedding = vectorstore._embed_query(query)
+
+        with span("retrieve.search", metric=metric):
+            if metric == "cosine":
+                docs = vectorstore.similarity_search_with_score_by_vector(query_embedding, k=k)
+                docs = [doc for doc, score in docs if score > threshold]
+            elif metric == "mmr":
+                # fetch_k grows with k, or a reranker_k above LangChain's default of 20 would rerank 20 candidates only.
+                docs = vectorstore.max_marginal_relevance_search_by_vector(query_embedding, k=k, fetch_k=max(20, k))
+            elif metric == "bm25":
+                bm25_index = _require_bm25_index(docs, bm25_index)
+                docs = [docs[doc_id] for doc_id, score in bm25_index.search(query, k=k)]
+            elif metric == "hybrid":
+                bm25_index = _require_bm25_index(docs, bm25_index)
+                docs = hybrid_retrieve(query, vectorstore, docs, bm25_index, k=k, query_embedding=query_embedding)
+            else:
+                raise ValueError(f"Unsupported metric: '{metric}'. Supported metrics are 'similarity', 'mmr', 'bm25' and 'hybrid'.")
+
+        if (reranker != None):
+            docs = rerank(query, docs, reranker, top_n=top_n)
+        current.set(documents=len(docs))
+        return docs
+
+def _search_rows(vectorstore: FAISS, vectors: np.ndarray, k: int) -> List[List[Tuple[Document, float, int]]]:
+    """One matrix FAISS search for all vectors. Returns (document, distance, faiss row) per query."""
+    scores, indices = vectorstore.index.search(vectors, k)
+    results = []
+    for row_scores, row_indices in zip(scores, indices):
+        row = []
+        for score, i in zip(row_scores, row_indices):
+            if i == -1:
+                # This happens when not enough docs are returned.
+                continue
+            row.append((vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]), float(score), int(i)))
+        results.append(row)
+    return results
+
+def retrieve_batch(queries: List[str], vectorstore: FAISS, docs: List[Document] = None, k: int = 4, metric: str = "cosine", threshold: float = 0.5, reranker: str = None, bm25_index: BM25Index = None, reranker_k: int = 20, batch_size: int = 256, fetch_k: int = 20, lambda_mult: float = 0.5, show_progress: bool = False, query_embeddings: np.ndarray = None) -> List[List[Document]]:
+    """
+    Retrieve documents for many queries at once. Queries are embedded in batches of `batch_size`
+    and each batch is answered with one FAISS search, same results as calling `retrieve` per query.
+    Args:
+       queries: The queries to search for.
+       vectorstore: The vectorstore to search in.
+       docs: The documents, needed for bm25 and hybrid.
+       k: The number of documents to retrieve per query.
+       metric: The metric to use for retrieval. Can be "cosine", "mmr", "bm25" or "hybrid".
+       threshold: The threshold for the cosine metric.
+       reranker: The cross-encoder model name used to rerank the retrieved documents. No reranking if None.
+       bm25_index: The prebuilt BM25 index over `docs`.
+       reranker_k: The number of candidates retrieved for the reranker, the best k are kept.
+       batch_size: The number of queries embedded and searched together.
+       fetch_k: The number of candidates for mmr (and per search for hybrid).
+       lambda_mult: The diversity of mmr, 0 is maximum diversity.
+       show_progress: Show a progress bar over the batches.
+       query_embeddings: The precomputed embeddings of the queries (one row per query), skips embedding them again.
+    Returns:
+       A list of document lists, one per query.
+    """
+    from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+    if metric not in ("cosine", "mmr", "bm25", "hybrid"):
+        raise ValueError(f"Unsupported metric: '{metric}'. Supported metrics are 'similarity', 'mmr', 'bm25' and 'hybrid'.")
+    if metric in ("bm25", "hybrid"):
+        bm25_index = _require_bm25_index(docs, bm25_index)
+    top_n = k
+    if reranker is not None:
+        k = max(k, reranker_k)
+
+    batches = range(0, len(queries), batch_size)
+    if show_progress:
+        from tqdm import tqdm
+        batches = tqdm(batches, desc="Retrieving documents")
+
+    results = []
+    for start in batches:
+        batch = queries[start:start + batch_size]
+
+        if metric == "bm25":
+            results.extend([[docs[doc_id] for doc_id, _ in bm25_index.search(query, k=k)] for query in batch])
+            continue
+
+        if query_embeddings is not None:
+            vectors = np.array(query_embeddings[start:start + batch_size], dtype=np.float32)
+        else:
+            vectors = np.array(vectorstore._embed_documents(batch), dtype=np.float32)
+
+        # One span per batch of queries, the embedding and reranking spans are separate.
+        with span("retrieve_batch.search", metric=metric, queries=len(batch)):
+            if metric == "cosine":
+                if vectorstore._normalize_L2:
+                    import faiss
+                    faiss.normalize_L2(vectors)
+                for row in _search_rows(vectorstore, vectors, k):
+                    results.append([doc for doc, score, _ in row if score > threshold])
+            elif metric == "mmr":
+                # Same as FAISS.max_marginal_relevance_search: no query normalization, fetch_k candidates.
+                for vector, row in zip(vectors, _search_rows(vectorstore, vectors, fetch_k)):
+                    candidates = np.array([vectorstore.index.reconstruct(i) for _, _, i in row], dtype=np.float32)
+                    selected = maximal_marginal_relevance(vector[None, :], candidates, k=k, lambda_mult=lambda_mult) if len(row) > 0 else []
+                    results.append([row[i][0] for i in selected])
+            elif metric == "hybrid":
+                if vectorstore._normalize_L2:
+                    import faiss
+                    faiss.normalize_L2(vectors)
+                hybrid_k = max(2 * k, fetch_k)
+                for query, row in zip(batch, _search_rows(vectorstore, vectors, hybrid_k)):
+                    dense = [(doc, -score) for doc, score, _ in row]
+                    sparse = [(docs[doc_id], score) for doc_id, score in bm25_index.search(query, k=hybrid_k)]
+                    results.append(fuse(dense, sparse, k))
+
     if (reranker != None):
-        return rerank(docs)
-    return docs
\ No newline at end of file
+        return [rerank(query, result, reranker, top_n=top_n) for query, result in zip(queries, results)]
+    return results
@@ -0,0 +1,91 @@
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from ..rag_pipeline import get_embeddings
+from ..rag_pipeline.indexing.ann.ann import build_index, set_search_params
+from ..utils import load_local, load_qa_dataset
+
+def index_size(index: faiss.Index) -> int:
+    return len(faiss.serialize_index(index))
+
+def bench(index: faiss.Index, queries: np.ndarray, ground_truth: np.ndarray, k: int, num_latency_queries: int):
+    _, rows = index.search(queries, k)
+    recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(ground_truth, rows)])
+    latencies = []
+    for query in queries[:num_latency_queries]:
+        start = time.perf_counter()
+        index.search(query[None], k)
+        latencies.append(time.perf_counter() - start)
+    return recall, latencies
+
+def main(args):
+    embed_model = get_embeddings(args.embed_model_name, show_progress=False)
+    vectorstore, _, _ = load_local(args.vectorstore_dir, embed_model)
+    if vectorstore is None:
+        raise ValueError(f"No vectorstore found in {args.vectorstore_dir}.")
+    vectors = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
+    _, questions, _, _ = load_qa_dataset(args.qa_data_path)
+    queries = np.array(embed_model.embed_documents(questions[:args.num_queries]), dtype=np.float32)
+
+    # Exact search is the ground truth.
+    flat = build_index("flat", vectors.shape[1])
+    flat.add(vectors)
+    _, ground_truth = flat.search(queries, args.k)
+
+    rng = np.random.default_rng(args.seed)
+    sample = vectors[rng.choice(len(vectors), size=min(args.train_size, len(vectors)), replace=False)]
+
+    print(f"{'index':<10} {'param':<14} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p95 ms':>8} {'size MB':>9} {'build s':>8}")
+    for index_type in args.index_types:
+        start = time.perf_counter()
+        index = build_index(index_type, vectors.shape[1], num_train=len(sample), nlist=args.nlist, pq_m=args.pq_m, pq_nbits=args.pq_nbits, hnsw_m=args.hnsw_m)
+        if not index.is_trained:
+            index.train(sample)
+        index.add(vectors)
+        build_time = time.perf_counter() - start
+        size = index_size(index) / 2**20
+
+        if index_type in ("ivf_flat", "ivf_pq"):
+            params = [("nprobe", value) for value in args.nprobe]
+        elif index_type == "hnsw":
+            params = [("ef_search", value) for value in args.ef_search]
+        else:
+            params = [("-", None)]
+        for name, value in params:
+            if value is not None:
+                set_search_params(index, **{name: value})
+            recall, latencies = bench(index, queries, ground_truth, args.k, args.num_latency_queries)
+            param = f"{name}={value}" if value is not None else name
+            print(f"{index_type:<10} {param:<14} {recall:10.3f} {np.percentile(latencies, 50) * 1000:8.2f} {np.percentile(latencies, 95) * 1000:8.2f} {size:9.1f} {build_time:8.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--vectorstore_dir", type=str, default="notebook/An/master/knowledge/vectorstore_full", help="A flat vectorstore, its vectors are re-indexed")
+    parser.add_argument("--qa_data_path", type=str, default="dataset/QA Data/MedMCQA/translated_hard_questions.jsonl")
+    parser.add_argument("--embed_model_name", type=str, default="alibaba-nlp/gte-multilingual-base")
+
+    # Index params
+    parser.add_argument("--index_types", type=str, nargs="+", default=["flat", "ivf_flat", "ivf_pq", "hnsw"])
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--pq_m", type=int, default=16)
+    parser.add_argument("--pq_nbits", type=int, default=8)
+    parser.add_argument("--hnsw_m", type=int, default=32)
+    parser.add_argument("--train_size", type=int, default=100_000)
+
+    # Bench params
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--ef_search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--num_queries", type=int, default=500)
+    parser.add_argument("--num_latency_queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
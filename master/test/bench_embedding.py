@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import numpy as np
+
+from ..rag_pipeline import get_embeddings
+from ..utils import load_local, load_qa_dataset
+
+def top_k(query_vectors: np.ndarray, doc_vectors: np.ndarray, k: int) -> np.ndarray:
+    query_vectors = query_vectors / np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    doc_vectors = doc_vectors / np.linalg.norm(doc_vectors, axis=1, keepdims=True)
+    return np.argsort(-query_vectors @ doc_vectors.T, axis=1)[:, :k]
+
+def parse_config(config: str) -> dict:
+    """backend:dtype:batch_size, e.g. torch:float32:15 or quantized:float32:64"""
+    backend, dtype, batch_size = config.split(":")
+    return {"backend": backend, "dtype": dtype, "batch_size": int(batch_size)}
+
+def bench(model_name: str, config: dict, texts: list, queries: list, num_latency_queries: int):
+    model = get_embeddings(model_name, show_progress=False, **config)
+    model.embed_documents(texts[:8])  # Warm up (and export for onnx).
+
+    start = time.perf_counter()
+    doc_vectors = np.array(model.embed_documents(texts), dtype=np.float32)
+    doc_throughput = len(texts) / (time.perf_counter() - start)
+
+    latencies = []
+    for query in queries[:num_latency_queries]:
+        start = time.perf_counter()
+        model.embed_query(query)
+        latencies.append(time.perf_counter() - start)
+
+    query_vectors = np.array(model.embed_documents(queries), dtype=np.float32)
+    return doc_vectors, query_vectors, doc_throughput, latencies
+
+def main(args):
+    reference = parse_config(args.reference)
+    _, docs, _ = load_local(args.vectorstore_dir, get_embeddings(args.embed_model_name, show_progress=False, **reference))
+    if docs is None:
+        raise ValueError(f"No documents found in {args.vectorstore_dir}.")
+    rng = np.random.default_rng(args.seed)
+    texts = [docs[i].page_content for i in rng.choice(len(docs), size=min(args.num_docs, len(docs)), replace=False)]
+    _, queries, _, _ = load_qa_dataset(args.qa_data_path)
+    queries = queries[:args.num_queries]
+
+    ref_docs, ref_queries, ref_throughput, ref_latencies = bench(args.embed_model_name, reference, texts, queries, args.num_latency_queries)
+    ref_top = top_k(ref_queries, ref_docs, args.k)
+
+    print(f"{'config':<28} {'docs/s':>10} {'query p50 ms':>13} {'query p95 ms':>13} {'recall@' + str(args.k):>10}")
+    print(f"{args.reference:<28} {ref_throughput:10.1f} {np.percentile(ref_latencies, 50) * 1000:13.1f} {np.percentile(ref_latencies, 95) * 1000:13.1f} {1.0:10.3f}")
+    for config in args.configs:
+        doc_vectors, query_vectors, throughput, latencies = bench(args.embed_model_name, parse_config(config), texts, queries, args.num_latency_queries)
+        candidate_top = top_k(query_vectors, doc_vectors, args.k)
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(ref_top, candidate_top)])
+        print(f"{config:<28} {throughput:10.1f} {np.percentile(latencies, 50) * 1000:13.1f} {np.percentile(latencies, 95) * 1000:13.1f} {recall:10.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--vectorstore_dir", type=str, default="notebook/An/master/knowledge/vectorstore_full")
+    parser.add_argument("--qa_data_path", type=str, default="dataset/QA Data/MedMCQA/translated_hard_questions.jsonl")
+    parser.add_argument("--embed_model_name", type=str, default="alibaba-nlp/gte-multilingual-base")
+
+    # Bench params
+    parser.add_argument("--reference", type=str, default="torch:float32:15", help="backend:dtype:batch_size of the reference path")
+    parser.add_argument("--configs", type=str, nargs="+", default=["torch:float32:64", "quantized:float32:64", "onnx:float32:64"], help="backend:dtype:batch_size of each candidate")
+    parser.add_argument("--num_docs", type=int, default=2000, help="Number of chunks embedded for throughput and recall")
+    parser.add_argument("--num_queries", type=int, default=200, help="Number of questions used for recall")
+    parser.add_argument("--num_latency_queries", type=int, default=50, help="Number of single-query embeddings timed")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
@@ -0,0 +1,125 @@
+import argparse
+import json
+import re
+import time
+
+import numpy as np
+
+from ..rag_pipeline import RetrievalRouter, NO_NEED
+
+_field_re = re.compile(r"^\*\* (.+?) \*\*: ?(.*)$")
+
+def parse_log(log_path: str) -> list:
+    """
+    Parse the turns logged by app.py, log.jsonl or the former log.txt.
+    Returns:
+        {"User message", "RAG query", "Router"} per turn.
+    """
+    if log_path.endswith(".jsonl"):
+        with open(log_path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        turns = []
+        for record in records:
+            if "rag_query" not in record:
+                continue
+            previous_turn = record.get("previous_turn")
+            if previous_turn == [record["message"], ""]:
+                # Logged by an app.py that passed the current message as the last turn: the previous turn is unknown.
+                previous_turn = None
+            turns.append({"User message": record["message"], "RAG query": record["rag_query"], "Router": record.get("route", "llm"), "Previous turn": previous_turn})
+        return turns
+
+    turns, turn, field = [], {}, None
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.startswith("=" * 50):
+                if turn:
+                    turns.append(turn)
+                turn, field = {}, None
+                continue
+            match = _field_re.match(line)
+            if match:
+                field = match.group(1)
+                turn[field] = match.group(2)
+            elif field is not None:
+                turn[field] += "\n" + line
+    if turn:
+        turns.append(turn)
+    return [{name: value.strip() for name, value in turn.items()} for turn in turns]
+
+def overlap(a: list, b: list) -> float:
+    a, b = {doc.page_content for doc in a}, {doc.page_content for doc in b}
+    return len(a & b) / max(len(a | b), 1)
+
+def main(args):
+    turns = parse_log(args.log_path)
+    # Turns decided by the router have no LLM rewrite to compare with.
+    turns = [turn for turn in turns if "User message" in turn and "RAG query" in turn and turn.get("Router", "llm") == "llm"]
+    print(f"{len(turns)} turns with an LLM rewrite in {args.log_path}")
+    if not turns:
+        return
+
+    retrieve = None
+    if args.vectorstore_dir is not None:
+        from ..rag_pipeline import get_embeddings, vretrieve
+        from ..utils import load_local
+        vectorstore, docs, bm25_index = load_local(args.vectorstore_dir, get_embeddings(args.embed_model_name, show_progress=False))
+        retrieve = lambda query: vretrieve(query, vectorstore, docs, k=args.k, metric=args.metric, threshold=args.threshold, bm25_index=bm25_index)
+
+    # Replay the turns in order: the LLM rewrite of an unsure turn is recorded, as app.py does.
+    # Turns are routed after their previous turn when the log has it (log.jsonl), without history otherwise (log.txt).
+    router = RetrievalRouter(max_size=args.max_size)
+    counts = {"agree": 0, "false_no_need": 0, "false_retrieve": 0, "stale_cache": 0}
+    latencies, overlaps = [], []
+    for turn in turns:
+        llm_query = turn["RAG query"]
+        history = [tuple(turn["Previous turn"])] if turn.get("Previous turn") else []
+        start = time.perf_counter()
+        query, reason = router.route(turn["User message"], history)
+        latencies.append(time.perf_counter() - start)
+        if query is None:
+            router.record(turn["User message"], history, llm_query)
+            continue
+        router_need, llm_need = NO_NEED not in query, NO_NEED not in llm_query
+        if reason == "cache" and query != llm_query:
+            # A rewrite recorded in another context, e.g. a follow-up of another conversation.
+            counts["stale_cache"] += 1
+        if router_need == llm_need:
+            counts["agree"] += 1
+        else:
+            counts["false_no_need" if llm_need else "false_retrieve"] += 1
+        if retrieve is not None and router_need and llm_need:
+            overlaps.append(overlap(retrieve(query), retrieve(llm_query)))
+        if args.verbose and router_need != llm_need:
+            print(f"[{reason}] {turn['User message']!r}: router {query!r}, LLM {llm_query!r}")
+
+    stats = router.stats()
+    local = len(turns) - stats["llm"]
+    print(f"Routing: {stats}")
+    print(f"Decided locally: {local}/{len(turns)} ({stats['local_rate']:.1%}), LLM calls saved")
+    if local:
+        print(f"Agreement with the LLM on retrieve vs NO NEED: {counts['agree'] / local:.1%} "
+              f"(false NO NEED: {counts['false_no_need']}, false retrieve: {counts['false_retrieve']})")
+        print(f"Cached rewrites differing from the LLM's: {counts['stale_cache']}/{stats['cache']}")
+    if overlaps:
+        print(f"Retrieved documents shared with the LLM query (Jaccard@{args.k}): {np.mean(overlaps):.3f} over {len(overlaps)} turns")
+    print(f"Routing latency: p50 {np.percentile(latencies, 50) * 1e6:.1f} us, p95 {np.percentile(latencies, 95) * 1e6:.1f} us")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log_path", type=str, default="log.jsonl", help="log.jsonl, or a log.txt of earlier versions")
+    parser.add_argument("--max_size", type=int, default=4096, help="Size of the router's rewrite cache")
+    parser.add_argument("--verbose", action="store_true", default=False, help="Print the turns where the router and the LLM disagree")
+
+    # Optional: compare the documents retrieved with the router's query and with the LLM's query
+    parser.add_argument("--vectorstore_dir", type=str, default=None)
+    parser.add_argument("--embed_model_name", type=str, default="alibaba-nlp/gte-multilingual-base")
+    parser.add_argument("--metric", type=str, choices=["cosine", "mmr", "bm25", "hybrid"], default="mmr")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--threshold", type=float, default=0.7)
+
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
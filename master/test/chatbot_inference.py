@@ -1,23 +1,39 @@
-from rag_pipeline import get_embeddings, vretrieve, rerank
-from utils import load_local
-
 import argparse
 
-def inference():
-    embed_model = get_embeddings(args.embed_model_name)
-    vectorstore, docs = load_local(args.vectorstore_dir, embed_model)
-    retrieve_results = vretrieve(args.query, vectorstore, docs, args.retriever_k, args.metric, args.threshold)
-    
-    retrieve_results = rerank(retrieve_results)
+from ..rag_pipeline import get_embeddings, vretrieve
+from ..utils import load_local
+
+def inference(query, vectorstore, docs, bm25_index, args):
+    # Reranking is opt-in: the cross-encoder is only loaded with --reranker_model_name.
+    retrieve_results = vretrieve(query, vectorstore, docs, args.retriever_k, args.metric, args.threshold, reranker=args.reranker_model_name, bm25_index=bm25_index, reranker_k=args.reranker_k)
 
     print(retrieve_results)
 
-def conversation():
+def conversation(args):
+    embed_model = get_embeddings(args.embed_model_name)
+    vectorstore, docs, bm25_index = load_local(args.vectorstore_dir, embed_model)
     while True:
         query = input("User: ")
         if query == "exit":
             break
-        inference(query)
+        inference(query, vectorstore, docs, bm25_index, args)
 
 if __name__ == '__main__':
-    conversation()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+
+    # Vectorstore params
+    parser.add_argument("--vectorstore_dir", type=str, required=False, default="notebook/An/master/knowledge/vectorstore_full")
+
+    # Model params
+    parser.add_argument("--embed_model_name", type=str, default="alibaba-nlp/gte-multilingual-base")
+
+    # Vectorstore retriever params
+    parser.add_argument("--metric", type=str, choices=["cosine", "mmr", "bm25", "hybrid"], default="cosine")
+    parser.add_argument("--retriever_k", type=int, default=4, help="Number of documents to retrieve")
+    parser.add_argument("--threshold", type=float, default=0.7, help="Threshold for cosine similarity")
+    parser.add_argument("--reranker_model_name", type=str, default=None)
+    parser.add_argument("--reranker_k", type=int, default=20, help="Number of documents to rerank")
+
+    args = parser.parse_args()
+
+    conversation(args)
@@ -1,44 +1,158 @@
 import argparse
 import os
+import tempfile
 from typing import List
 
-from ..rag_pipeline import get_embeddings, load_data
+from ..rag_pipeline import get_embeddings, CachedEmbeddings
+from ..rag_pipeline.data_ingest.loader import list_files
+from ..rag_pipeline.data_ingest.pipeline import run_ingest_pipeline
+from ..rag_pipeline.data_ingest.manifest import load_manifest, save_manifest, diff_manifest, chunk_ids, file_entry
+from ..rag_pipeline.indexing.ann.ann import INDEX_TYPES, create_vectorstore, delete, set_search_params, supports_remove, save_index_config, load_index_config
 from ..utils import load_local, save_local
 
+def chunk_documents(documents, args):
+    """Returns the chunks of each document, one list per document."""
+    if args.chunk_method == "recursive":
+        from ..rag_pipeline import recursive_chunking
+        return recursive_chunking(documents, args.chunk_size, args.chunk_overlap, args.chunk_workers, flatten=False)
+    elif args.chunk_method == "markdown":
+        from ..rag_pipeline import markdown_chunking
+        return markdown_chunking(documents, args.chunk_size, args.chunk_overlap, args.chunk_workers, flatten=False)
+    return [[document] for document in documents]
+
 def main(args):
     print(f"Log: {args}")
 
-    if args.clear_vectorstore:
+    if args.clear_vectorstore and not args.incremental:
         import shutil
         if os.path.isdir(args.vectorstore_dir):
             shutil.rmtree(args.vectorstore_dir)
 
-    embed_model = get_embeddings(args.embed_model_name)
-    vectorstore, docs = load_local(args.vectorstore_dir, embed_model)
-
-    new_docs = []
-    for data_path in args.data_paths:
-        new_docs.extend(load_data(data_path, args.file_type))
-    print(f"Got {len(new_docs)} documents.")
-
-    if args.chunk_method == "recursive":
-        from ..rag_pipeline import recursive_chunking
-        new_docs = recursive_chunking(new_docs, args.chunk_size, args.chunk_overlap)
-    elif args.chunk_method == "markdown":
-        from ..rag_pipeline import markdown_chunking
-        new_docs = markdown_chunking(new_docs, args.chunk_size, args.chunk_overlap)
-    print(f"Got {len(new_docs)} chunks.")
-
-    from langchain_community.vectorstores import FAISS
+    embed_model = get_embeddings(args.embed_model_name, batch_size=args.embed_batch_size, backend=args.embed_backend, dtype=args.embed_dtype)
+    if args.embed_cache_dir:
+        embed_model = CachedEmbeddings(embed_model, args.embed_model_name, args.embed_cache_dir, backend=args.embed_backend, dtype=args.embed_dtype)
+    vectorstore, docs, _ = load_local(args.vectorstore_dir, embed_model)
+    if vectorstore is not None:
+        saved_index_type = load_index_config(args.vectorstore_dir)["index_type"]
+        if saved_index_type != args.index_type:
+            print(f"Warning: The vectorstore uses a '{saved_index_type}' index, ignoring --index_type {args.index_type}.")
+            args.index_type = saved_index_type
+
+    manifest = load_manifest(args.vectorstore_dir)
+    if vectorstore is not None and not manifest:
+        print("Warning: The vectorstore has no manifest, so its chunks cannot be matched to files. Rebuilding it from scratch.")
+        vectorstore, docs = None, None
+    if vectorstore is None:
+        manifest = {}
+
+    file_paths = [os.path.normpath(f) for data_path in args.data_paths for f in list_files(data_path, args.file_type)]
+    added, modified, deleted, hashes = diff_manifest(manifest, file_paths)
+    print(f"Got {len(file_paths)} files: {len(added)} added, {len(modified)} modified, {len(deleted)} deleted.")
+    if vectorstore is not None and not (added or modified or deleted):
+        save_manifest(args.vectorstore_dir, manifest)
+        print("Vectorstore is up to date.")
+        return
+
+    # Drop the chunks of deleted and modified files before re-adding the modified ones.
+    stale_ids = [chunk_id for file_path in modified + deleted for chunk_id in manifest.pop(file_path)["chunk_ids"]]
+    if stale_ids:
+        if not supports_remove(vectorstore.index):
+            raise ValueError(f"The '{args.index_type}' index does not support removing vectors. Re-run without --incremental to rebuild it.")
+        delete(vectorstore, stale_ids)
+        stale = set(stale_ids)
+        docs = [doc for doc in docs if doc.id not in stale]
+        print(f"Removed {len(stale_ids)} stale chunks.")
+
+    import numpy as np
+    docs = docs if docs is not None else []
+
+    def chunk_files(files):
+        file_paths, documents = zip(*files)
+        chunked = []
+        for file_path, chunks in zip(file_paths, chunk_documents(list(documents), args)):
+            ids = chunk_ids(file_path, len(chunks))
+            for chunk, chunk_id in zip(chunks, ids):
+                chunk.id = chunk_id
+            chunked.extend(chunks)
+            manifest[file_path] = file_entry(file_path, ids, hashes.get(file_path))
+        return chunked
+
+    def add(chunks, vectors):
+        text_embeddings = [(chunk.page_content, vector) for chunk, vector in zip(chunks, vectors)]
+        metadatas = [chunk.metadata for chunk in chunks]
+        ids = [chunk.id for chunk in chunks]
+        vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        docs.extend(chunks)
+
+    # IVF indexes are trained before the first add. Their quantizers are trained on a uniform sample of all the vectors
+    # (reservoir sampling), not on the first files ingested: until the pipeline ends, the vectors are spilled to a
+    # temporary file and the chunks held back.
+    train_size = args.train_size if args.index_type in ("ivf_flat", "ivf_pq") else 0
+    rng = np.random.default_rng(args.seed)
+    pending, sample, seen = [], [], 0
+    spill = None
+
+    def create(sample_vectors):
+        nonlocal vectorstore
+        vectorstore = create_vectorstore(
+            embed_model, sample_vectors, args.index_type,
+            nlist=args.nlist, pq_m=args.pq_m, pq_nbits=args.pq_nbits, hnsw_m=args.hnsw_m,
+        )
+
+    def flush():
+        create(np.stack(sample))
+        dim = sample[0].shape[0]
+        spill.seek(0)
+        for chunks in pending:
+            add(chunks, np.frombuffer(spill.read(len(chunks) * dim * 4), dtype=np.float32).reshape(len(chunks), dim))
+        pending.clear()
+        spill.close()
+
+    def write(chunks, vectors):
+        nonlocal seen, spill
+        if vectorstore is None and not train_size:
+            create(vectors)  # Flat and HNSW indexes need no training.
+        if vectorstore is not None:
+            add(chunks, vectors)
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        for vector in vectors:
+            seen += 1
+            if len(sample) < train_size:
+                sample.append(vector.copy())
+            else:
+                slot = rng.integers(seen)
+                if slot < train_size:
+                    sample[slot] = vector.copy()
+        if spill is None:
+            spill = tempfile.TemporaryFile()
+        spill.write(vectors.tobytes())
+        pending.append(chunks)
+
+    # Load, chunk, embed and write run concurrently, connected by bounded queues.
+    stats = run_ingest_pipeline(
+        added + modified, chunk_files, embed_model, write,
+        batch_size=args.ingest_batch_size,
+        group_size=args.chunk_group_size,
+        queue_size=args.queue_size,
+        load_workers=args.load_workers,
+    )
+    for stage_stats in stats:
+        print(stage_stats)
+    print(f"Successfully consumed {stats[-1].items} chunks.")
+
+    if pending:
+        flush()
     if vectorstore is None:
-        vectorstore = FAISS.from_documents(new_docs, embed_model)
-        docs = new_docs
-        print(f"Successfully consumed {len(new_docs)} documents.")
-    else:
-        docs.extend(new_docs)
-        vectorstore.add_documents(new_docs)
+        print("Nothing to ingest.")
+        return
 
+    set_search_params(vectorstore.index, nprobe=args.nprobe, ef_search=args.ef_search)
     save_local(args.vectorstore_dir, vectorstore, docs)
+    save_index_config(args.vectorstore_dir, {"index_type": args.index_type, "nprobe": args.nprobe, "ef_search": args.ef_search})
+    save_manifest(args.vectorstore_dir, manifest)
+    if args.embed_cache_dir:
+        print(f"Embedding cache: {embed_model.hits} hits, {embed_model.misses} misses.")
 
     import json
     with open(os.path.join(args.vectorstore_dir, "config.json"), "a") as f:
@@ -59,18 +173,37 @@ if __name__ == '__main__':
     parser.add_argument("--data_paths", type=List[str], required=False, default=data_paths)
     parser.add_argument("--vectorstore_dir", type=str, required=False, default="notebook/An/master/knowledge/vectorstore_full")
     parser.add_argument("--file_type", type=str, choices=["pdf", "txt"], default="txt")
+    parser.add_argument("--load_workers", type=int, default=8, help="Number of threads reading source files")
+    parser.add_argument("--ingest_batch_size", type=int, default=512, help="Number of chunks embedded and added to the vectorstore at once")
+    parser.add_argument("--queue_size", type=int, default=4, help="Number of file groups / chunk batches buffered between ingest stages")
  
     # Model params
     parser.add_argument("--embed_model_name", type=str, default="alibaba-nlp/gte-multilingual-base")
+    parser.add_argument("--embed_batch_size", type=int, default=15)
+    parser.add_argument("--embed_backend", type=str, choices=["torch", "onnx", "quantized"], default="torch")
+    parser.add_argument("--embed_dtype", type=str, choices=["float32", "float16", "bfloat16"], default="float32")
+    parser.add_argument("--embed_cache_dir", type=str, default="notebook/An/master/knowledge/embedding_cache", help="Content-addressed embedding cache, empty string to disable")
 
     # Index params
     parser.add_argument("--chunk_size", type=int, default=2048)
     parser.add_argument("--chunk_overlap", type=int, default=512)
     parser.add_argument("--chunk_method", type=str, choices=["recursive", "markdown"], default="markdown")
+    parser.add_argument("--chunk_workers", type=int, default=None, help="Number of chunking processes, defaults to all cores, 1 to chunk in-process")
+    parser.add_argument("--chunk_group_size", type=int, default=64, help="Number of files chunked together on the process pool")
 
     # Vectorstore params
     parser.add_argument("--vectorstore", type=str, choices=["faiss", "chroma"], default="faiss")
     parser.add_argument("--clear_vectorstore", action="store_true", default=True)
+    parser.add_argument("--incremental", action="store_true", default=False, help="Only re-ingest added/modified files and drop chunks of deleted ones, using the manifest")
+    parser.add_argument("--index_type", type=str, choices=INDEX_TYPES, default="flat", help="FAISS index, see test/bench_ann.py for the recall/latency trade-off")
+    parser.add_argument("--nlist", type=int, default=1024, help="Number of IVF lists, lowered to fit the training sample")
+    parser.add_argument("--pq_m", type=int, default=16, help="Number of PQ sub-quantizers (ivf_pq), must divide the embedding dimension")
+    parser.add_argument("--pq_nbits", type=int, default=8, help="Bits per PQ code (ivf_pq)")
+    parser.add_argument("--hnsw_m", type=int, default=32, help="Neighbours per HNSW node")
+    parser.add_argument("--train_size", type=int, default=100_000, help="Number of vectors the IVF quantizers are trained on, sampled uniformly from all the ingested vectors")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the IVF training sample")
+    parser.add_argument("--nprobe", type=int, default=32, help="Default number of IVF lists visited per query, saved with the index")
+    parser.add_argument("--ef_search", type=int, default=64, help="Default HNSW search beam width, saved with the index")
 
 
     args = parser.parse_args()
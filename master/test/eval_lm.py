@@ -1,6 +1,14 @@
 import argparse
+import asyncio
+import os
 from ..rag_pipeline import qa_prompt
-from ..rag_pipeline import ChatAssistant
+from ..rag_pipeline import AsyncChatAssistant
+from ..rag_pipeline.generation.llm_wrapper import set_max_concurrency
+from ..rag_pipeline.generation.rate_limiter import rate_limit_stats, override_rate_limit
+from ..rag_pipeline.evaluation.runner import run_eval_async, completed_records, fingerprint, summarize_results, format_summary
+from ..rag_pipeline.observability.log_writer import get_log_writer
+from ..rag_pipeline.observability.tracing import enable_tracing
+from ..rag_pipeline.evaluation.batch import BATCH_FORMATS, write_batch_file, uncached_requests, ingest_batch_results
 from ..utils import load_qa_dataset, load_prepared_retrieve_docs
 
 from typing import List, Optional
@@ -15,31 +23,29 @@ def build_qa_prompt(question: str, document: Optional[List[Document]]) -> str:
     
     return qa_prompt.format(question=question, document=document)
 
-def process_question(question, prompt, answer, id, args, llm):
-    llm_response = llm.get_response("", prompt)
+async def process_question(item, args, llm):
+    llm_response, usage = await llm.get_response("", item["prompt"], return_usage=True)
     # ans = get_answer_from_response(llm_response)
-    with open("log.txt", "a", encoding="utf-8") as f:
-        f.write(f"ID: {id}\n")
-        f.write(prompt)
-        f.write(f"LLM Response:\n{llm_response}\n")
-        f.write(f"Answer: {answer} \n\n")
-
-    # with open("log_score.txt", "a", encoding="utf-8") as f:
-    #     f.write("1" if ans == answer else "0")
-    # return 1 if ans == answer else 0
-    return llm_response
-
-def evaluate_qa(questions, prompts, answers, ids, args, llm):
-    import concurrent.futures
-    from tqdm import tqdm
-    ans = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
-        futures = [executor.submit(process_question, questions[i], prompts[i], answers[i], ids[i], args, llm) for i in range(len(questions))]
-        for future in tqdm(concurrent.futures.as_completed(futures), total=len(questions)):
-            ans.append(future.result())
-    return ans
+    get_log_writer(args.log_path).write({"id": item["id"], "run": item["run"], "fingerprint": item["fingerprint"], "model": llm.model_name, "prompt": item["prompt"], "response": llm_response, "answer": item["answer"]})
+
+    return {"answer": item["answer"], "response": llm_response, "usage": usage}
+
+def evaluate_qa(items, args, llm):
+    records = asyncio.run(run_eval_async(items, lambda item: process_question(item, args, llm), args.results_path, concurrency=args.concurrency, resume=not args.restart))
+    print(format_summary(summarize_results(records, len(items))))
+    return [record["response"] for record in records]
+
+def write_batch(items, args, llm):
+    """Write the questions not evaluated nor cached yet as a batch input file."""
+    done = {} if args.restart else completed_records(items, args.results_path)
+    requests = [{"custom_id": str(item["id"]), "user": "", "sys": item["prompt"]} for item in items if item["id"] not in done]
+    requests = uncached_requests(requests, llm.cache, args.provider, args.model_name, llm.sampling_params)
+    write_batch_file(requests, args.batch_file, args.model_name, llm.sampling_params, format=args.batch_format)
+    print(f"Wrote {len(requests)} requests to {args.batch_file}. Submit it to the {args.batch_format} batch API, then rerun with --batch_results <output file>.")
 
 def main(args):
+    if args.metrics_path is not None:
+        enable_tracing(metrics_path=args.metrics_path)
     ids, questions, options, answers = load_qa_dataset(args.qa_file)
 
     if ids is None:
@@ -56,12 +62,29 @@ def main(args):
 
     prompts = [build_qa_prompt(questions[i], docs[i]) for i in range(len(questions))]
 
-    llm = ChatAssistant(args.model_name, args.provider)
-
-    with open("log_score.txt", "a", encoding="utf-8") as f:
-            f.write("\n")
-
-    qa_results = evaluate_qa(questions, prompts, answers, ids, args, llm)
+    set_max_concurrency(args.provider, args.concurrency)
+    override_rate_limit(args.provider, args.rpm, args.tpm)
+    llm = AsyncChatAssistant(args.model_name, args.provider, cache_path=None if args.no_cache else args.cache_path)
+
+    if args.results_path is None:
+        args.results_path = os.path.join("eval_results", f"{os.path.splitext(os.path.basename(args.qa_file))[0]}_{args.model_name.replace(':', '-')}_{args.num_docs}docs_lm.jsonl")
+    if args.batch_file is None:
+        args.batch_file = os.path.splitext(args.results_path)[0] + "_batch.jsonl"
+
+    run = os.path.splitext(os.path.basename(args.results_path))[0]
+    items = [{"id": ids[i], "run": run, "prompt": prompts[i], "answer": answers[i], "fingerprint": fingerprint(prompts[i], args.provider, args.model_name, llm.sampling_params)} for i in range(len(questions))]
+    if (args.write_batch or args.batch_results is not None) and llm.cache is None:
+        raise ValueError("Batch mode goes through the response cache, remove --no_cache.")
+    if args.write_batch:
+        write_batch(items, args, llm)
+        return
+    if args.batch_results is not None:
+        print(f"Batch results: {ingest_batch_results(args.batch_file, args.batch_results, llm.cache, args.provider, args.model_name)}")
+
+    qa_results = evaluate_qa(items, args, llm)
+    if llm.cache:
+        print(f"Response cache: {llm.cache.stats()}")
+    print(f"Rate limits: {rate_limit_stats()}")
     qa_results = [qa_results[i][qa_results[i].rfind("[")+1:qa_results[i].rfind("]")] for i in range(len(qa_results))]
     # print(f"{qa_results}")
     import pyperclip
@@ -75,8 +98,20 @@ if __name__ == '__main__':
 
     parser.add_argument("--model_name", type=str, default="mistral-medium")
     parser.add_argument("--provider", type=str, default="mistral")
-    parser.add_argument("--max_workers", type=int, default=4)
+    parser.add_argument("--concurrency", "--max_workers", type=int, default=64, help="Max requests in flight (--max_workers is a deprecated alias)")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute allowed by your account tier, 0 for unlimited (default: the provider's, or <PROVIDER>_RPM)")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute allowed by your account tier, 0 for unlimited (default: the provider's, or <PROVIDER>_TPM)")
     parser.add_argument("--num_docs", type=int, default=0)
+    parser.add_argument("--cache_path", type=str, default="llm_cache.sqlite", help="SQLite cache of LLM responses, reruns only pay for new prompts")
+    parser.add_argument("--no_cache", action="store_true", default=False, help="Always query the provider")
+    parser.add_argument("--results_path", type=str, default=None, help="JSONL of per-question results, defaults to eval_results/<qa file>_<model>_<num_docs>docs_lm.jsonl")
+    parser.add_argument("--restart", action="store_true", default=False, help="Discard the results of a previous run instead of resuming it")
+    parser.add_argument("--log_path", type=str, default="eval_log.jsonl", help="JSONL log of the prompts and responses, written in the background")
+    parser.add_argument("--metrics_path", type=str, default=None, help="Latency histograms of the LLM calls (p50/p95/p99), .prom for Prometheus text or .json")
+    parser.add_argument("--write_batch", action="store_true", default=False, help="Write the pending questions to --batch_file for the provider's batch API and exit")
+    parser.add_argument("--batch_file", type=str, default=None, help="Batch input file, defaults to <results_path>_batch.jsonl")
+    parser.add_argument("--batch_format", type=str, default="mistral", choices=BATCH_FORMATS)
+    parser.add_argument("--batch_results", type=str, default=None, help="Output file of the batch job, its responses are cached before evaluating")
 
     parser.add_argument("--dataset_path", type=str)
 
@@ -1,6 +1,15 @@
 import argparse
+import asyncio
+import json
+import os
 from ..rag_pipeline import multichoice_qa_prompt
-from ..rag_pipeline import ChatAssistant
+from ..rag_pipeline import AsyncChatAssistant
+from ..rag_pipeline.generation.llm_wrapper import set_max_concurrency
+from ..rag_pipeline.generation.rate_limiter import rate_limit_stats, override_rate_limit
+from ..rag_pipeline.evaluation.runner import run_eval_async, completed_records, fingerprint, summarize_results, format_summary
+from ..rag_pipeline.observability.log_writer import get_log_writer
+from ..rag_pipeline.observability.tracing import enable_tracing
+from ..rag_pipeline.evaluation.batch import BATCH_FORMATS, write_batch_file, uncached_requests, ingest_batch_results
 from ..utils import paralelize, load_qa_dataset, load_prepared_retrieve_docs
 
 from datetime import datetime
@@ -22,38 +31,40 @@ def build_multichoice_qa_prompt(question: str, options: str, document: Optional[
     
     return multichoice_qa_prompt.format(question=question, options=options, document=document)
 
-def process_question(question, prompt, answer, id, args, llm):
-    llm_response = ""
+async def process_question(item, args, llm):
+    llm_response, usage, ans, error = "", None, "#", None
     for j in range(args.retries):
         try:
-            llm_response = llm.get_response("", prompt)
+            # A cached response that failed to parse would fail again, so retries bypass the cache.
+            llm_response, usage = await llm.get_response("", item["prompt"], use_cache=(j == 0), return_usage=True)
             ans = get_answer_from_response(llm_response)
             if ans in ["A", "B", "C", "D", "E"]:
-                with open("log.txt", "a", encoding="utf-8") as f:
-                    f.write(f"ID: {id}\n")
-                    f.write(prompt)
-                    f.write(f"LLM Response:\n{llm_response}\n")
-                    f.write(f"Answer: {answer}  {ans}\n\n")
+                get_log_writer(args.log_path).write({"id": item["id"], "run": item["run"], "fingerprint": item["fingerprint"], "model": llm.model_name, "prompt": item["prompt"], "response": llm_response, "answer": item["answer"], "prediction": ans})
                 break
         except Exception as e:
             print(f"Error: {e}")
-            ans = "#"
-    with open("log_score.txt", "a", encoding="utf-8") as f:
-        f.write("1" if ans == answer else "0")
-    return 1 if ans == answer else 0
+            ans, error = "#", e
+    if error is not None and not llm_response:
+        # No response at all, leave the question out of the results so that a resumed run retries it.
+        raise error
+    return {"answer": item["answer"], "prediction": ans, "correct": ans == item["answer"], "attempts": j + 1, "response": llm_response, "usage": usage}
+
+def evaluate_qa(items, args, llm):
+    records = asyncio.run(run_eval_async(items, lambda item: process_question(item, args, llm), args.results_path, concurrency=args.concurrency, resume=not args.restart))
+    return summarize_results(records, len(items))
 
-def evaluate_qa(questions, prompts, answers, ids, args, llm):
-    import concurrent.futures
-    from tqdm import tqdm
-    correct = 0
-    with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
-        futures = [executor.submit(process_question, questions[i], prompts[i], answers[i], ids[i], args, llm) for i in range(len(questions))]
-        for future in tqdm(concurrent.futures.as_completed(futures), total=len(questions)):
-            correct += future.result()
-    return correct / len(questions)
+def write_batch(items, args, llm):
+    """Write the questions not evaluated nor cached yet as a batch input file."""
+    done = {} if args.restart else completed_records(items, args.results_path)
+    requests = [{"custom_id": str(item["id"]), "user": "", "sys": item["prompt"]} for item in items if item["id"] not in done]
+    requests = uncached_requests(requests, llm.cache, args.provider, args.model_name, llm.sampling_params)
+    write_batch_file(requests, args.batch_file, args.model_name, llm.sampling_params, format=args.batch_format)
+    print(f"Wrote {len(requests)} requests to {args.batch_file}. Submit it to the {args.batch_format} batch API, then rerun with --batch_results <output file>.")
 
 
 def main(args):
+    if args.metrics_path is not None:
+        enable_tracing(metrics_path=args.metrics_path)
     ids, questions, options, answers = load_qa_dataset(args.qa_file)
 
     if ids is None:
@@ -71,13 +82,33 @@ def main(args):
     prompts = [build_multichoice_qa_prompt(questions[i], options[i], docs[i]) for i in range(len(questions))]
 
     # print(prompts[0])
-    llm = ChatAssistant(args.model_name, args.provider)
-
+    set_max_concurrency(args.provider, args.concurrency)
+    override_rate_limit(args.provider, args.rpm, args.tpm)
+    llm = AsyncChatAssistant(args.model_name, args.provider, cache_path=None if args.no_cache else args.cache_path)
+
+    if args.results_path is None:
+        args.results_path = os.path.join("eval_results", f"{os.path.splitext(os.path.basename(args.qa_file))[0]}_{args.model_name.replace(':', '-')}_{args.num_docs}docs.jsonl")
+    if args.batch_file is None:
+        args.batch_file = os.path.splitext(args.results_path)[0] + "_batch.jsonl"
+
+    run = os.path.splitext(os.path.basename(args.results_path))[0]
+    items = [{"id": ids[i], "run": run, "prompt": prompts[i], "answer": answers[i], "fingerprint": fingerprint(prompts[i], args.provider, args.model_name, llm.sampling_params)} for i in range(len(questions))]
+    if (args.write_batch or args.batch_results is not None) and llm.cache is None:
+        raise ValueError("Batch mode goes through the response cache, remove --no_cache.")
+    if args.write_batch:
+        write_batch(items, args, llm)
+        return
+    if args.batch_results is not None:
+        # Batch responses are served from the cache, the questions missing from the batch are sent live.
+        print(f"Batch results: {ingest_batch_results(args.batch_file, args.batch_results, llm.cache, args.provider, args.model_name)}")
+
+    summary = evaluate_qa(items, args, llm)
+    print(format_summary(summary))
     with open("log_score.txt", "a", encoding="utf-8") as f:
-            f.write(f"\n{datetime.now()} {args}\n")
-
-    acc = evaluate_qa(questions, prompts, answers, ids, args, llm)
-    print(f"Accuracy: {acc}")
+        f.write(f"\n{datetime.now()} {args}\n{json.dumps(summary)}\n")
+    if llm.cache:
+        print(f"Response cache: {llm.cache.stats()}")
+    print(f"Rate limits: {rate_limit_stats()}")
     
 
 if __name__ == '__main__':
@@ -92,9 +123,21 @@ if __name__ == '__main__':
     # Eval params
     parser.add_argument("--model_name", type=str, default="mistral-medium")
     parser.add_argument("--provider", type=str, default="mistral")
-    parser.add_argument("--max_workers", type=int, default=4)
+    parser.add_argument("--concurrency", "--max_workers", type=int, default=64, help="Max requests in flight (--max_workers is a deprecated alias)")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute allowed by your account tier, 0 for unlimited (default: the provider's, or <PROVIDER>_RPM)")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute allowed by your account tier, 0 for unlimited (default: the provider's, or <PROVIDER>_TPM)")
     parser.add_argument("--num_docs", type=int, default=0)
+    parser.add_argument("--cache_path", type=str, default="llm_cache.sqlite", help="SQLite cache of LLM responses, reruns only pay for new prompts")
+    parser.add_argument("--no_cache", action="store_true", default=False, help="Always query the provider")
     parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--results_path", type=str, default=None, help="JSONL of per-question results, defaults to eval_results/<qa file>_<model>_<num_docs>docs.jsonl")
+    parser.add_argument("--restart", action="store_true", default=False, help="Discard the results of a previous run instead of resuming it")
+    parser.add_argument("--log_path", type=str, default="eval_log.jsonl", help="JSONL log of the prompts and responses, written in the background")
+    parser.add_argument("--metrics_path", type=str, default=None, help="Latency histograms of the LLM calls (p50/p95/p99), .prom for Prometheus text or .json")
+    parser.add_argument("--write_batch", action="store_true", default=False, help="Write the pending questions to --batch_file for the provider's batch API and exit")
+    parser.add_argument("--batch_file", type=str, default=None, help="Batch input file, defaults to <results_path>_batch.jsonl")
+    parser.add_argument("--batch_format", type=str, default="mistral", choices=BATCH_FORMATS)
+    parser.add_argument("--batch_results", type=str, default=None, help="Output file of the batch job, its responses are cached before evaluating")
 
 
     # Dataset params
@@ -0,0 +1,141 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stand-in for an OpenAI-compatible provider, for testing the evaluation scripts without paying for tokens:
+#   python -m master.test.mock_llm_server --port 8000 --latency 0.5 --error_rate 0.05
+#   python -m master.test.eval_qa --provider mock --model_name mock --concurrency 256
+# It can also play a batch job, turning a batch input file into the output file the provider would return:
+#   python -m master.test.mock_llm_server --batch_input batch.jsonl --batch_output batch_results.jsonl
+
+def mock_content(messages: list) -> str:
+    """A deterministic answer per prompt, in the format the evaluation prompts ask for."""
+    prompt = "".join(message["content"] for message in messages)
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    return f"Mock response. The answer is {'ABCDE'[digest[0] % 5]}"
+
+def mock_completion(body: dict) -> dict:
+    content = mock_content(body["messages"])
+    prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    error_rate = 0.0
+    stats = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data: dict, headers: dict = None):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def _stream(self, completion: dict):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in completion["choices"][0]["message"]["content"].split(" "):
+            chunk = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"], "model": completion["model"],
+                     "choices": [{"index": 0, "delta": {"content": token + " "}, "finish_reason": None}]}
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._send_chunk(b"")
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        try:
+            time.sleep(self.latency)
+            if random.random() < self.error_rate:
+                with self.lock:
+                    self.stats["errors"] += 1
+                self._send_json(429, {"error": {"message": "Mock rate limit"}}, {"Retry-After": "0.1"})
+                return
+            completion = mock_completion(body)
+            if body.get("stream"):
+                self._stream(completion)
+            else:
+                self._send_json(200, completion)
+        finally:
+            with self.lock:
+                self.stats["in_flight"] -= 1
+
+    def do_GET(self):
+        with self.lock:
+            stats = dict(self.stats)
+        self._send_json(200, stats)
+
+def serve(host: str = "localhost", port: int = 8000, latency: float = 0.0, error_rate: float = 0.0) -> ThreadingHTTPServer:
+    """Start the server on a background thread, stop it with server.shutdown()."""
+    MockHandler.latency = latency
+    MockHandler.error_rate = error_rate
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run_batch(input_path: str, output_path: str, error_rate: float = 0.0) -> None:
+    """Write the output file of a batch job (OpenAI or Mistral input format), failing `error_rate` of the requests."""
+    with open(input_path, "r", encoding="utf-8") as f_in, open(output_path, "w", encoding="utf-8") as f_out:
+        for i, line in enumerate(f_in):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if random.random() < error_rate:
+                result = {"id": f"batch_req_{i}", "custom_id": request["custom_id"], "response": None, "error": {"code": "server_error", "message": "Mock error"}}
+            else:
+                result = {"id": f"batch_req_{i}", "custom_id": request["custom_id"], "response": {"status_code": 200, "body": mock_completion(request["body"])}, "error": None}
+            f_out.write(json.dumps(result) + "\n")
+
+def main(args):
+    if args.batch_input is not None:
+        run_batch(args.batch_input, args.batch_output, args.error_rate)
+        print(f"Wrote {args.batch_output}")
+        return
+    server = serve(args.host, args.port, args.latency, args.error_rate)
+    print(f"Mock LLM server on http://{args.host}:{args.port}/v1 (GET / for stats), Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per request, to exercise concurrency")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests answered with a 429 (or failed, in batch mode)")
+    parser.add_argument("--batch_input", type=str, default=None, help="Answer a batch input file instead of serving")
+    parser.add_argument("--batch_output", type=str, default="batch_results.jsonl")
+    args = parser.parse_args()
+    print(args)
+    main(args)
@@ -1,12 +1,12 @@
 import argparse
 import os
 
-from ..rag_pipeline import get_embeddings, vretrieve
+from ..rag_pipeline import get_embeddings, vretrieve_batch
 from ..utils import load_local, load_qa_dataset, safe_save_langchain_docs
 
 def main(args):
-    embed_model = get_embeddings(args.embed_model_name, show_progress=False)
-    vectorstore, docs = load_local(args.vectorstore_dir, embed_model)
+    embed_model = get_embeddings(args.embed_model_name, show_progress=False, batch_size=args.embed_batch_size, backend=args.embed_backend, dtype=args.embed_dtype)
+    vectorstore, docs, bm25_index = load_local(args.vectorstore_dir, embed_model)
 
     ids, questions, options, answers = load_qa_dataset(args.qa_data_path)
     
@@ -16,8 +16,7 @@ def main(args):
         with open(args.rag_queries_path, "r", encoding="utf-8") as f:
             rag_queries = [json.loads(line)["query"] for line in f]
 
-    from tqdm import tqdm
-    retrieve_results = [vretrieve(rag_queries[i], vectorstore, docs, args.retriever_k, args.metric, args.threshold) for i in tqdm(range(len(rag_queries)), desc="Retrieving documents")]
+    retrieve_results = vretrieve_batch(rag_queries, vectorstore, docs, args.retriever_k, args.metric, args.threshold, reranker=args.reranker_model_name, bm25_index=bm25_index, reranker_k=args.reranker_k, batch_size=args.batch_size, show_progress=True)
 
     safe_save_langchain_docs(retrieve_results, args.prepared_retrieve_docs_path)
 
@@ -35,12 +34,16 @@ if __name__ == '__main__':
 
     # Model params
     parser.add_argument("--embed_model_name", type=str, default="alibaba-nlp/gte-multilingual-base")
+    parser.add_argument("--embed_batch_size", type=int, default=64)
+    parser.add_argument("--embed_backend", type=str, choices=["torch", "onnx", "quantized"], default="torch")
+    parser.add_argument("--embed_dtype", type=str, choices=["float32", "float16", "bfloat16"], default="float32")
 
     # Vectorstore retriever params
     parser.add_argument("--vectorstore", type=str, choices=["faiss", "chroma"], default="faiss")
-    parser.add_argument("--metric", type=str, choices=["cosine", "mmr", "bm25"], default="mmr")
+    parser.add_argument("--metric", type=str, choices=["cosine", "mmr", "bm25", "hybrid"], default="mmr")
     parser.add_argument("--retriever_k", type=int, default=20, help="Number of documents to retrieve")
     parser.add_argument("--threshold", type=float, default=0.5, help="Threshold for cosine similarity")
+    parser.add_argument("--batch_size", type=int, default=256, help="Number of queries embedded and searched together")
     parser.add_argument("--reranker_model_name", type=str, default=None)
     parser.add_argument("--reranker_k", type=int, default=50, help="Number of documents to rerank")
 
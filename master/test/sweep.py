@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from ..rag_pipeline import AsyncChatAssistant, get_embeddings, vretrieve_batch
+from ..rag_pipeline.generation.llm_wrapper import set_max_concurrency
+from ..rag_pipeline.generation.rate_limiter import rate_limit_stats
+from ..rag_pipeline.evaluation.runner import run_eval_async, summarize_results, fingerprint
+from ..utils import load_local, load_qa_dataset
+from .eval_qa import build_multichoice_qa_prompt, process_question
+
+# Grid sweep of eval_qa over retrieval and generation parameters, e.g.
+#   python -m master.test.sweep --vectorstore_dirs vs_chunk500 vs_chunk1000 --metrics cosine mmr hybrid \
+#       --retriever_ks 10 20 --num_docs 0 3 5 --models mistral:mistral-small ollama:llama3.1:8b
+# Each vectorstore is loaded and the questions embedded once. Configs differing only in num_docs or model
+# share one retrieval, and the LLM evaluations of all configs run concurrently.
+
+RETRIEVAL_PARAMS = ["vectorstore_dir", "metric", "retriever_k", "reranker"]
+TABLE_COLUMNS = ["vectorstore", "metric", "retriever_k", "reranker", "num_docs", "model", "accuracy", "num_items", "num_failed", "retrieval_ms", "llm_p50", "llm_p95", "total_tokens", "cached"]
+
+def parse_model(model: str):
+    """'provider:model_name', the model name may contain ':' (ollama tags)."""
+    provider, model_name = model.split(":", 1)
+    return provider, model_name
+
+def build_configs(args) -> list:
+    configs = []
+    retrieval_grid = list(itertools.product(args.vectorstore_dirs, args.metrics, args.retriever_ks, args.rerankers))
+    for num_docs, model in itertools.product(args.num_docs, args.models):
+        if num_docs == 0:
+            # Closed-book baseline: the retrieval params do not matter.
+            configs.append({"vectorstore_dir": None, "metric": None, "retriever_k": None, "reranker": None, "num_docs": 0, "model": model})
+            continue
+        for vectorstore_dir, metric, retriever_k, reranker in retrieval_grid:
+            if num_docs > retriever_k:
+                continue
+            configs.append({"vectorstore_dir": vectorstore_dir, "metric": metric, "retriever_k": retriever_k, "reranker": None if reranker == "none" else reranker, "num_docs": num_docs, "model": model})
+    return configs
+
+def config_name(config: dict, args) -> str:
+    """A readable name, plus a hash of everything that changes the results so that sweeps sharing --output_dir never reuse each other's records."""
+    settings = {"qa_file": os.path.abspath(args.qa_file), **config}
+    if config["num_docs"] > 0:
+        settings.update(vectorstore_dir=os.path.abspath(config["vectorstore_dir"]), threshold=args.threshold, reranker_k=args.reranker_k,
+                        embed_model_name=args.embed_model_name, embed_backend=args.embed_backend)
+    suffix = fingerprint(settings)
+    if config["num_docs"] == 0:
+        return f"{config['model'].replace(':', '-')}_0docs_{suffix}".replace("/", "-")
+    vectorstore = os.path.basename(os.path.normpath(config["vectorstore_dir"]))
+    reranker = os.path.basename(config["reranker"]) if config["reranker"] else "none"
+    return f"{vectorstore}_{config['metric']}_k{config['retriever_k']}_{reranker}_{config['model'].replace(':', '-')}_{config['num_docs']}docs_{suffix}".replace("/", "-")
+
+def retrieve_all(configs: list, queries: list, args) -> dict:
+    """
+    Run each distinct retrieval of the grid once.
+    Returns:
+        {retrieval key: (documents per question, retrieval seconds per question)}
+    """
+    keys = list(dict.fromkeys(tuple(config[name] for name in RETRIEVAL_PARAMS) for config in configs if config["num_docs"] > 0))
+    if not keys:
+        return {}
+
+    embed_model = get_embeddings(args.embed_model_name, show_progress=False, batch_size=args.embed_batch_size, backend=args.embed_backend)
+    start = time.perf_counter()
+    query_embeddings = np.array(embed_model.embed_documents(queries), dtype=np.float32)
+    print(f"Embedded {len(queries)} questions in {time.perf_counter() - start:.1f}s")
+
+    retrievals = {}
+    for vectorstore_dir in dict.fromkeys(key[0] for key in keys):
+        vectorstore, docs, bm25_index = load_local(vectorstore_dir, embed_model, mmap=True)
+        if vectorstore is None:
+            raise ValueError(f"No vectorstore found in {vectorstore_dir}.")
+        for key in keys:
+            if key[0] != vectorstore_dir:
+                continue
+            _, metric, retriever_k, reranker = key
+            start = time.perf_counter()
+            results = vretrieve_batch(queries, vectorstore, docs, retriever_k, metric, args.threshold, reranker=reranker, bm25_index=bm25_index, reranker_k=args.reranker_k, batch_size=args.batch_size, query_embeddings=query_embeddings)
+            retrievals[key] = (results, (time.perf_counter() - start) / len(queries))
+            print(f"Retrieved {key} in {retrievals[key][1] * 1000:.2f} ms/question")
+    return retrievals
+
+async def run_config(config: dict, items: list, questions: list, options: list, retrievals: dict, concurrency: int, args) -> dict:
+    provider, model_name = parse_model(config["model"])
+    llm = AsyncChatAssistant(model_name, provider, cache_path=None if args.no_cache else args.cache_path)
+    if config["num_docs"] > 0:
+        docs, retrieval_seconds = retrievals[tuple(config[name] for name in RETRIEVAL_PARAMS)]
+    else:
+        docs, retrieval_seconds = [None] * len(items), 0.0
+    prompts = [build_multichoice_qa_prompt(questions[i], options[i], docs[i][:config["num_docs"]] if docs[i] is not None else None) for i in range(len(items))]
+    run = config_name(config, args)
+    config_items = [{**item, "run": run, "prompt": prompt, "fingerprint": fingerprint(prompt, provider, model_name, llm.sampling_params)} for item, prompt in zip(items, prompts)]
+    results_path = os.path.join(args.output_dir, run + ".jsonl")
+    records = await run_eval_async(config_items, lambda item: process_question(item, args, llm), results_path, concurrency=concurrency, resume=not args.restart)
+    return {**config, **summarize_results(records, len(config_items)), "retrieval_ms": retrieval_seconds * 1000}
+
+async def run_sweep(configs: list, items: list, questions: list, options: list, retrievals: dict, args) -> list:
+    # The configs of a provider split its --concurrency slots, so requests do not queue behind the provider's cap
+    # and the measured LLM latency is the latency of the requests.
+    providers = [parse_model(config["model"])[0] for config in configs]
+    concurrency = {provider: max(1, args.concurrency // providers.count(provider)) for provider in set(providers)}
+    return await asyncio.gather(*(run_config(config, items, questions, options, retrievals, concurrency[provider], args) for config, provider in zip(configs, providers)))
+
+def format_table(rows: list) -> str:
+    cells = []
+    for row in rows:
+        row = {**row, "vectorstore": os.path.basename(os.path.normpath(row["vectorstore_dir"])) if row["vectorstore_dir"] else "-", "llm_p50": row.get("latency_p50"), "llm_p95": row.get("latency_p95")}
+        cells.append([f"{row.get(name):.4f}" if isinstance(row.get(name), float) else ("-" if row.get(name) is None else str(row.get(name))) for name in TABLE_COLUMNS])
+    widths = [max(len(name), *(len(row[i]) for row in cells)) for i, name in enumerate(TABLE_COLUMNS)]
+    lines = ["  ".join(name.rjust(width) for name, width in zip(TABLE_COLUMNS, widths))]
+    lines += ["  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in cells]
+    return "\n".join(lines)
+
+def main(args):
+    ids, questions, options, answers = load_qa_dataset(args.qa_file)
+    if ids is None:
+        raise ValueError(f"No id field in {args.qa_file}.")
+    items = [{"id": ids[i], "answer": answers[i]} for i in range(len(questions))]
+
+    configs = build_configs(args)
+    print(f"{len(configs)} configs")
+    queries = [f"Question: {questions[i]}\n{options[i]}" for i in range(len(questions))]
+    retrievals = retrieve_all(configs, queries, args)
+
+    for provider in dict.fromkeys(parse_model(model)[0] for model in args.models):
+        set_max_concurrency(provider, args.concurrency)
+    os.makedirs(args.output_dir, exist_ok=True)
+    rows = asyncio.run(run_sweep(configs, items, questions, options, retrievals, args))
+    rows.sort(key=lambda row: -row.get("accuracy", 0.0))
+
+    print(format_table(rows))
+    with open(os.path.join(args.output_dir, "sweep.jsonl"), "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+    print(f"Rate limits: {rate_limit_stats()}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--qa_file", type=str, default="dataset/QA Data/MedMCQA/translated_hard_questions.jsonl")
+    parser.add_argument("--output_dir", type=str, default="eval_results/sweep", help="Per-config results (resumable) and sweep.jsonl")
+
+    # Grid
+    parser.add_argument("--vectorstore_dirs", type=str, nargs="+", default=["notebook/An/master/knowledge/vectorstore_full"], help="One vectorstore per chunking setup")
+    parser.add_argument("--metrics", type=str, nargs="+", choices=["cosine", "mmr", "bm25", "hybrid"], default=["mmr"])
+    parser.add_argument("--retriever_ks", type=int, nargs="+", default=[20])
+    parser.add_argument("--rerankers", type=str, nargs="+", default=["none"], help="Cross-encoder model names, 'none' for no reranking")
+    parser.add_argument("--num_docs", type=int, nargs="+", default=[0, 3, 5], help="Documents put in the prompt, 0 for closed book")
+    parser.add_argument("--models", type=str, nargs="+", default=["mistral:mistral-medium"], help="provider:model_name")
+
+    # Fixed params
+    parser.add_argument("--embed_model_name", type=str, default="alibaba-nlp/gte-multilingual-base")
+    parser.add_argument("--embed_batch_size", type=int, default=64)
+    parser.add_argument("--embed_backend", type=str, choices=["torch", "onnx", "quantized"], default="torch")
+    parser.add_argument("--threshold", type=float, default=0.5, help="Threshold for cosine similarity")
+    parser.add_argument("--reranker_k", type=int, default=50, help="Number of documents to rerank")
+    parser.add_argument("--batch_size", type=int, default=256, help="Number of queries searched together")
+    parser.add_argument("--concurrency", type=int, default=64, help="Max requests in flight per provider, shared by its configs")
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--cache_path", type=str, default="llm_cache.sqlite")
+    parser.add_argument("--no_cache", action="store_true", default=False)
+    parser.add_argument("--restart", action="store_true", default=False, help="Discard the results of previous runs instead of resuming them")
+    parser.add_argument("--log_path", type=str, default="eval_log.jsonl", help="JSONL log of the prompts and responses, written in the background")
+
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
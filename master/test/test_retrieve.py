@@ -1,17 +1,15 @@
 import argparse
 import os
 
-from ..rag_pipeline import get_embeddings, rerank
+from ..rag_pipeline import get_embeddings
 from ..utils import load_local
 
 from ..rag_pipeline import vretrieve
 
 def main(args):
     embed_model = get_embeddings(args.embed_model_name)
-    vectorstore, docs = load_local(args.vectorstore_dir, embed_model)
-    retrieve_results = vretrieve(args.query, vectorstore, docs, args.retriever_k, args.metric, args.threshold)
-    
-    retrieve_results = rerank(retrieve_results)
+    vectorstore, docs, bm25_index = load_local(args.vectorstore_dir, embed_model)
+    retrieve_results = vretrieve(args.query, vectorstore, docs, args.retriever_k, args.metric, args.threshold, reranker=args.reranker_model_name, bm25_index=bm25_index, reranker_k=args.reranker_k)
 
     print(retrieve_results)
 
@@ -28,7 +26,7 @@ if __name__ == '__main__':
 
     # Vectorstore retriever params
     parser.add_argument("--vectorstore", type=str, choices=["faiss", "chroma"], default="faiss")
-    parser.add_argument("--metric", type=str, choices=["cosine", "mmr", "bm25"], default="cosine")
+    parser.add_argument("--metric", type=str, choices=["cosine", "mmr", "bm25", "hybrid"], default="cosine")
     parser.add_argument("--retriever_k", type=int, default=4, help="Number of documents to retrieve")
     parser.add_argument("--threshold", type=float, default=0.7, help="Threshold for cosine similarity")
     parser.add_argument("--reranker_model_name", type=str, default=None)
@@ -6,58 +6,115 @@ from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain.schema import Document
 
+from .rag_pipeline.indexing.bm25.bm25 import BM25Index
+from .rag_pipeline.indexing.ann.ann import load_index_config, set_search_params, ensure_direct_map, read_index
+from .rag_pipeline.indexing.chunk_store.chunk_store import ChunkStore, ChunkDocstore, RowIds
 
-def load_local(vectorstore_dir: str, embed_model: HuggingFaceEmbeddings) -> tuple[Optional[FAISS], Optional[List[Document]]]:
+BM25_DIR_NAME = "bm25"
+CHUNK_STORE_DIR_NAME = "chunks"
+INDEX_NAME = "index.faiss"
+
+def load_local(vectorstore_dir: str, embed_model: HuggingFaceEmbeddings, nprobe: Optional[int] = None, ef_search: Optional[int] = None, mmap: bool = False) -> tuple[Optional[FAISS], Optional[List[Document]], Optional[BM25Index]]:
     """
-    Load the vectorstore and documents from disk.
+    Load the vectorstore, documents and BM25 index from disk.
     Args:
         vectorstore_dir: The directory to load the vectorstore from.
         embed_model: The embedding model to use.
+        nprobe: Override the saved number of IVF lists visited per query.
+        ef_search: Override the saved HNSW search beam width.
+        mmap: Memory-map the index and the chunk store, chunks are then decoded on access.
+            The vectorstore is read-only. Meant for serving, several workers share the same pages.
     Returns:
         vector_store: The vectorstore.
+        docs: The documents, docs[i] being the chunk at row i of the index (a lazy ChunkStore with mmap).
+        bm25_index: The memory-mapped BM25 index.
     """
+    from langchain_community.docstore.in_memory import InMemoryDocstore
     from langchain_community.vectorstores import FAISS
 
     if not os.path.isdir(vectorstore_dir):
         print(f"Vectorstore directory not found at {vectorstore_dir}. Creating a new one.")
         os.makedirs(vectorstore_dir, exist_ok=True)
-        
+
+    chunk_store_dir = os.path.join(vectorstore_dir, CHUNK_STORE_DIR_NAME)
+    legacy = not os.path.isdir(chunk_store_dir) and os.path.exists(os.path.join(vectorstore_dir, "index.pkl"))
+    if legacy and mmap:
+        print(f"Warning: No chunk store in {vectorstore_dir}, mmap loading is not available.")
+        mmap = False
+
     try:
-        vector_store = FAISS.load_local(vectorstore_dir, embed_model, allow_dangerous_deserialization=True)
-        
-        docs_path = os.path.join(vectorstore_dir, "docs.pkl")
-        if os.path.exists(docs_path):
-            with open(docs_path, "rb") as f:
-                docs = pickle.load(f)
+        index_config = load_index_config(vectorstore_dir)
+        if legacy:
+            print(f"Warning: Loading the pickled docstore of {vectorstore_dir}. Re-save the vectorstore to convert it to a chunk store.")
+            vector_store = FAISS.load_local(vectorstore_dir, embed_model, allow_dangerous_deserialization=True)
+            docs_path = os.path.join(vectorstore_dir, "docs.pkl")
+            if os.path.exists(docs_path):
+                with open(docs_path, "rb") as f:
+                    docs = pickle.load(f)
+            else:
+                docs = None
+                print("Warning: docs.pkl not found. BM25 search will not be available.")
         else:
-            docs = None 
-            print("Warning: docs.pkl not found. BM25 search will not be available.")
+            chunks = ChunkStore.load(chunk_store_dir, mmap=mmap)
+            index = read_index(os.path.join(vectorstore_dir, INDEX_NAME), index_config["index_type"], mmap=mmap)
+            if mmap:
+                docs = chunks
+                vector_store = FAISS(embedding_function=embed_model, index=index, docstore=ChunkDocstore(chunks), index_to_docstore_id=RowIds(len(chunks)))
+            else:
+                # The docs list and the docstore share the Document objects.
+                docs = list(chunks)
+                for i, doc in enumerate(docs):
+                    doc.id = doc.id or str(i)  # Stores converted from the pickled format may lack chunk ids.
+                docstore = InMemoryDocstore({doc.id: doc for doc in docs})
+                vector_store = FAISS(embedding_function=embed_model, index=index, docstore=docstore, index_to_docstore_id={i: doc.id for i, doc in enumerate(docs)})
+        ensure_direct_map(vector_store.index)
+        set_search_params(
+            vector_store.index,
+            nprobe=nprobe if nprobe is not None else index_config.get("nprobe"),
+            ef_search=ef_search if ef_search is not None else index_config.get("ef_search"),
+        )
+
+        bm25_index = None
+        bm25_dir = os.path.join(vectorstore_dir, BM25_DIR_NAME)
+        if os.path.isdir(bm25_dir):
+            bm25_index = BM25Index.load(bm25_dir, mmap=True)
+        elif docs is not None:
+            print(f"Warning: BM25 index not found at {bm25_dir}. Building it in memory, re-save the vectorstore to persist it.")
+            bm25_index = BM25Index.from_documents(docs)
 
         print(f"Successfully loaded RAG state from {vectorstore_dir}")
-        return vector_store, docs
+        return vector_store, docs, bm25_index
     except Exception as e:
         print(f"Could not load from {vectorstore_dir}. It might be empty or corrupted. Error: {e}")
-        return None, None
+        return None, None, None
 
-def save_local(vectorstore_dir: str, vectorstore: FAISS, docs: Optional[List[Document]]) -> None:
+def save_local(vectorstore_dir: str, vectorstore: FAISS, docs: Optional[List[Document]] = None) -> None:
     """
-    Save the vectorstore and documents to disk.
+    Save the index, the chunk store and the BM25 index to disk.
+    The chunk store replaces both docs.pkl and the pickled FAISS docstore (index.pkl).
     Args:
         vectorstore_dir: The directory to save the vectorstore to.
         vectorstore: The vectorstore to save.
-        docs: The documents to save.
+        docs: The documents to save, docs[i] being the chunk at row i of the index. Read from the docstore if not given.
     """
+    import faiss
+
     if vectorstore is None:
         raise ValueError("Nothing to save.")
     if docs is None:
-        print("Warning: No documents to save. BM25 search will not be available.")
-    
+        docs = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in range(vectorstore.index.ntotal)]
+    if len(docs) != vectorstore.index.ntotal:
+        raise ValueError(f"Got {len(docs)} documents for {vectorstore.index.ntotal} vectors, docs[i] must be the chunk at row i of the index.")
+
     os.makedirs(vectorstore_dir, exist_ok=True)
-    vectorstore.save_local(vectorstore_dir)
-    
-    if docs is not None:
-        with open(os.path.join(vectorstore_dir, "docs.pkl"), "wb") as f:
-            pickle.dump(docs, f)
+    faiss.write_index(vectorstore.index, os.path.join(vectorstore_dir, INDEX_NAME))
+    ChunkStore.from_documents(docs).save(os.path.join(vectorstore_dir, CHUNK_STORE_DIR_NAME))
+    BM25Index.from_documents(docs).save(os.path.join(vectorstore_dir, BM25_DIR_NAME))
+    # Superseded by the chunk store.
+    for legacy_name in ("index.pkl", "docs.pkl"):
+        legacy_path = os.path.join(vectorstore_dir, legacy_name)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
 
     print(f"Successfully saved RAG state to {vectorstore_dir}")
 